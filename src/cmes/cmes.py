@@ -18,6 +18,51 @@ class MissmatchInTimes(Exception):
         super().__init__(self.message)
 
 
+def calculate_approximate_linear_times_at_sun_centre(
+    detection_epochs, linear_speeds, seen_only_in
+) -> np.ndarray:
+    """
+    Vectorized version of CME.calculateApproximateLinearTimeAtSunCentre for a
+    whole catalogue. Takes detection times as unix epochs (s), linear speeds in
+    km/s and the SEEN_ONLY_IN flags, and returns the back-projected times as
+    unix epochs (s).
+
+    CMEs without a valid (positive) linear speed keep their detection time.
+    """
+    detection_epochs = np.asarray(detection_epochs, dtype=float)
+    linear_speeds = np.asarray(linear_speeds, dtype=float)
+    seen_only_in = np.asarray(seen_only_in)
+
+    # Seen only in C3 then assume the detection time is at the edge of C3
+    distances = np.where(
+        seen_only_in == 2, (3.7 * u.Rsun).to_value(u.km), (1.5 * u.Rsun).to_value(u.km)
+    )
+
+    valid_speed = np.isfinite(linear_speeds) & (linear_speeds > 0)
+
+    travel_times = np.zeros_like(detection_epochs)
+    travel_times[valid_speed] = distances[valid_speed] / linear_speeds[valid_speed]
+
+    return detection_epochs - travel_times
+
+
+def get_pa_diffs(position_angles, cme_pas, halo) -> np.ndarray:
+    """
+    Vectorized version of CME.get_pa_diff for arrays of position angles and
+    the PA and halo flag of the CME of each one. NaN for halo CMEs.
+    """
+    angle_dists_to_PA = np.abs(
+        np.asarray(position_angles, dtype=float) - np.asarray(cme_pas, dtype=float)
+    )
+
+    # If the angle distance is larger than 180, then take the other side (360 - >180) is the smaller angle.
+    angle_dists_to_PA = np.where(
+        angle_dists_to_PA > 180, 360 - angle_dists_to_PA, angle_dists_to_PA
+    )
+
+    return np.where(np.asarray(halo, dtype=bool), np.nan, angle_dists_to_PA)
+
+
 class CME:
     def __init__(self, date, PA, width, linear_speed = None, halo: bool = False, seen_only_in: int = 0):
 
@@ -64,7 +109,13 @@ class CME:
         if self.HALO:
             return np.nan
 
-        angle_dist_to_PA = np.abs(bbox.get_position_angle() - self.PA)
+        return self.get_pa_diff(bbox.get_position_angle())
+
+    def get_pa_diff(self, position_angle):
+        if self.HALO:
+            return np.nan
+
+        angle_dist_to_PA = np.abs(position_angle - self.PA)
 
         # If the angle distance is larger than 180, then take the other side (360 - >180) is the smaller angle.
         if angle_dist_to_PA > 180:
@@ -99,3 +150,183 @@ class CME:
             return True, rotated, rotated_by, final_harps
         else:
             return False, rotated, rotated_by, final_harps
+
+
+class CMEBatch:
+    """
+    Columnar version of CME for a whole catalogue. Holds the detection epochs,
+    PAs, widths, halo flags, SEEN_ONLY_IN flags and linear speeds as arrays and
+    works on arrays of (CME, bounding box) pairs, with the same semantics as
+    CME.hasHarpsSpatialCoOcurrence.
+
+    Halo CMEs have a NaN PA and CMEs without linear speed a NaN speed.
+    """
+
+    HALO_MAX_DIST_TO_SUN_CENTRE = 0.2  # How far harps can be from Sun centre to be consistent with HALO CME
+    WIDTH_EXTRA_ANGLE = 10  # Extra angle to sides of CME for Spatial co-ocurrence
+
+    def __init__(self, dates, PA, width, linear_speed=None, halo=None, seen_only_in=None):
+        self.DATES = Time(dates, format="iso")
+        self.EPOCHS = np.atleast_1d(self.DATES.unix)
+        n_cmes = len(self.EPOCHS)
+
+        self.WIDTH = np.atleast_1d(np.asarray(width, dtype=float))
+
+        if halo is None:
+            self.HALO = np.zeros(n_cmes, dtype=bool)
+        else:
+            self.HALO = np.atleast_1d(np.asarray(halo, dtype=bool))
+
+        # Halo CMEs may come with a PA (or None), it's ignored
+        PA = np.atleast_1d(np.array(PA, dtype=object))
+        PA[self.HALO | np.equal(PA, None)] = np.nan
+        self.PA = np.where(self.HALO, np.nan, PA.astype(float))
+
+        if linear_speed is None:
+            self.LINEAR_SPEED = np.full(n_cmes, np.nan)
+        else:
+            linear_speed = np.atleast_1d(np.array(linear_speed, dtype=object))
+            linear_speed[np.equal(linear_speed, None)] = np.nan
+            self.LINEAR_SPEED = linear_speed.astype(float)
+
+        if seen_only_in is None:
+            self.SEEN_ONLY_IN = np.zeros(n_cmes, dtype=int)
+        else:
+            self.SEEN_ONLY_IN = np.atleast_1d(np.asarray(seen_only_in, dtype=int))
+
+        self.validate()
+
+        # NaN for the CMEs without linear speed
+        self.LINEAR_TIME_AT_SUN_CENTER = np.where(
+            np.isnan(self.LINEAR_SPEED),
+            np.nan,
+            calculate_approximate_linear_times_at_sun_centre(
+                self.EPOCHS, self.LINEAR_SPEED, self.SEEN_ONLY_IN
+            ),
+        )
+
+    @classmethod
+    def from_catalogue(cls, catalogue):
+        """
+        Builds the batch from the parsed LASCO CME catalogue (a DataFrame with
+        the CME_* columns).
+        """
+        return cls(
+            dates=catalogue["CME_DATE"].to_list(),
+            PA=catalogue["CME_PA"].to_numpy(dtype=float),
+            width=catalogue["CME_WIDTH"].to_numpy(dtype=float),
+            linear_speed=catalogue["CME_LINEAR_SPEED"].to_numpy(dtype=float),
+            halo=catalogue["CME_HALO"].to_numpy(dtype=bool),
+            seen_only_in=catalogue["CME_SEEN_IN"].to_numpy(dtype=int),
+        )
+
+    def __len__(self):
+        return len(self.EPOCHS)
+
+    def validate(self) -> None:
+        """
+        Same checks as CME, on all the CMEs at once. Raises ValueError naming
+        the first invalid CME.
+        """
+        n_cmes = len(self.EPOCHS)
+
+        for name, values in [
+            ("widths", self.WIDTH),
+            ("PAs", self.PA),
+            ("halo flags", self.HALO),
+            ("linear speeds", self.LINEAR_SPEED),
+            ("SEEN_ONLY_IN flags", self.SEEN_ONLY_IN),
+        ]:
+            if len(values) != n_cmes:
+                raise ValueError(f"Got {len(values)} {name} for {n_cmes} CMEs")
+
+        too_wide = np.flatnonzero(self.WIDTH > 360)
+
+        if len(too_wide) > 0:
+            raise ValueError(
+                f"Width {self.WIDTH[too_wide[0]]} must be <= 360 deg. (CME {too_wide[0]})"
+            )
+
+        # NaN comparisons are False, so a missing PA is also invalid
+        bad_PA = np.flatnonzero(~self.HALO & ~((0 <= self.PA) & (self.PA <= 360)))
+
+        if len(bad_PA) > 0:
+            raise ValueError(
+                f"Principal angle {self.PA[bad_PA[0]]} must be within 0 and 360 (CME {bad_PA[0]})"
+            )
+
+    def get_pa_diff(self, position_angles, cme_indices) -> np.ndarray:
+        return get_pa_diffs(position_angles, self.PA[cme_indices], self.HALO[cme_indices])
+
+    def get_bbox_pa_diff(self, bboxes, cme_indices) -> np.ndarray:
+        """
+        PA difference between each bounding box of a BoundingBoxArray and the
+        CME of the pair. NaN for halo CMEs.
+        """
+        return self.get_pa_diff(bboxes.get_position_angle(), cme_indices)
+
+    def rotate_bboxes(self, cme_indices, bboxes, max_time_diff=12 * u.min) -> tuple:
+        """
+        Rotates the boxes of pairs (cme_indices[i], bboxes[i]) (with one date
+        per box) more than max_time_diff away from their CME to the CME time,
+        in one batch. Rotations giving an invalid box (see
+        BoundingBoxArray.is_valid) keep the original box.
+
+        Returns the arrays (rotated, time_diffs), with the time differences in
+        minutes, and the final BoundingBoxArray.
+        """
+        cme_indices = np.atleast_1d(np.asarray(cme_indices, dtype=np.int64))
+        cme_dates = self.DATES[cme_indices]
+
+        time_diffs = (cme_dates - bboxes.DATE).to_value(u.min)
+        rotated = np.abs(time_diffs) > max_time_diff.to_value(u.min)
+
+        final_bboxes = bboxes[np.arange(len(bboxes))]
+        to_rotate = np.flatnonzero(rotated)
+
+        if len(to_rotate) > 0:
+            rotated_bboxes = bboxes[to_rotate].rotate_bbox(cme_dates[to_rotate])
+
+            valid = rotated_bboxes.is_valid()
+            rotated[to_rotate[~valid]] = False
+            rotated_bboxes = rotated_bboxes[valid]
+            to_rotate = to_rotate[valid]
+
+            final_bboxes.LON_MIN[to_rotate] = rotated_bboxes.LON_MIN
+            final_bboxes.LAT_MIN[to_rotate] = rotated_bboxes.LAT_MIN
+            final_bboxes.LON_MAX[to_rotate] = rotated_bboxes.LON_MAX
+            final_bboxes.LAT_MAX[to_rotate] = rotated_bboxes.LAT_MAX
+            final_bboxes.DATE[to_rotate] = cme_dates[to_rotate]
+
+        return rotated, time_diffs, final_bboxes
+
+    def hasHarpsSpatialCoOcurrence(self, cme_indices, bboxes, max_time_diff=12 * u.min) -> tuple:
+        """
+        CME.hasHarpsSpatialCoOcurrence for pairs (cme_indices[i], bboxes[i]).
+        The boxes are rotated with rotate_bboxes, so a rotation giving an
+        invalid box keeps the original box and the pair is not rotated (CME
+        raises InvalidBoundingBox instead).
+
+        Returns arrays (has_harps, rotated, rotated_by) and the final
+        BoundingBoxArray.
+        """
+        cme_indices = np.atleast_1d(np.asarray(cme_indices, dtype=np.int64))
+
+        rotated, time_diffs, final_bboxes = self.rotate_bboxes(
+            cme_indices, bboxes, max_time_diff
+        )
+        rotated_by = np.where(rotated, time_diffs, 0)
+
+        halo = self.HALO[cme_indices]
+
+        # As in CME, halo CMEs use the distance of the original boxes
+        halo_consistent = bboxes.get_distance_to_sun_centre() < self.HALO_MAX_DIST_TO_SUN_CENTRE
+
+        with np.errstate(invalid="ignore"):
+            pa_consistent = self.get_bbox_pa_diff(final_bboxes, cme_indices) < (
+                (self.WIDTH[cme_indices] + self.WIDTH_EXTRA_ANGLE) / 2
+            )
+
+        has_harps = np.where(halo, halo_consistent, pa_consistent)
+
+        return has_harps, rotated, rotated_by, final_bboxes
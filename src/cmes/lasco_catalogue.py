@@ -0,0 +1,431 @@
+"""
+Parser of the fixed-width text format of the LASCO CME catalogue (univ_all.txt)
+into the LASCO CME database .csv. IDs are generated from the date, time and PA.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+HEADER_LINES = 4
+
+# Data columns are the first 101 characters of a line, the rest is the comment
+DATA_WIDTH = 101
+
+# The data fields are right aligned and end at these columns, each one in its
+# own slot between the end of the previous one and its own end
+FIELD_ENDS = [10, 20, 26, 32, 40, 48, 56, 64, 73, 83, 93, DATA_WIDTH]
+
+DATA_COLUMNS = [
+    "CME_DATE",
+    "CME_TIME",
+    "CME_PA",
+    "CME_WIDTH",
+    "CME_LINEAR_SPEED",
+    "CME_2ND_ORDER_INITIAL_SPEED",
+    "CME_2ND_ORDER_FINAL_SPEED",
+    "CME_2ND_ORDER_20R_SPEED",
+    "CME_ACCELERATION",
+    "CME_MASS",
+    "CME_KINETIC_ENERGY",
+    "CME_MPA",
+]
+
+OUTPUT_COLUMNS = [
+    "CME_ID",
+    "CME_DATE",
+    "CME_PA",
+    "CME_WIDTH",
+    "CME_LINEAR_SPEED",
+    "CME_2ND_ORDER_INITIAL_SPEED",
+    "CME_2ND_ORDER_FINAL_SPEED",
+    "CME_2ND_ORDER_20R_SPEED",
+    "CME_ACCELERATION",
+    "CME_MASS",
+    "CME_KINETIC_ENERGY",
+    "CME_MPA",
+    "CME_HALO",
+    "CME_SEEN_IN",
+    "CME_QUALITY",
+    "CME_THREE_POINTS",
+]
+
+
+def split_catalogue_lines(text: str) -> list:
+    """
+    Lines of (part of) the catalogue, without line breaks. Line breaks are
+    handled like when reading the file in text mode.
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
+    # A file ending with a line break leaves an empty last element
+    if len(lines) > 0 and lines[-1] == "":
+        lines = lines[:-1]
+
+    return lines
+
+
+def read_catalogue_lines(path: str) -> list:
+    """
+    Reads the catalogue in one go and returns its lines, without the header
+    and the line breaks.
+    """
+    with open(path, "r") as file:
+        lines = split_catalogue_lines(file.read())
+
+    return lines[HEADER_LINES:]
+
+
+def parse_lasco_lines_per_line(lines: list) -> pd.DataFrame:
+    """
+    Parses catalogue lines (no header) one by one, in Python. Used for the
+    lines parse_lasco_lines_columns doesn't handle.
+    """
+    rows = []  # List of all rows
+
+    for line in lines:
+        comment = line[DATA_WIDTH:]
+        raw_columns = line[:DATA_WIDTH].split()
+
+        if len(raw_columns) == 0:
+            continue
+
+        # Some data may be missing (represented by ---- in the file).
+        no_missing_values_columns = [column.replace("-", "") for column in raw_columns]
+
+        # Non_reliable measurements of acceleration or mass and kinetic energy
+        # measurements with large uncertainties are marked with a *. We remove these as well.
+        non_reliable_removed_columns = [
+            "" if "*" in column else column for column in no_missing_values_columns
+        ]
+
+        # Now, Halo CMES have the word "Halo" in the "Width column". For those, we change the width to "" and add a halo flag
+        processed_columns = []
+        halo = 0
+        for column in non_reliable_removed_columns:
+            if "Halo" in column:
+                processed_columns.append("")
+                halo = 1
+            else:
+                processed_columns.append(column)
+
+        if "Only C2" in comment:
+            seen_in = 1
+        elif "Only C3" in comment:
+            seen_in = 2
+        else:
+            seen_in = 0
+
+        # Order of conditions important. FIRST check "Very Poor", THEN check "Poor".
+        if "Very Poor" in comment:
+            quality = 2
+        elif "Poor" in comment:
+            quality = 1
+        else:
+            quality = 0
+
+        n_points = re.search(r"Only (\d) points", comment)
+        three_points = n_points.group(1) if n_points else 0
+
+        original_id = f"ID{processed_columns[0].replace('/','')}{processed_columns[1].replace(':','')}"
+        pa_id = (
+            f"{int(processed_columns[2]):03}"
+            if len(processed_columns[2]) > 0
+            else "999"
+        )
+
+        rows.append(
+            [
+                original_id + pa_id,
+                f"{processed_columns[0].replace('/','-')} {processed_columns[1]}",  # ISO
+                *processed_columns[2:12],
+                halo,
+                seen_in,
+                quality,
+                three_points,
+            ]
+        )
+
+    # Object columns, so that a line missing fields doesn't turn the integer
+    # flags of the other lines into floats
+    return pd.DataFrame(rows, columns=OUTPUT_COLUMNS, dtype=object)
+
+
+def get_comment_flags(comment: str) -> str:
+    """
+    seen_in, quality and three_points flags of a comment, as in
+    parse_lasco_lines_per_line, formatted as the end of a CSV row.
+    """
+    if "Only C2" in comment:
+        seen_in = 1
+    elif "Only C3" in comment:
+        seen_in = 2
+    else:
+        seen_in = 0
+
+    # Order of conditions important. FIRST check "Very Poor", THEN check "Poor".
+    if "Very Poor" in comment:
+        quality = 2
+    elif "Poor" in comment:
+        quality = 1
+    else:
+        quality = 0
+
+    n_points = re.search(r"Only (\d) points", comment)
+    three_points = n_points.group(1) if n_points else 0
+
+    return f"{seen_in},{quality},{three_points}"
+
+
+def _process_field(field: str) -> tuple:
+    """
+    Value of a data field as in parse_lasco_lines_per_line, and whether it
+    marks a halo CME.
+    """
+    value = field.replace("-", "")
+
+    if "*" in value:
+        value = ""
+
+    if "Halo" in value:
+        return "", True
+
+    return value, False
+
+
+def _get_pa_id(pa: str):
+    """
+    PA part of the CME ID, None if the PA isn't an integer.
+    """
+    if len(pa) == 0:
+        return "999"
+
+    try:
+        return f"{int(pa):03}"
+    except ValueError:
+        return None
+
+
+def lasco_lines_to_csv(lines: list) -> bytes:
+    """
+    Parses catalogue lines (no header) straight into the contents of the LASCO
+    CME database .csv, header included.
+
+    The data fields are sliced at the fixed columns of the catalogue
+    (FIELD_ENDS) for all the lines at once, and every distinct field or
+    comment is only processed once. A line that doesn't fit that layout (non
+    ASCII data, a slot without exactly one field, a field running into the
+    next slot, a PA that isn't an integer or characters that need quoting in
+    a CSV) goes through parse_lasco_lines_per_line, on its own.
+    """
+    lines = [line for line in lines if line[:DATA_WIDTH] != "" and not line[:DATA_WIDTH].isspace()]
+    n_lines = len(lines)
+
+    data = [line[:DATA_WIDTH].ljust(DATA_WIDTH) for line in lines]
+    regular = np.ones(n_lines, dtype=bool)
+
+    text = "".join(data)
+    if not text.isascii() or "\0" in text:
+        regular = np.array([row.isascii() and "\0" not in row for row in data], dtype=bool)
+        text = "".join(row if is_regular else " " * DATA_WIDTH for row, is_regular in zip(data, regular))
+
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8).reshape(n_lines, DATA_WIDTH)
+
+    values = []
+    halo = np.zeros(n_lines, dtype=bool)
+    previous_ends_with_space = np.ones(n_lines, dtype=bool)
+
+    for start, end in zip([0] + FIELD_ENDS[:-1], FIELD_ENDS):
+        slots = np.ascontiguousarray(chars[:, start:end]).view(f"S{end - start}").ravel()
+        codes, unique_slots = pd.factorize(slots)
+        unique_slots = [slot.decode("ascii").ljust(end - start) for slot in unique_slots]
+
+        unique_fields = [slot.split() for slot in unique_slots]
+        processed_fields = [
+            _process_field(fields[0]) if len(fields) == 1 else ("", False) for fields in unique_fields
+        ]
+
+        # A field running into the next slot would be split in two
+        regular &= np.array([len(fields) == 1 for fields in unique_fields], dtype=bool)[codes]
+        regular &= previous_ends_with_space | np.array([slot[0].isspace() for slot in unique_slots], dtype=bool)[codes]
+        previous_ends_with_space = np.array([slot[-1].isspace() for slot in unique_slots], dtype=bool)[codes]
+
+        unique_values = np.array([value for value, _ in processed_fields], dtype=object)
+        regular &= ~np.array([("," in value) or ('"' in value) for value in unique_values], dtype=bool)[codes]
+
+        halo |= np.array([is_halo for _, is_halo in processed_fields], dtype=bool)[codes]
+        values.append((codes, unique_values))
+
+    (date_codes, dates), (time_codes, times), (pa_codes, pas) = values[:3]
+
+    pa_ids = np.array([_get_pa_id(pa) for pa in pas], dtype=object)
+    regular &= np.array([pa_id is not None for pa_id in pa_ids], dtype=bool)[pa_codes]
+
+    comment_codes, comments = pd.factorize(np.array([line[DATA_WIDTH:] for line in lines], dtype=object))
+    comment_flags = np.array([get_comment_flags(comment) for comment in comments], dtype=object)
+
+    def regular_column(codes, unique_values):
+        return unique_values[codes[regular]]
+
+    cme_ids = (
+        "ID"
+        + regular_column(date_codes, np.array([date.replace("/", "") for date in dates], dtype=object))
+        + regular_column(time_codes, np.array([time.replace(":", "") for time in times], dtype=object))
+        + regular_column(pa_codes, pa_ids)
+    )
+    iso_dates = (
+        regular_column(date_codes, np.array([date.replace("/", "-") for date in dates], dtype=object))
+        + " "
+        + regular_column(time_codes, times)
+    )
+
+    rows = np.empty(n_lines, dtype=object)
+    rows[regular] = [
+        ",".join(row)
+        for row in zip(
+            cme_ids,
+            iso_dates,
+            *[regular_column(codes, unique_values) for codes, unique_values in values[2:]],
+            np.where(halo[regular], "1", "0"),
+            regular_column(comment_codes, comment_flags),
+        )
+    ]
+
+    if not np.all(regular):
+        irregular_lines = [line for line, is_regular in zip(lines, regular) if not is_regular]
+        irregular_csv = parse_lasco_lines_per_line(irregular_lines).to_csv(index=False, header=False)
+        rows[~regular] = irregular_csv.split("\n")[:-1]
+
+    return "".join([",".join(OUTPUT_COLUMNS) + "\n"] + [row + "\n" for row in rows]).encode("utf-8")
+
+
+def parse_lasco_lines(lines: list) -> pd.DataFrame:
+    """
+    Parses catalogue lines (no header) into the LASCO CME database, as it's
+    read back from the .csv file.
+    """
+    return pd.read_csv(io.BytesIO(lasco_lines_to_csv(lines)))
+
+
+def _get_ingest_state(raw_catalogue: bytes, output_size: int) -> dict:
+    """
+    Where the parsed part of the catalogue ends: its size in bytes and the
+    hash of all of it, plus the size of the output database.
+    """
+    return {
+        "offset": len(raw_catalogue),
+        "prefix_hash": hashlib.sha256(raw_catalogue).hexdigest(),
+        "output_size": output_size,
+    }
+
+
+def _is_catalogue_extended(raw_catalogue: bytes, state: dict) -> bool:
+    """
+    Whether the catalogue still starts with the part parsed before, checked
+    from its size and the hash of that whole part. States written before the
+    hash of the whole part was kept are never extended.
+    """
+    if len(raw_catalogue) < state["offset"] or "prefix_hash" not in state:
+        return False
+
+    prefix = raw_catalogue[: state["offset"]]
+
+    return hashlib.sha256(prefix).hexdigest() == state["prefix_hash"]
+
+
+def _save_json(data: dict, path: str) -> None:
+    temporary_path = path + ".tmp"
+
+    with open(temporary_path, "w") as file:
+        json.dump(data, file)
+
+    os.replace(temporary_path, path)
+
+
+def ingest_lasco_cme_catalogue(
+    catalogue_path: str, output_path: str, state_path: str, full_parse: bool = False
+) -> set:
+    """
+    Incremental parse of the catalogue into the database at output_path. The
+    catalogue is append-only in practice, so only the lines after the byte
+    offset where the last ingest stopped are parsed and appended to the
+    database.
+
+    If there is no state, the parsed part of the catalogue changed (the file
+    is shorter or its parsed part has a different hash) or full_parse is
+    True, the whole catalogue is parsed again and the new CMEs are the ones
+    whose ID wasn't in the database.
+
+    Only complete lines are parsed: a last line without a line break may still
+    be being written, it's left for the next ingest. With full_parse the file
+    is taken as complete and its last line is parsed too. Returns the IDs of
+    the new CMEs.
+    """
+    with open(catalogue_path, "rb") as file:
+        raw_catalogue = file.read()
+
+    if not full_parse:
+        raw_catalogue = raw_catalogue[: raw_catalogue.rfind(b"\n") + 1]
+    elif len(raw_catalogue) > 0 and not raw_catalogue.endswith(b"\n"):
+        # The state then records one byte more than the file has, so the next
+        # incremental ingest only resumes once that line is finished
+        raw_catalogue += b"\n"
+
+    state = None
+    if not full_parse and os.path.exists(state_path) and os.path.exists(output_path):
+        with open(state_path, "r") as file:
+            state = json.load(file)
+
+    if state is not None and _is_catalogue_extended(raw_catalogue, state):
+        new_lines = split_catalogue_lines(raw_catalogue[state["offset"] :].decode())
+        new_rows = lasco_lines_to_csv(new_lines).split(b"\n", 1)[1]
+
+        # Rows appended by an ingest interrupted before saving its state are
+        # dropped
+        with open(output_path, "r+b") as file:
+            file.truncate(state["output_size"])
+            file.seek(0, os.SEEK_END)
+            file.write(new_rows)
+            output_size = file.tell()
+
+        new_cmes = pd.read_csv(
+            io.BytesIO(lasco_lines_to_csv([]) + new_rows), usecols=["CME_ID"]
+        )
+        new_ids = set(new_cmes["CME_ID"])
+    else:
+        if os.path.exists(output_path):
+            previous_ids = set(pd.read_csv(output_path, usecols=["CME_ID"])["CME_ID"])
+        else:
+            previous_ids = set()
+
+        lines = split_catalogue_lines(raw_catalogue.decode())[HEADER_LINES:]
+        csv_contents = lasco_lines_to_csv(lines)
+
+        with open(output_path, "wb") as file:
+            file.write(csv_contents)
+
+        output_size = len(csv_contents)
+
+        all_cmes = pd.read_csv(io.BytesIO(csv_contents), usecols=["CME_ID"])
+        new_ids = set(all_cmes["CME_ID"]) - previous_ids
+
+    _save_json(_get_ingest_state(raw_catalogue, output_size), state_path)
+
+    print(f"NEW CMES: {len(new_ids)}")
+
+    return new_ids
+
+
+def save_cme_ids(cme_ids: set, path: str) -> None:
+    """
+    Writes a set of CME IDs to a .csv file with a single CME_ID column.
+    """
+    pd.DataFrame({"CME_ID": sorted(cme_ids)}).to_csv(path, index=False)
+
+
+def read_cme_ids(path: str) -> set:
+    return set(pd.read_csv(path, usecols=["CME_ID"])["CME_ID"])
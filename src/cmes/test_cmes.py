@@ -1,5 +1,6 @@
 import pytest
-from src.cmes.cmes import CME, MissmatchInTimes
+from src.cmes.cmes import CME, CMEBatch, MissmatchInTimes, calculate_approximate_linear_times_at_sun_centre, get_pa_diffs
+from src.cmesrc.classes import BoundingBoxArray
 from src.harps.harps import Harps
 from astropy.time import Time
 import astropy.units as u
@@ -126,3 +127,107 @@ def test_rotated_by_harps_co_ocurrence():
     true_rotated_by = -13 
 
     assert np.isclose(rotated_by, true_rotated_by)
+
+def test_vectorized_linear_time_at_sun_centre():
+    dates = ["2000-12-23 12:00:00", "2000-12-24 03:00:00", "2000-12-25 00:00:00"]
+    speeds = [500, 1200, np.nan]
+    seen_only_in = [0, 2, 0]
+
+    epochs = calculate_approximate_linear_times_at_sun_centre(
+        Time(dates).unix, speeds, seen_only_in
+    )
+
+    true_epochs = [
+        CME(date, PA, WIDTH, linear_speed=speed, seen_only_in=seen).LINEAR_TIME_AT_SUN_CENTER.unix
+        for date, speed, seen in zip(dates[:2], speeds[:2], seen_only_in[:2])
+    ]
+
+    assert np.all([
+        np.allclose(epochs[:2], true_epochs, atol=1e-3),
+        epochs[2] == Time(dates[2]).unix
+        ])
+
+def test_vectorized_pa_diff():
+    position_angles = [10, 350, 180, 100]
+    cme_pas = [350, 10, 0, 100]
+    halo = [False, False, False, True]
+
+    pa_diffs = get_pa_diffs(position_angles, cme_pas, halo)
+
+    true_pa_diffs = [CME(DATE, pa, WIDTH).get_pa_diff(position_angle) for position_angle, pa in zip(position_angles[:3], cme_pas[:3])]
+
+    assert np.all([
+        np.allclose(pa_diffs[:3], true_pa_diffs),
+        np.isnan(pa_diffs[3])
+        ])
+
+def test_cme_batch_spatial_co_ocurrence_matches_cme():
+    dates = [DATE, DATE, "2000-12-24 08:00:00"]
+    pas = [PA, None, 300]
+    widths = [WIDTH, 360, 40]
+    halo = [False, True, False]
+    speeds = [500, None, 800]
+
+    batch = CMEBatch(dates, pas, widths, linear_speed=speeds, halo=halo)
+
+    cme_indices = [0, 0, 0, 1, 1, 2, 2]
+    harps_dates = [HARPS_DATE, "2000-12-23 12:13:00", "2000-12-10 12:13:00", HARPS_DATE, HARPS_DATE, "2000-12-24 07:00:00", "2000-12-24 07:55:00"]
+    bboxes = np.array([
+        [MIN_LON, MIN_LAT, MAX_LON, MAX_LAT],
+        [MIN_LON, MIN_LAT, MAX_LON, MAX_LAT],
+        [MIN_LON, MIN_LAT, MAX_LON, MAX_LAT],
+        [5, 5, 7, 7],
+        [80, 80, 85, 85],
+        [40, 10, 45, 15],
+        [-45, -15, -40, -10],
+        ])
+
+    has_harps, rotated, rotated_by, final_bboxes = batch.hasHarpsSpatialCoOcurrence(
+        cme_indices, BoundingBoxArray(Time(harps_dates), *bboxes.T)
+    )
+
+    expected = [
+        CME(dates[i], pas[i], widths[i], linear_speed=speeds[i], halo=halo[i]).hasHarpsSpatialCoOcurrence(
+            Harps(harps_date, *bbox)
+        )
+        for i, harps_date, bbox in zip(cme_indices, harps_dates, bboxes)
+    ]
+
+    assert np.all([
+        np.all(has_harps == [result[0] for result in expected]),
+        np.all(rotated == [result[1] for result in expected]),
+        np.allclose(rotated_by, [result[2] for result in expected]),
+        np.allclose(final_bboxes.get_raw_bbox(), [result[3].get_raw_bbox() for result in expected]),
+        np.isnan(batch.LINEAR_TIME_AT_SUN_CENTER[1]),
+        np.isclose(batch.LINEAR_TIME_AT_SUN_CENTER[0], CME(DATE, PA, WIDTH, linear_speed=500).LINEAR_TIME_AT_SUN_CENTER.unix)
+        ])
+
+def test_cme_batch_validation():
+    with pytest.raises(ValueError):
+        CMEBatch([DATE, DATE], [PA, PA], [WIDTH, 400])
+
+    with pytest.raises(ValueError):
+        CMEBatch([DATE, DATE], [PA, 361], [WIDTH, WIDTH])
+
+    with pytest.raises(ValueError):
+        CMEBatch([DATE, DATE], [PA, None], [WIDTH, WIDTH])
+
+def test_cme_batch_invalid_rotation_keeps_original_bbox():
+    batch = CMEBatch(["2000-12-20 12:00:00"] * 2, [90, 90], [WIDTH, WIDTH])
+
+    # Rotating the first box half a day takes it across the +-180 deg longitude wrap
+    bboxes = BoundingBoxArray(
+        Time(["2000-12-20 00:00:00"] * 2), [165, 10], [0, 0], [178, 20], [10, 10]
+    )
+
+    rotated, time_diffs, final_bboxes = batch.rotate_bboxes([0, 1], bboxes)
+    _, _, rotated_by, _ = batch.hasHarpsSpatialCoOcurrence([0, 1], bboxes)
+
+    assert np.all([
+        np.all(rotated == [False, True]),
+        np.allclose(time_diffs, 720),
+        np.allclose(rotated_by, [0, 720]),
+        np.allclose(final_bboxes.get_raw_bbox()[0], bboxes.get_raw_bbox()[0]),
+        final_bboxes.DATE[0].iso == "2000-12-20 00:00:00.000",
+        np.all(final_bboxes.is_valid()),
+        ])
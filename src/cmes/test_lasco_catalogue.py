@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import src.cmes.lasco_catalogue as lasco_catalogue
+from src.cmes.lasco_catalogue import (
+    OUTPUT_COLUMNS,
+    ingest_lasco_cme_catalogue,
+    lasco_lines_to_csv,
+    parse_lasco_lines,
+    parse_lasco_lines_per_line,
+)
+
+# Lines in the fixed-width layout of univ_all.txt: halo CMEs, missing values
+# ("----"), non reliable measurements ("*") and all the comment flags
+LINES = [
+    "1996/12/22  10:29:21   180    37     767    ----    1746     820    -2.5*   3.2e+14      ----    320   Poor Event",
+    "2002/12/23  20:40:12    94   262     333    2058    1616     203    13.4*      ----   1.2e+27    346   Only C2",
+    "2003/08/25  16:52:11  Halo   360    1090     219    ----    ----     24.4   2.9e+14   2.9e+29    130   Only C2 Poor Event; Only 3 points",
+    "2004/09/24  02:24:22   270   197    1577    1724    2022    2072      7.7      ----   7.2e+31    194   Only C2",
+    "2009/04/01  07:13:10   100   103    1952    1978    2410     453    -30.3      ----   5.5e+30    278   Very Poor Event",
+    "2010/05/01  09:35:38     9   262     938    ----    2242     406     35.1   2.3e+15   1.6e+29     25   Only C3",
+    "2017/02/22  02:21:16   174    62    1551     519     418     969     -2.2      ----      ----   ----",
+    "2019/01/16  05:52:46    42   119    1943    1410     153    1905    -13.8   2.0e+15   3.3e+31    303   Very Poor Event; Only C3; Only 4 points",
+    "2022/08/12  09:24:47   346   188     147     518    2242    1743     17.0   7.9e+15     ----*     12   Only 2 points; Only 4 points",
+    "",
+    "2023/01/01  00:00:00  Halo   360    ----    ----    ----    ----     ----      ----      ----    ----   Only C3 Very Poor Event",
+]
+
+def per_line_csv(lines):
+    return (
+        ",".join(OUTPUT_COLUMNS) + "\n" + parse_lasco_lines_per_line(lines).to_csv(index=False, header=False)
+    ).encode("utf-8")
+
+def test_vectorized_parser_matches_per_line():
+    assert lasco_lines_to_csv(LINES) == per_line_csv(LINES)
+
+def test_parsed_fields():
+    cmes = parse_lasco_lines(LINES)
+
+    assert np.all([
+        len(cmes) == 10,
+        list(cmes["CME_ID"][:3]) == ["ID19961222102921180", "ID20021223204012094", "ID20030825165211999"],
+        list(cmes["CME_HALO"]) == [0, 0, 1, 0, 0, 0, 0, 0, 0, 1],
+        list(cmes["CME_SEEN_IN"]) == [0, 1, 1, 1, 0, 2, 0, 2, 0, 2],
+        list(cmes["CME_QUALITY"]) == [1, 0, 1, 0, 2, 0, 0, 2, 0, 2],
+        list(cmes["CME_THREE_POINTS"]) == [0, 0, 3, 0, 0, 0, 0, 4, 2, 0],
+        # Missing and non reliable values are empty
+        np.isnan(cmes["CME_2ND_ORDER_INITIAL_SPEED"][0]),
+        np.isnan(cmes["CME_ACCELERATION"][0]),
+        np.isnan(cmes["CME_KINETIC_ENERGY"][8]),
+        np.isnan(cmes["CME_MPA"][6]),
+        np.isnan(cmes["CME_PA"][2]),
+        ])
+
+def test_irregular_lines_parsed_on_their_own(monkeypatch):
+    rng = np.random.default_rng(0)
+
+    # Lines that don't fit the fixed columns: too few fields, non ASCII data,
+    # characters that need quoting in a CSV and fields out of their slot. They
+    # go through the line by line parser, the lines around them don't
+    irregular_lines = [
+        "2005/01/01  00:00:00    10   262     938    ----    2242     406     35.1   2.3e+15   1.6e+29",
+        "2005/01/02  00:00:00   ٣٤   262     938    ----    2242     406     35.1   2.3e+15   1.6e+29     25",
+        "2005/01/03  00:00:00    10   2ñ2     938    ----    2242     406     35.1   2.3e+15   1.6e+29     25",
+        '2005/01/04  00:00:00    10   262     938    ----    2242     406     35.1  "2.3e+15   1.6e+29     25',
+        "2005/01/05  00:00:00    10   262     938    ----    2242     406     35.1   2.3e+15   1.6e+29     25,",
+        "2005/01/06  00:00:00    10   262       938  ----    2242     406     35.1   2.3e+15   1.6e+29     25",
+        "2005/01/07  00:00:00  10 262         938    ----    2242     406     35.1   2.3e+15   1.6e+29     25",
+    ]
+    lines = list(rng.choice(LINES, 200)) + irregular_lines + list(rng.choice(LINES, 50))
+
+    expected_csv = per_line_csv(lines)
+
+    per_line_calls = []
+
+    def spy_per_line(lines):
+        per_line_calls.append(lines)
+        return parse_lasco_lines_per_line(lines)
+
+    monkeypatch.setattr(lasco_catalogue, "parse_lasco_lines_per_line", spy_per_line)
+
+    assert np.all([
+        lasco_lines_to_csv(lines) == expected_csv,
+        per_line_calls == [irregular_lines],
+        ])
+
+def test_no_lines():
+    assert lasco_lines_to_csv([]) == per_line_csv([])
+
+HEADER = "HEADER\n\nDate Time PA Width ...\n\n"
+
+def ingest(tmp_path, contents, full_parse=False):
+    catalogue_path = str(tmp_path / "univ_all.txt")
+
+    with open(catalogue_path, "w") as file:
+        file.write(contents)
+
+    new_ids = ingest_lasco_cme_catalogue(
+        catalogue_path, str(tmp_path / "lasco.csv"), str(tmp_path / "state.json"), full_parse
+    )
+
+    with open(tmp_path / "lasco.csv", "rb") as file:
+        return new_ids, file.read()
+
+def test_resumed_ingest_matches_full_parse(tmp_path):
+    first_lines, new_lines = LINES[:5], LINES[5:]
+
+    first_ids, first_output = ingest(tmp_path, HEADER + "\n".join(first_lines) + "\n")
+
+    # The last appended line is still being written, without a line break
+    appended_ids, appended_output = ingest(
+        tmp_path, HEADER + "\n".join(first_lines + new_lines[:-1]) + "\n" + new_lines[-1][:30]
+    )
+
+    resumed_ids, resumed_output = ingest(tmp_path, HEADER + "\n".join(LINES) + "\n")
+
+    all_ids = set(parse_lasco_lines(LINES)["CME_ID"])
+
+    assert np.all([
+        first_output == lasco_lines_to_csv(first_lines),
+        first_ids == set(parse_lasco_lines(first_lines)["CME_ID"]),
+        appended_output == lasco_lines_to_csv(LINES[:-1]),
+        appended_ids == set(parse_lasco_lines(new_lines[:-1])["CME_ID"]),
+        resumed_output == lasco_lines_to_csv(LINES),
+        resumed_ids == set(parse_lasco_lines(LINES[-1:])["CME_ID"]),
+        first_ids | appended_ids | resumed_ids == all_ids,
+        ])
+
+def test_rewritten_catalogue_is_parsed_again(tmp_path):
+    ingest(tmp_path, HEADER + "\n".join(LINES[:5]) + "\n")
+
+    # The last ingested line changed, the whole catalogue is parsed again
+    rewritten_lines = LINES[:4] + [LINES[4].replace("Very Poor Event", "Only C2")] + LINES[5:]
+
+    new_ids, output = ingest(tmp_path, HEADER + "\n".join(rewritten_lines) + "\n")
+
+    assert np.all([
+        output == lasco_lines_to_csv(rewritten_lines),
+        new_ids == set(parse_lasco_lines(LINES[5:])["CME_ID"]),
+        ])
+
+def test_change_before_last_line_is_parsed_again(tmp_path):
+    ingest(tmp_path, HEADER + "\n".join(LINES[:5]) + "\n")
+
+    # Only the first line changed, the last ingested line is the same
+    rewritten_lines = [LINES[0].replace("Poor Event", "Only C3")] + LINES[1:]
+
+    new_ids, output = ingest(tmp_path, HEADER + "\n".join(rewritten_lines) + "\n")
+
+    assert np.all([
+        output == lasco_lines_to_csv(rewritten_lines),
+        new_ids == set(parse_lasco_lines(LINES[5:])["CME_ID"]),
+        ])
+
+def test_full_parse_refreshes_state(tmp_path, monkeypatch):
+    ingest(tmp_path, HEADER + "\n".join(LINES[:3]) + "\n")
+
+    # The full parse takes the last line as complete, even without a line break
+    full_ids, full_output = ingest(tmp_path, HEADER + "\n".join(LINES[:5]), full_parse=True)
+
+    parsed_lines = []
+
+    def lines_to_csv_spy(lines):
+        parsed_lines.extend(lines)
+        return lasco_lines_to_csv(lines)
+
+    monkeypatch.setattr(lasco_catalogue, "lasco_lines_to_csv", lines_to_csv_spy)
+
+    # Resumed from the state of the full parse
+    resumed_ids, resumed_output = ingest(tmp_path, HEADER + "\n".join(LINES) + "\n")
+    resumed_lines = list(parsed_lines)
+
+    assert np.all([
+        full_output == lasco_lines_to_csv(LINES[:5]),
+        full_ids == set(parse_lasco_lines(LINES[3:5])["CME_ID"]),
+        resumed_output == lasco_lines_to_csv(LINES),
+        resumed_ids == set(parse_lasco_lines(LINES[5:])["CME_ID"]),
+        resumed_lines == LINES[5:],
+        ])
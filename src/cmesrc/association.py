@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def _check_sorted(groups, epochs, name: str) -> None:
+    same_group = groups[1:] == groups[:-1]
+
+    if not np.all((groups[1:] > groups[:-1]) | (same_group & (epochs[1:] >= epochs[:-1]))):
+        raise ValueError(f"{name} must be sorted by group and then by epoch")
+
+
+def associate_events(
+    event_groups,
+    event_epochs,
+    anchor_groups,
+    anchor_epochs,
+    min_before: float,
+    max_before: float,
+    event_ranks=None,
+) -> tuple:
+    """
+    Associates each anchor (e.g. a CME) with at most one event (e.g. a flare or
+    a dimming) of the same group (e.g. HARPS) that happened between min_before
+    and max_before seconds before it, both excluded.
+
+    Each event is used once: it is claimed by the first anchor of its group
+    whose window contains it, whether or not that anchor ends up choosing it.
+    Out of the events it claimed, each anchor chooses the one with the lowest
+    rank (e.g. minus the flare class score), then the closest in time and then
+    the last one.
+
+    Events and anchors must be sorted by group and then by (integer) epoch,
+    all the groups are associated in one call. Returns (index of the event of
+    each anchor, anchor epoch - event epoch), both -1 for the anchors without
+    an event.
+    """
+    event_groups = np.atleast_1d(np.asarray(event_groups))
+    event_epochs = np.atleast_1d(np.asarray(event_epochs, dtype=np.int64))
+    anchor_groups = np.atleast_1d(np.asarray(anchor_groups))
+    anchor_epochs = np.atleast_1d(np.asarray(anchor_epochs, dtype=np.int64))
+
+    if event_ranks is None:
+        event_ranks = np.zeros(len(event_epochs))
+
+    event_ranks = np.atleast_1d(np.asarray(event_ranks, dtype=float))
+
+    if not (event_groups.shape == event_epochs.shape == event_ranks.shape):
+        raise ValueError("Event groups, epochs and ranks must have the same shape")
+
+    if anchor_groups.shape != anchor_epochs.shape:
+        raise ValueError("Anchor groups and epochs must have the same shape")
+
+    _check_sorted(event_groups, event_epochs, "Events")
+    _check_sorted(anchor_groups, anchor_epochs, "Anchors")
+
+    n_events = len(event_epochs)
+    n_anchors = len(anchor_epochs)
+
+    anchor_events = np.full(n_anchors, -1, dtype=np.int64)
+    time_diffs = np.full(n_anchors, -1, dtype=np.int64)
+
+    # Integer bounds of the window, min_before < time diff < max_before
+    lower = int(np.floor(min_before)) + 1
+    upper = int(np.ceil(max_before)) - 1
+
+    if n_events == 0 or n_anchors == 0 or upper < lower:
+        return anchor_events, time_diffs
+
+    # Events and anchors are placed on a single sorted axis, with the groups
+    # far enough apart that no window reaches the next group
+    _, group_codes = np.unique(np.concatenate([event_groups, anchor_groups]), return_inverse=True)
+
+    first_epoch = min(event_epochs.min(), anchor_epochs.min())
+    group_stride = max(event_epochs.max(), anchor_epochs.max()) - first_epoch + upper + 1
+
+    event_keys = group_codes[:n_events] * group_stride + (event_epochs - first_epoch)
+    anchor_keys = group_codes[n_events:] * group_stride + (anchor_epochs - first_epoch)
+
+    # The first anchor at least lower seconds after each event claims it, if
+    # it's also at most upper seconds after it
+    claims = np.searchsorted(anchor_keys, event_keys + lower, side="left")
+
+    claimed_events = np.flatnonzero(
+        (claims < n_anchors)
+        & (anchor_keys[np.minimum(claims, n_anchors - 1)] - event_keys <= upper)
+    )
+    claims = claims[claimed_events]
+
+    claim_diffs = anchor_epochs[claims] - event_epochs[claimed_events]
+
+    order = np.lexsort((-claimed_events, claim_diffs, event_ranks[claimed_events], claims))
+    _, first_claims = np.unique(claims[order], return_index=True)
+    chosen = order[first_claims]
+
+    anchor_events[claims[chosen]] = claimed_events[chosen]
+    time_diffs[claims[chosen]] = claim_diffs[chosen]
+
+    return anchor_events, time_diffs
+
+
+def get_top_choices(groups, levels) -> np.ndarray:
+    """
+    Index of the top choice of each group (e.g. the candidate HARPS of a CME):
+    the candidate with the lowest level, the first one in the given order on
+    ties. Candidates with level -1 are never chosen, groups without any other
+    candidate have no top choice. Returns the indices sorted by group.
+    """
+    groups = np.atleast_1d(np.asarray(groups))
+    levels = np.atleast_1d(np.asarray(levels))
+
+    valid_candidates = np.flatnonzero(levels != -1)
+
+    # lexsort is stable, so ties keep the given order
+    valid_candidates = valid_candidates[
+        np.lexsort((levels[valid_candidates], groups[valid_candidates]))
+    ]
+    _, first_candidates = np.unique(groups[valid_candidates], return_index=True)
+
+    return valid_candidates[first_candidates]
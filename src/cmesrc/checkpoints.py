@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from src.cmesrc.config import CHECKPOINTS_DIR
+
+
+def get_input_hash(*inputs) -> str:
+    """
+    Hash of the inputs and parameters of a stage. Takes DataFrames, arrays and
+    anything with a stable repr (numbers, strings, tuples of them...).
+    """
+    input_hash = hashlib.sha256()
+
+    for stage_input in inputs:
+        if isinstance(stage_input, pd.DataFrame):
+            input_hash.update(repr(list(stage_input.columns)).encode())
+            input_hash.update(
+                pd.util.hash_pandas_object(stage_input, index=True).to_numpy().tobytes()
+            )
+        elif isinstance(stage_input, np.ndarray):
+            if stage_input.dtype == object:
+                input_hash.update(repr(stage_input.tolist()).encode())
+            else:
+                input_hash.update(str(stage_input.dtype).encode())
+                input_hash.update(np.ascontiguousarray(stage_input).tobytes())
+        else:
+            input_hash.update(repr(stage_input).encode())
+
+    return input_hash.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Durable store of the results of finished partitions of a stage. Results
+    are saved under CHECKPOINTS_DIR/<stage>/<input hash>/, so a restart with
+    the same inputs and parameters finds them and a run with different ones
+    doesn't. Each result is written to a temporary file and then renamed, so
+    an interrupted write never leaves a partial checkpoint.
+    """
+
+    def __init__(self, stage: str, input_hash: str, directory: str = CHECKPOINTS_DIR):
+        self.STAGE = stage
+        self.INPUT_HASH = input_hash
+        self.STAGE_DIR = os.path.join(directory, stage)
+        self.PATH = os.path.join(self.STAGE_DIR, input_hash)
+
+        os.makedirs(self.PATH, exist_ok=True)
+
+    def _get_filepath(self, partition) -> str:
+        if isinstance(partition, tuple):
+            partition = "_".join(str(part) for part in partition)
+
+        return os.path.join(self.PATH, f"{partition}.pkl")
+
+    def has(self, partition) -> bool:
+        return os.path.exists(self._get_filepath(partition))
+
+    def save(self, partition, result) -> None:
+        filepath = self._get_filepath(partition)
+        temporary_filepath = f"{filepath}.{os.getpid()}.tmp"
+
+        with open(temporary_filepath, "wb") as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary_filepath, filepath)
+
+    def load(self, partition):
+        with open(self._get_filepath(partition), "rb") as file:
+            return pickle.load(file)
+
+    def clear(self) -> None:
+        """
+        Removes all the checkpoints of the stage, for any inputs.
+        """
+        shutil.rmtree(self.STAGE_DIR, ignore_errors=True)
+
+
+def checkpointed_call(store_partition_function_task):
+    """
+    Runs function(task) and saves the result as the given partition of the
+    store before returning it. Meant to be used from a pool, so every worker
+    saves its partitions as soon as they are finished.
+    """
+    store, partition, function, task = store_partition_function_task
+
+    result = function(task)
+    store.save(partition, result)
+
+    return result
+
+
+def map_with_checkpoints(scheduler, store, function, partitions, tasks, costs=None):
+    """
+    Yields function(task) for each partition, in order. Partitions already in
+    the store are loaded instead of computed, the rest are run on the
+    scheduler and saved to the store as they finish.
+    """
+    if costs is None:
+        costs = np.ones(len(tasks))
+
+    pending = [i for i, partition in enumerate(partitions) if not store.has(partition)]
+
+    if len(pending) < len(partitions):
+        print(f"Resuming {store.STAGE}: {len(partitions) - len(pending)} of {len(partitions)} partitions already done")
+
+    pending_results = scheduler.map(
+        checkpointed_call,
+        [(store, partitions[i], function, tasks[i]) for i in pending],
+        [costs[i] for i in pending],
+    )
+
+    pending = set(pending)
+
+    for i, partition in enumerate(partitions):
+        if i in pending:
+            yield next(pending_results)
+        else:
+            yield store.load(partition)
+
+    # Let the scheduler close its pool
+    next(pending_results, None)
@@ -0,0 +1,87 @@
+import os
+import pickle
+import pandas as pd
+
+# Default number of rows per chunk written by the matching stages
+CHUNK_SIZE = 50_000
+
+# A chunk file is a stream of pickles, pd.read_pickle would only return the
+# first chunk. It gets its own extension so it's never mistaken for a pickle
+CHUNK_EXTENSION = ".chunks"
+
+
+def _check_chunk_path(path) -> None:
+    if not str(path).endswith(CHUNK_EXTENSION):
+        raise ValueError(f"Chunk files must have the {CHUNK_EXTENSION} extension, got {path}")
+
+
+class ChunkWriter:
+    """
+    Writes a table as a sequence of DataFrame chunks appended to a single file,
+    so a stage can save its results as they are produced instead of building
+    the whole table in memory. Optionally appends the same chunks to a CSV file
+    (the header is only written with the first chunk).
+
+    The chunk file (with the CHUNK_EXTENSION extension) is read back with
+    iter_chunks or read_chunks.
+    """
+
+    def __init__(self, path: str, csv_path: str = None):
+        _check_chunk_path(path)
+
+        self.PATH = path
+        self.CSV_PATH = csv_path
+        self.N_CHUNKS = 0
+        self.N_ROWS = 0
+
+        self._file = open(path, "wb")
+
+        if csv_path is not None and os.path.exists(csv_path):
+            os.remove(csv_path)
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        pickle.dump(chunk, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self.CSV_PATH is not None:
+            chunk.to_csv(
+                self.CSV_PATH, mode="a", header=self.N_CHUNKS == 0, index=False
+            )
+
+        self.N_CHUNKS += 1
+        self.N_ROWS += len(chunk)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_chunks(path: str):
+    """
+    Yields the DataFrame chunks of a file written with ChunkWriter, in the
+    order they were written. Only one chunk is in memory at a time.
+    """
+    _check_chunk_path(path)
+
+    with open(path, "rb") as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+def read_chunks(path: str) -> pd.DataFrame:
+    """
+    Reads all the chunks of a file written with ChunkWriter into one DataFrame.
+    """
+    chunks = list(iter_chunks(path))
+
+    if len(chunks) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(chunks)
@@ -402,3 +402,222 @@ class RotatedBoundingBox(BoundingBox):
 
     def rotate_bbox(self, date, inplace: bool = False):
         raise TypeError("Can't rotate a RotatedBoundingBox")
+
+
+def get_cartesian_coords(lon, lat) -> tuple:
+    """
+    Vectorised version of Point.get_cartesian_coords. Takes longitudes and
+    latitudes in degrees and returns the projected (x, y) arrays.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    return (
+        np.cos(lat * DEG_TO_RAD) * np.sin(lon * DEG_TO_RAD),
+        np.sin(lat * DEG_TO_RAD),
+    )
+
+
+def get_position_angle(x, y) -> np.ndarray:
+    """
+    Vectorised version of Point.get_position_angle working from the projected
+    cartesian coordinates.
+    """
+    position_angle = np.arctan2(y, x) * 180 / np.pi
+
+    return np.select(
+        [
+            (0 <= position_angle) & (position_angle <= 90),
+            (90 < position_angle) & (position_angle <= 180),
+            position_angle < 0,
+        ],
+        [position_angle + 270, position_angle - 90, position_angle + 270],
+        default=position_angle,
+    )
+
+
+class BoundingBoxArray:
+    """
+    Column oriented collection of bounding boxes. Reproduces the geometry of
+    BoundingBox but every method works on all the boxes at once.
+
+    Unlike BoundingBox, invalid boxes don't raise on creation so a single bad
+    row doesn't stop a whole batch. Use is_valid() to find them.
+    """
+
+    def __init__(
+        self,
+        date,
+        lon_min,
+        lat_min,
+        lon_max,
+        lat_max,
+        units: str = "deg",
+    ):
+        self.LON_MIN = np.atleast_1d(np.asarray(lon_min, dtype=float))
+        self.LAT_MIN = np.atleast_1d(np.asarray(lat_min, dtype=float))
+        self.LON_MAX = np.atleast_1d(np.asarray(lon_max, dtype=float))
+        self.LAT_MAX = np.atleast_1d(np.asarray(lat_max, dtype=float))
+
+        self.DATE = None if date is None else Time(date)
+        self.UNITS = units
+
+    def __len__(self):
+        return len(self.LON_MIN)
+
+    def __getitem__(self, key):
+        return BoundingBoxArray(
+            date=None if self.DATE is None else self.DATE[key],
+            lon_min=self.LON_MIN[key],
+            lat_min=self.LAT_MIN[key],
+            lon_max=self.LON_MAX[key],
+            lat_max=self.LAT_MAX[key],
+            units=self.UNITS,
+        )
+
+    def is_valid(self) -> np.ndarray:
+        return (self.LON_MIN <= self.LON_MAX) & (self.LAT_MIN <= self.LAT_MAX)
+
+    def get_centre_point(self) -> tuple:
+        return (
+            (self.LON_MIN + self.LON_MAX) / 2,
+            (self.LAT_MIN + self.LAT_MAX) / 2,
+        )
+
+    def get_cartesian_centre_point(self) -> tuple:
+        return get_cartesian_coords(*self.get_centre_point())
+
+    def get_position_angle(self) -> np.ndarray:
+        return get_position_angle(*self.get_cartesian_centre_point())
+
+    def get_distance_to_sun_centre(self) -> np.ndarray:
+        x, y = self.get_cartesian_centre_point()
+        return np.sqrt(x**2 + y**2)
+
+    def rotate_bbox(self, date, keep_shape: bool = False):
+        """
+        Rotates every box to the given date (a single date or one per box) in a
+        single coordinate transformation. Like Point.rotate_coords, rotated
+        coordinates are rounded to 4 decimals so the results match rotating
+        the boxes one by one with BoundingBox.rotate_bbox.
+
+        Rotated boxes may be invalid (see is_valid), e.g. when they cross the
+        +-180 deg longitude wrap.
+        """
+        if self.DATE is None:
+            raise ValueError("Can't rotate bounding boxes without dates")
+
+        new_date = Time(date, format="iso")
+
+        if new_date.isscalar:
+            new_date = Time([new_date] * len(self))
+
+        if keep_shape:
+            lon_cen, lat_cen = self.get_centre_point()
+            lons, lats = [lon_cen], [lat_cen]
+        else:
+            lons, lats = [self.LON_MIN, self.LON_MAX], [self.LAT_MIN, self.LAT_MAX]
+
+        coords = SkyCoord(
+            np.concatenate(lons),
+            np.concatenate(lats),
+            unit=self.UNITS,
+            frame=HeliographicStonyhurst(obstime=Time(np.tile(self.DATE, len(lons)))),
+        )
+        new_frame = HeliographicStonyhurst(obstime=Time(np.tile(new_date, len(lons))))
+
+        with propagate_with_solar_surface():
+            new_coords = coords.transform_to(new_frame)
+
+        new_lons = np.round(new_coords.lon.to_value(self.UNITS), 4).reshape(len(lons), -1)
+        new_lats = np.round(new_coords.lat.to_value(self.UNITS), 4).reshape(len(lats), -1)
+
+        if keep_shape:
+            half_widths = (self.LON_MAX - self.LON_MIN) / 2
+            half_heights = (self.LAT_MAX - self.LAT_MIN) / 2
+
+            return BoundingBoxArray(
+                date=new_date,
+                lon_min=new_lons[0] - half_widths,
+                lat_min=new_lats[0] - half_heights,
+                lon_max=new_lons[0] + half_widths,
+                lat_max=new_lats[0] + half_heights,
+                units=self.UNITS,
+            )
+
+        return BoundingBoxArray(
+            date=new_date,
+            lon_min=new_lons[0],
+            lat_min=new_lats[0],
+            lon_max=new_lons[1],
+            lat_max=new_lats[1],
+            units=self.UNITS,
+        )
+
+    def is_point_inside(self, lon, lat) -> np.ndarray:
+        """
+        Vectorised BoundingBox.is_point_inside for points at the date of the
+        boxes (rotate the boxes first if needed). Boxes and points broadcast
+        against each other, e.g. (N, 1) and (M,) arrays give (N, M) results.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+
+        return (
+            (self.LON_MIN <= lon)
+            & (lon <= self.LON_MAX)
+            & (self.LAT_MIN <= lat)
+            & (lat <= self.LAT_MAX)
+        )
+
+    def get_spherical_point_distance(self, lon, lat) -> np.ndarray:
+        """
+        Vectorised BoundingBox.get_spherical_point_distance (in radians) for
+        points at the date of the boxes (rotate the boxes first if needed).
+        Boxes and points broadcast against each other like in is_point_inside.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+
+        left = lon < self.LON_MIN
+        right = lon > self.LON_MAX
+        below = lat < self.LAT_MIN
+        above = lat > self.LAT_MAX
+
+        # Same (signed) angular distances as BoundingBox.get_angular_point_distance
+        lon_dist = np.select(
+            [left, right & (below | above), right],
+            [self.LON_MIN - lon, self.LON_MAX - lon, lon - self.LON_MAX],
+            default=0,
+        )
+        lat_dist = np.select(
+            [(left | right) & below, (left | right) & above, above, below],
+            [self.LAT_MIN - lat, self.LAT_MAX - lat, lat - self.LAT_MAX, self.LAT_MIN - lat],
+            default=0,
+        )
+
+        point_lat = lat * np.pi / 180
+        lon_dist = lon_dist * np.pi / 180
+        lat_dist = lat_dist * np.pi / 180
+        bbox_lat = point_lat + lat_dist
+
+        with np.errstate(invalid="ignore"):
+            dist = np.arccos(
+                np.sin(point_lat) * np.sin(bbox_lat)
+                + np.cos(point_lat) * np.cos(bbox_lat) * np.cos(lon_dist)
+            )
+
+        return np.where(self.is_point_inside(lon, lat), 0, dist)
+
+    def get_raw_bbox(self) -> np.ndarray:
+        """
+        Returns an array of shape (N, 2, 2) with the same layout as
+        BoundingBox.get_raw_bbox for each box.
+        """
+        return np.stack(
+            [
+                np.stack([self.LON_MIN, self.LAT_MIN], axis=-1),
+                np.stack([self.LON_MAX, self.LAT_MAX], axis=-1),
+            ],
+            axis=1,
+        )
@@ -20,6 +20,7 @@ REPORTS_DIR = os.path.join(ROOT, "reports/")
 FIGURES_DIR = os.path.join(REPORTS_DIR, "figures/")
 OVERVIEW_FIGURES_DIR = os.path.join(FIGURES_DIR, "overviews/")
 SDOML_FOLDER = os.path.join(RAW_DATA_DIR, "sdoml/")
+CHECKPOINTS_DIR = os.path.join(INTERIM_DATA_DIR, "checkpoints/")
 
 # Raw data files
 
@@ -33,17 +34,22 @@ SDOML_TIMESTAMP_INFO = os.path.join(SDOML_FOLDER, "timestamps_info_dict.pkl")
 
 HARPS_LIFETIME_DATABSE = os.path.join(INTERIM_DATA_DIR, "harps_lifetime_database.csv")
 LASCO_CME_DATABASE = os.path.join(INTERIM_DATA_DIR, "lasco_cme_database.csv")
+LASCO_INGEST_STATE = os.path.join(INTERIM_DATA_DIR, "lasco_ingest_state.json")
+NEW_LASCO_CME_IDS = os.path.join(INTERIM_DATA_DIR, "new_lasco_cme_ids.csv")
 TEMPORAL_MATCHING_HARPS_DATABASE = os.path.join(
     INTERIM_DATA_DIR, "temporal_matching_harps_database.csv"
 )
-TEMPORAL_MATCHING_HARPS_DATABASE_PICKLE = os.path.join(
-    INTERIM_DATA_DIR, "temporal_matching_harps_database.pkl"
+TEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS = os.path.join(
+    INTERIM_DATA_DIR, "temporal_matching_harps_database.chunks"
+)
+TEMPORAL_MATCHING_HARPS_PAIRS = os.path.join(
+    INTERIM_DATA_DIR, "temporal_matching_harps_pairs.pkl"
 )
 SPATIOTEMPORAL_MATCHING_HARPS_DATABASE = os.path.join(
     INTERIM_DATA_DIR, "spatiotemporal_matching_harps_database.csv"
 )
-SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_PICKLE = os.path.join(
-    INTERIM_DATA_DIR, "spatiotemporal_matching_harps_database.pkl"
+SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS = os.path.join(
+    INTERIM_DATA_DIR, "spatiotemporal_matching_harps_database.chunks"
 )
 ALL_MATCHING_HARPS_DATABASE = os.path.join(
     INTERIM_DATA_DIR, "all_matching_harps_database.csv"
@@ -93,7 +99,7 @@ SCORED_HARPS_MATCHING_FLARES_DATABASE_PICKLE = os.path.join(
     INTERIM_DATA_DIR, "scored_harps_matching_flares_database.pkl"
 )
 
-MAIN_DATABASE_PICKLE = os.path.join(INTERIM_DATA_DIR, "main_database.pkl")
+MAIN_DATABASE_CHUNKS = os.path.join(INTERIM_DATA_DIR, "main_database.chunks")
 MAIN_DATABASE = os.path.join(INTERIM_DATA_DIR, "main_database.csv")
 
 DIMMINGS_MATCHED_TO_HARPS = os.path.join(
@@ -102,11 +108,23 @@ DIMMINGS_MATCHED_TO_HARPS = os.path.join(
 DIMMINGS_MATCHED_TO_HARPS_PICKLE = os.path.join(
     INTERIM_DATA_DIR, "dimmings_matched_to_harps.pkl"
 )
+OFF_DISK_DIMMINGS_MATCHED_TO_HARPS = os.path.join(
+    INTERIM_DATA_DIR, "off_disk_dimmings_matched_to_harps.csv"
+)
+OFF_DISK_DIMMINGS_MATCHED_TO_HARPS_PICKLE = os.path.join(
+    INTERIM_DATA_DIR, "off_disk_dimmings_matched_to_harps.pkl"
+)
 
 FLARES_MATCHED_TO_HARPS = os.path.join(INTERIM_DATA_DIR, "flares_matched_to_harps.csv")
 FLARES_MATCHED_TO_HARPS_PICKLE = os.path.join(
     INTERIM_DATA_DIR, "flares_matched_to_harps.pkl"
 )
+GOES_FLARES_MATCHED_TO_HARPS = os.path.join(
+    INTERIM_DATA_DIR, "goes_flares_matched_to_harps.csv"
+)
+GOES_FLARES_MATCHED_TO_HARPS_PICKLE = os.path.join(
+    INTERIM_DATA_DIR, "goes_flares_matched_to_harps.pkl"
+)
 
 UPDATED_SWAN = os.path.join(INTERIM_DATA_DIR, "SWAN/")
 
@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class IntervalIndex:
+    """
+    Index over half-open intervals [start, end) on integer epochs, such as the
+    lifetimes of HARPS regions.
+
+    Intervals are grouped in length classes (powers of two) and sorted by start
+    time within each class. For a query, the only candidates in a class are the
+    intervals starting at most the longest length of that class before it, so
+    the work done scales with the number of matches instead of with the number
+    of intervals.
+    """
+
+    def __init__(self, starts, ends):
+        self.STARTS = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        self.ENDS = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+
+        if self.STARTS.shape != self.ENDS.shape:
+            raise ValueError("Interval starts and ends must have the same shape")
+
+        if np.any(self.ENDS < self.STARTS):
+            raise ValueError("Interval ends must not be earlier than their starts")
+
+        lengths = self.ENDS - self.STARTS
+        length_classes = np.floor(np.log2(np.maximum(lengths, 1))).astype(int)
+
+        self._buckets = []
+
+        for length_class in np.unique(length_classes):
+            indices = np.flatnonzero(length_classes == length_class)
+            indices = indices[np.argsort(self.STARTS[indices], kind="stable")]
+
+            self._buckets.append(
+                (
+                    indices,
+                    self.STARTS[indices],
+                    self.ENDS[indices],
+                    lengths[indices].max(),
+                )
+            )
+
+    def __len__(self):
+        return len(self.STARTS)
+
+    def query_points(self, times) -> tuple:
+        """
+        Finds the intervals containing each time, i.e. start <= time < end.
+
+        Returns two arrays of the same length, (query indices, interval
+        indices), sorted by query index and then by interval index.
+        """
+        return self.query_overlaps(times, times)
+
+    def query_overlaps(self, query_starts, query_ends) -> tuple:
+        """
+        Finds the intervals overlapping each query window [query_start,
+        query_end], i.e. start <= query_end and end > query_start. A window
+        with query_start == query_end is the same as a point query.
+
+        Returns two arrays of the same length, (query indices, interval
+        indices), sorted by query index and then by interval index.
+        """
+        query_starts = np.atleast_1d(np.asarray(query_starts, dtype=np.int64))
+        query_ends = np.atleast_1d(np.asarray(query_ends, dtype=np.int64))
+
+        if query_starts.shape != query_ends.shape:
+            raise ValueError("Query starts and ends must have the same shape")
+
+        if np.any(query_ends < query_starts):
+            raise ValueError("Query ends must not be earlier than their starts")
+
+        all_query_indices = [np.array([], dtype=np.int64)]
+        all_interval_indices = [np.array([], dtype=np.int64)]
+
+        for indices, starts, ends, max_length in self._buckets:
+            # Intervals in this class can only overlap if they start after
+            # query_start - max_length and no later than query_end
+            lower = np.searchsorted(starts, query_starts - max_length, side="right")
+            upper = np.searchsorted(starts, query_ends, side="right")
+
+            counts = np.maximum(upper - lower, 0)
+            total = counts.sum()
+
+            if total == 0:
+                continue
+
+            query_indices = np.repeat(np.arange(len(query_starts)), counts)
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(lower, counts) + np.arange(total) - offsets
+
+            overlapping = ends[positions] > query_starts[query_indices]
+
+            all_query_indices.append(query_indices[overlapping])
+            all_interval_indices.append(indices[positions[overlapping]])
+
+        query_indices = np.concatenate(all_query_indices)
+        interval_indices = np.concatenate(all_interval_indices)
+
+        order = np.lexsort((interval_indices, query_indices))
+
+        return query_indices[order], interval_indices[order]
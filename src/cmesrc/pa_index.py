@@ -0,0 +1,177 @@
+import numpy as np
+from src.cmes.cmes import get_pa_diffs
+
+# Padding of the searchsorted bounds, the exact criterion is checked afterwards
+KEY_PADDING = 1e-6
+
+# Key stride between cadences for the distance keys (distances are at most 1)
+DISTANCE_STRIDE = 4
+
+
+class CircularPAIndex:
+    """
+    Index over records (e.g. HARPS positions) grouped by cadence timestamp.
+    Within each cadence, records are sorted by position angle on the circle and
+    separately by distance to the Sun centre, so finding the records within a
+    PA window (with wrap-around at 0/360 deg) or closer than a distance is a
+    couple of binary searches plus the matches, O(log n + k).
+    """
+
+    def __init__(self, epochs, position_angles, distances):
+        self.EPOCHS = np.atleast_1d(np.asarray(epochs, dtype=np.int64))
+        self.PA = np.atleast_1d(np.asarray(position_angles, dtype=float))
+        self.DISTANCES = np.atleast_1d(np.asarray(distances, dtype=float))
+
+        if not (self.EPOCHS.shape == self.PA.shape == self.DISTANCES.shape):
+            raise ValueError("Epochs, position angles and distances must have the same shape")
+
+        if not (np.all(np.isfinite(self.PA)) and np.all(np.isfinite(self.DISTANCES))):
+            raise ValueError("Position angles and distances must be finite")
+
+        self.CADENCES, cadence_positions = np.unique(self.EPOCHS, return_inverse=True)
+        self.CADENCE_OFFSETS = np.concatenate(
+            [[0], np.cumsum(np.bincount(cadence_positions, minlength=len(self.CADENCES)))]
+        )
+
+        wrapped_pas = self.PA % 360
+
+        self.PA_ORDER = np.lexsort((wrapped_pas, cadence_positions))
+        self._PA_KEYS = (cadence_positions * 360 + wrapped_pas)[self.PA_ORDER]
+
+        self.DISTANCE_ORDER = np.lexsort((self.DISTANCES, cadence_positions))
+        self._DISTANCE_KEYS = (
+            cadence_positions * DISTANCE_STRIDE + np.minimum(self.DISTANCES, DISTANCE_STRIDE - 1)
+        )[self.DISTANCE_ORDER]
+
+    def __len__(self):
+        return len(self.EPOCHS)
+
+    def get_nearest_cadences(self, epochs) -> tuple:
+        """
+        Position of the nearest cadence to each epoch (the earlier one on ties)
+        and the absolute time gap to it in seconds.
+        """
+        epochs = np.atleast_1d(np.asarray(epochs, dtype=np.int64))
+
+        after = np.searchsorted(self.CADENCES, epochs, side="left")
+        after = np.minimum(after, len(self.CADENCES) - 1)
+        before = np.maximum(after - 1, 0)
+
+        before_gaps = np.abs(epochs - self.CADENCES[before])
+        after_gaps = np.abs(epochs - self.CADENCES[after])
+
+        nearest = np.where(before_gaps <= after_gaps, before, after)
+
+        return nearest, np.minimum(before_gaps, after_gaps)
+
+    @staticmethod
+    def _expand_ranges(lower, upper) -> tuple:
+        """
+        Expands the ranges [lower, upper) of positions into (range indices,
+        positions).
+        """
+        counts = np.maximum(upper - lower, 0)
+        total = counts.sum()
+
+        range_indices = np.repeat(np.arange(len(lower)), counts)
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(lower, counts) + np.arange(total) - offsets
+
+        return range_indices, positions
+
+    def query_pa_windows(self, cadence_positions, position_angles, half_widths) -> tuple:
+        """
+        Finds, for each query, the records of the cadence whose PA differs by
+        less than half_width from the query PA on the circle (same difference
+        as get_pa_diffs).
+
+        Returns two arrays of the same length, (query indices, record
+        indices), sorted by query index and then by record index.
+        """
+        cadence_positions = np.atleast_1d(np.asarray(cadence_positions, dtype=np.int64))
+        position_angles = np.atleast_1d(np.asarray(position_angles, dtype=float))
+        half_widths = np.atleast_1d(np.asarray(half_widths, dtype=float))
+
+        cadence_starts = self.CADENCE_OFFSETS[cadence_positions]
+        cadence_ends = self.CADENCE_OFFSETS[cadence_positions + 1]
+        key_bases = cadence_positions * 360
+
+        window_starts = (position_angles - half_widths) % 360
+        window_ends = (position_angles + half_widths) % 360
+
+        whole_circle = half_widths >= 180
+        wraps = (window_starts > window_ends) & ~whole_circle
+
+        # Main range, [window_start, window_end] or [window_start, 360) if the
+        # window wraps around
+        lower = np.searchsorted(self._PA_KEYS, key_bases + window_starts - KEY_PADDING)
+        upper = np.where(
+            wraps,
+            cadence_ends,
+            np.searchsorted(self._PA_KEYS, key_bases + window_ends + KEY_PADDING, side="right"),
+        )
+
+        # Second range [0, window_end] for the windows wrapping around
+        wrap_lower = cadence_starts
+        wrap_upper = np.where(
+            wraps,
+            np.searchsorted(self._PA_KEYS, key_bases + window_ends + KEY_PADDING, side="right"),
+            cadence_starts,
+        )
+
+        lower = np.where(whole_circle, cadence_starts, np.clip(lower, cadence_starts, cadence_ends))
+        upper = np.where(whole_circle, cadence_ends, np.clip(upper, cadence_starts, cadence_ends))
+        wrap_upper = np.clip(wrap_upper, cadence_starts, cadence_ends)
+
+        query_indices, positions = self._expand_ranges(
+            np.concatenate([lower, wrap_lower]), np.concatenate([upper, wrap_upper])
+        )
+        query_indices = query_indices % len(cadence_positions)
+        record_indices = self.PA_ORDER[positions]
+
+        pa_diffs = get_pa_diffs(
+            self.PA[record_indices],
+            position_angles[query_indices],
+            np.zeros(len(record_indices), dtype=bool),
+        )
+        within = pa_diffs < half_widths[query_indices]
+
+        query_indices, record_indices = query_indices[within], record_indices[within]
+
+        # The two ranges may overlap for windows of almost 360 deg
+        pairs = np.unique(np.stack([query_indices, record_indices]), axis=1)
+
+        return pairs[0], pairs[1]
+
+    def query_distances(self, cadence_positions, max_distances) -> tuple:
+        """
+        Finds, for each query, the records of the cadence closer than
+        max_distance to the Sun centre.
+
+        Returns two arrays of the same length, (query indices, record
+        indices), sorted by query index and then by record index.
+        """
+        cadence_positions = np.atleast_1d(np.asarray(cadence_positions, dtype=np.int64))
+        max_distances = np.atleast_1d(np.asarray(max_distances, dtype=float))
+
+        lower = self.CADENCE_OFFSETS[cadence_positions]
+        cadence_ends = self.CADENCE_OFFSETS[cadence_positions + 1]
+
+        upper = np.searchsorted(
+            self._DISTANCE_KEYS,
+            cadence_positions * DISTANCE_STRIDE
+            + np.minimum(max_distances, DISTANCE_STRIDE - 1)
+            + KEY_PADDING,
+            side="right",
+        )
+        upper = np.clip(upper, lower, cadence_ends)
+
+        query_indices, positions = self._expand_ranges(lower, upper)
+        record_indices = self.DISTANCE_ORDER[positions]
+
+        within = self.DISTANCES[record_indices] < max_distances[query_indices]
+
+        query_indices, record_indices = query_indices[within], record_indices[within]
+        order = np.lexsort((record_indices, query_indices))
+
+        return query_indices[order], record_indices[order]
@@ -0,0 +1,140 @@
+from astropy.time import Time
+import numpy as np
+import pandas as pd
+
+
+class CandidatePairs:
+    """
+    Compact representation of event-HARPS candidate pairs (e.g. CMEs and the
+    HARPS present at their detection time).
+
+    Each pair is stored as an index into a columnar events table and an index
+    into an array of HARPNUMs. Pairs are sorted by event and then by HARPS, and
+    CSR offsets are kept both by event and by HARPS so the pairs of a given
+    event or HARPS are a slice away. The wide table with one row per pair is
+    only built when asked for through to_frame.
+    """
+
+    def __init__(
+        self,
+        events: pd.DataFrame,
+        harpnums,
+        event_indices,
+        harp_indices,
+        event_id_column: str = "CME_ID",
+        date_column: str = "CME_DATE",
+        pair_id_column: str = "CME_HARPNUM_ID",
+    ):
+        self.EVENTS = events.reset_index(drop=True)
+        self.HARPNUMS = np.asarray(harpnums)
+
+        event_indices = np.asarray(event_indices, dtype=np.int64)
+        harp_indices = np.asarray(harp_indices, dtype=np.int64)
+
+        order = np.lexsort((harp_indices, event_indices))
+
+        self.EVENT_INDICES = event_indices[order]
+        self.HARP_INDICES = harp_indices[order]
+
+        self.EVENT_ID_COLUMN = event_id_column
+        self.DATE_COLUMN = date_column
+        self.PAIR_ID_COLUMN = pair_id_column
+
+        # CSR offsets by event. Pairs of event i are EVENT_OFFSETS[i]:EVENT_OFFSETS[i + 1]
+        self.EVENT_OFFSETS = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.EVENT_INDICES, minlength=len(self.EVENTS)))]
+        )
+
+        # CSR offsets by HARPS, through a permutation of the pairs sorted by HARPS
+        self.HARP_ORDER = np.argsort(self.HARP_INDICES, kind="stable")
+        self.HARP_OFFSETS = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.HARP_INDICES, minlength=len(self.HARPNUMS)))]
+        )
+
+    def __len__(self):
+        return len(self.EVENT_INDICES)
+
+    def get_event_pairs(self, event_index: int) -> np.ndarray:
+        """
+        Positions of the pairs of a given event.
+        """
+        return np.arange(
+            self.EVENT_OFFSETS[event_index], self.EVENT_OFFSETS[event_index + 1]
+        )
+
+    def get_harp_pairs(self, harp_index: int) -> np.ndarray:
+        """
+        Positions of the pairs of a given HARPS, sorted by event.
+        """
+        return self.HARP_ORDER[
+            self.HARP_OFFSETS[harp_index] : self.HARP_OFFSETS[harp_index + 1]
+        ]
+
+    def get_pair_harpnums(self, pair_positions=None) -> np.ndarray:
+        if pair_positions is None:
+            pair_positions = slice(None)
+
+        return self.HARPNUMS[self.HARP_INDICES[pair_positions]]
+
+    def select_events(self, event_mask) -> "CandidatePairs":
+        """
+        Candidate pairs of only the events where event_mask is True, with the
+        same HARPNUMs.
+        """
+        event_mask = np.asarray(event_mask, dtype=bool)
+        new_event_indices = np.cumsum(event_mask) - 1
+
+        kept_pairs = event_mask[self.EVENT_INDICES]
+
+        return CandidatePairs(
+            self.EVENTS[event_mask],
+            self.HARPNUMS,
+            new_event_indices[self.EVENT_INDICES[kept_pairs]],
+            self.HARP_INDICES[kept_pairs],
+            event_id_column=self.EVENT_ID_COLUMN,
+            date_column=self.DATE_COLUMN,
+            pair_id_column=self.PAIR_ID_COLUMN,
+        )
+
+    def to_frame(self, pair_positions=None, parse_dates: bool = True) -> pd.DataFrame:
+        """
+        Joins the events table with the pairs, giving one row per pair with
+        all the event columns, the HARPNUM and a pair ID. Row i of the result
+        corresponds to pair_positions[i] (or pair i if not given).
+
+        If parse_dates is True, the date column holds astropy Time objects.
+        """
+        if pair_positions is None:
+            pair_positions = np.arange(len(self))
+
+        pair_positions = np.asarray(pair_positions, dtype=np.int64)
+
+        frame = self.EVENTS.iloc[self.EVENT_INDICES[pair_positions]].reset_index(
+            drop=True
+        )
+        harpnums = self.get_pair_harpnums(pair_positions)
+
+        frame["HARPNUM"] = harpnums
+        frame[self.PAIR_ID_COLUMN] = [
+            f"{event_id}{harpnum}"
+            for event_id, harpnum in zip(frame[self.EVENT_ID_COLUMN], harpnums)
+        ]
+
+        if parse_dates and len(frame) > 0:
+            frame[self.DATE_COLUMN] = list(Time(frame[self.DATE_COLUMN].to_list()))
+
+        first_cols = [
+            self.EVENT_ID_COLUMN,
+            self.PAIR_ID_COLUMN,
+            self.DATE_COLUMN,
+            "HARPNUM",
+        ]
+
+        return frame[first_cols + [col for col in frame.columns if col not in first_cols]]
+
+    def save(self, path: str) -> None:
+        pd.to_pickle(self, path)
+
+    @staticmethod
+    def load(path: str):
+        return pd.read_pickle(path)
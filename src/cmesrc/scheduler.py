@@ -0,0 +1,161 @@
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+
+
+def split_by_cost(costs, n_tasks: int, boundaries=None, max_size: int = None) -> list:
+    """
+    Splits items 0..len(costs) in contiguous ranges [start, end) of roughly
+    equal total cost. Ranges are only cut at the given boundaries (e.g. the
+    pair offsets of each CME, so a CME is never split), or anywhere if
+    boundaries is None. If max_size is given, ranges are also cut so they hold
+    about max_size items at most.
+    """
+    costs = np.asarray(costs, dtype=float)
+    n_items = len(costs)
+
+    if n_items == 0:
+        return []
+
+    if boundaries is None:
+        boundaries = np.arange(n_items + 1)
+
+    boundaries = np.unique(np.concatenate([[0], np.asarray(boundaries), [n_items]]))
+
+    cumulative_costs = np.concatenate([[0], np.cumsum(costs)])[boundaries]
+    total_cost = cumulative_costs[-1]
+
+    if total_cost > 0 and n_tasks > 1:
+        targets = total_cost * np.arange(1, n_tasks) / n_tasks
+        cut_positions = np.searchsorted(cumulative_costs, targets, side="left")
+        cost_cuts = boundaries[cut_positions]
+    else:
+        cost_cuts = np.array([], dtype=int)
+
+    if max_size is not None:
+        size_cuts = boundaries[
+            np.concatenate([[True], np.diff(boundaries // max_size) > 0])
+        ]
+    else:
+        size_cuts = np.array([], dtype=int)
+
+    cuts = np.unique(np.concatenate([[0, n_items], cost_cuts, size_cuts]))
+
+    return [(int(start), int(end)) for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+def _timed_call(function_and_task):
+    function, task_number, task = function_and_task
+
+    start = time.perf_counter()
+    result = function(task)
+    end = time.perf_counter()
+
+    return task_number, os.getpid(), end - start, result
+
+
+class CostAwareScheduler:
+    """
+    Runs many small tasks on a process pool. Idle workers take the next task
+    from a shared queue (one task at a time), so a worker stuck on an expensive
+    task does not hold back the rest. If the results don't need to come back
+    in order, the most expensive tasks are dispatched first.
+
+    Keeps per-task timings so the estimated costs and the worker utilisation
+    can be checked after a run with get_stats.
+    """
+
+    def __init__(self, n_workers: int = 4):
+        self.N_WORKERS = n_workers
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.TASK_COSTS = []
+        self.TASK_TIMES = []
+        self.TASK_WORKERS = []
+        self.WALL_TIME = 0
+
+    def map(self, function, tasks, costs=None, ordered: bool = True):
+        """
+        Applies function to every task in a pool of N_WORKERS processes.
+        Yields the results in task order if ordered is True, or as they finish
+        otherwise. The function must be importable by the workers (defined at
+        module level).
+        """
+        tasks = list(tasks)
+
+        if costs is None:
+            costs = np.ones(len(tasks))
+
+        costs = np.asarray(costs, dtype=float)
+
+        if ordered:
+            dispatch_order = np.arange(len(tasks))
+        else:
+            dispatch_order = np.argsort(-costs, kind="stable")
+
+        self._reset_stats()
+
+        jobs = ((function, task_number, tasks[task_number]) for task_number in dispatch_order)
+
+        start = time.perf_counter()
+
+        with mp.Pool(processes=self.N_WORKERS) as pool:
+            if ordered:
+                results = pool.imap(_timed_call, jobs, chunksize=1)
+            else:
+                results = pool.imap_unordered(_timed_call, jobs, chunksize=1)
+
+            for task_number, worker, task_time, result in results:
+                self.TASK_COSTS.append(costs[task_number])
+                self.TASK_TIMES.append(task_time)
+                self.TASK_WORKERS.append(worker)
+                self.WALL_TIME = time.perf_counter() - start
+
+                yield result
+
+    def get_stats(self) -> dict:
+        """
+        Summary of the last run: busy time of each worker, utilisation (busy
+        time over wall time times the number of workers) and how well the
+        estimated costs tracked the actual task times.
+        """
+        task_times = np.array(self.TASK_TIMES)
+        task_workers = np.array(self.TASK_WORKERS)
+
+        busy_times = {
+            int(worker): float(task_times[task_workers == worker].sum())
+            for worker in np.unique(task_workers)
+        }
+
+        if self.WALL_TIME > 0:
+            utilisation = task_times.sum() / (self.WALL_TIME * self.N_WORKERS)
+        else:
+            utilisation = np.nan
+
+        if len(task_times) > 1 and np.std(self.TASK_COSTS) > 0 and np.std(task_times) > 0:
+            cost_correlation = np.corrcoef(self.TASK_COSTS, task_times)[0, 1]
+        else:
+            cost_correlation = np.nan
+
+        return {
+            "n_tasks": len(task_times),
+            "n_workers": self.N_WORKERS,
+            "wall_time": self.WALL_TIME,
+            "busy_times": busy_times,
+            "utilisation": float(utilisation),
+            "cost_time_correlation": float(cost_correlation),
+        }
+
+    def print_stats(self) -> None:
+        stats = self.get_stats()
+
+        print(f"TASKS: {stats['n_tasks']} ON {stats['n_workers']} WORKERS")
+        print(f"WALL TIME: {stats['wall_time']:.1f} s")
+        print(f"WORKER UTILISATION: {100 * stats['utilisation']:.1f}%")
+
+        for worker, busy_time in stats["busy_times"].items():
+            print(f"    WORKER {worker}: {busy_time:.1f} s busy")
+
+        print(f"ESTIMATED COST/TIME CORRELATION: {stats['cost_time_correlation']:.2f}")
@@ -0,0 +1,286 @@
+import bisect
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from src.cmesrc.association import associate_events, get_top_choices
+from src.flares.flare_index import FlareLabelIndex
+from src.cmesrc.utils import to_epoch
+
+def walk_back_associations(event_groups, event_epochs, anchor_groups, anchor_epochs, min_before, max_before, event_ranks):
+    """
+    The association loop of generate_catalogue.py, one anchor at a time.
+    """
+    anchor_events = []
+
+    for group in np.unique(anchor_groups):
+        group_events = list(np.flatnonzero(event_groups == group))
+        group_epochs = list(event_epochs[group_events])
+        used_events = set()
+
+        for anchor_epoch in anchor_epochs[anchor_groups == group]:
+            event_index = bisect.bisect_right(group_epochs, anchor_epoch)
+            matching_events = []
+
+            while event_index > 0:
+                event_index -= 1
+                time_diff = anchor_epoch - group_epochs[event_index]
+                event = group_events[event_index]
+                if min_before < time_diff < max_before:
+                    if event not in used_events:
+                        used_events.add(event)
+                        matching_events.append((event_ranks[event], time_diff, event))
+                elif time_diff > max_before:
+                    break
+
+            if matching_events:
+                anchor_events.append(sorted(matching_events, key=lambda x: (x[0], x[1]))[0][2])
+            else:
+                anchor_events.append(-1)
+
+    return np.array(anchor_events)
+
+def baseline_associations(flares, dimmings, cmes, min_time_before=12 / 60, association_threshold=2.01):
+    """
+    The association block of generate_catalogue.py before associate_events,
+    on tables of rows (id, harpnum, date) (plus the class score for flares)
+    in the order the FLARES, DIMMINGS and CMES tables were read.
+    """
+    results = dict()
+
+    for harp in sorted(set(cme[1] for cme in cmes)):
+        flare_data = [(flare[2], flare[0], flare[3]) for flare in flares if flare[1] == harp]
+        flare_timestamps, flare_ids, flare_class_scores = (
+            zip(*flare_data) if flare_data else ([], [], [])
+        )
+
+        dimming_data = [(dimming[2], dimming[0]) for dimming in dimmings if dimming[1] == harp]
+        dimming_timestamps, dimming_ids = zip(*dimming_data) if dimming_data else ([], [])
+
+        present_at_cme_data = [(cme[2], cme[0]) for cme in cmes if cme[1] == harp]
+        present_at_cme_timestamps, present_at_cme_ids = zip(*present_at_cme_data)
+
+        flare_timestamps = [datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in flare_timestamps]
+        dimming_timestamps = [datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in dimming_timestamps]
+        present_at_cme_timestamps = [
+            datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in present_at_cme_timestamps
+        ]
+
+        used_flare_ids = set()
+        used_dimming_ids = set()
+
+        for cme_timestamp, cme_id in zip(present_at_cme_timestamps, present_at_cme_ids):
+            closest_flare_id = None
+            if flare_timestamps:
+                flare_index = bisect.bisect_right(flare_timestamps, cme_timestamp)
+                matching_flares = []
+
+                while flare_index > 0:
+                    flare_index -= 1
+                    hour_diff = (cme_timestamp - flare_timestamps[flare_index]).total_seconds() / 3600
+                    if min_time_before < hour_diff < association_threshold:
+                        if flare_ids[flare_index] not in used_flare_ids:
+                            used_flare_ids.add(flare_ids[flare_index])
+                            matching_flares.append(
+                                (hour_diff, flare_ids[flare_index], flare_class_scores[flare_index])
+                            )
+                    elif hour_diff > association_threshold:
+                        break
+
+                if matching_flares:
+                    closest_flare_id = sorted(matching_flares, key=lambda x: (-x[2], x[0]))[0][1]
+
+            closest_dimming_id = None
+            if dimming_timestamps:
+                dimming_index = bisect.bisect_right(dimming_timestamps, cme_timestamp)
+                matching_dimmings = []
+
+                while dimming_index > 0:
+                    dimming_index -= 1
+                    hour_diff = (cme_timestamp - dimming_timestamps[dimming_index]).total_seconds() / 3600
+                    if min_time_before < hour_diff < association_threshold:
+                        if dimming_ids[dimming_index] not in used_dimming_ids:
+                            used_dimming_ids.add(dimming_ids[dimming_index])
+                            matching_dimmings.append((hour_diff, dimming_ids[dimming_index]))
+                    elif hour_diff > association_threshold:
+                        break
+
+                if matching_dimmings:
+                    closest_dimming_id = min(matching_dimmings, key=lambda x: x[0])[1]
+
+            results[(harp, cme_id)] = (closest_flare_id, closest_dimming_id)
+
+    return results
+
+def engine_associations(flares, dimmings, cmes):
+    """
+    The association of generate_catalogue.py with associate_events, on the
+    same tables as baseline_associations.
+    """
+    flares = pd.DataFrame(flares, columns=["flare_id", "harpnum", "flare_date", "flare_class_score"])
+    dimmings = pd.DataFrame(dimmings, columns=["dimming_id", "harpnum", "dimming_start_date"])
+    cmes = pd.DataFrame(cmes, columns=["cme_id", "harpnum", "cme_date"])
+
+    flare_index = FlareLabelIndex(
+        flares["flare_id"], flares["harpnum"], to_epoch(flares["flare_date"].to_numpy()), flares["flare_class_score"]
+    )
+    flare_order = flare_index.HARPS_ORDER
+
+    dimming_epochs = to_epoch(dimmings["dimming_start_date"].to_numpy())
+    dimming_order = np.lexsort((dimmings["dimming_id"], dimming_epochs, dimmings["harpnum"]))
+
+    cme_epochs = to_epoch(cmes["cme_date"].to_numpy())
+    cme_order = np.lexsort((cmes["cme_id"], cme_epochs, cmes["harpnum"]))
+
+    args = (cmes["harpnum"].to_numpy()[cme_order], cme_epochs[cme_order], 12 * 60, 2.01 * 3600)
+
+    flare_positions, _ = associate_events(
+        flare_index.HARPNUMS[flare_order],
+        flare_index.EPOCHS[flare_order],
+        *args,
+        event_ranks=-flare_index.CLASS_SCORES[flare_order],
+    )
+    dimming_positions, _ = associate_events(
+        dimmings["harpnum"].to_numpy()[dimming_order], dimming_epochs[dimming_order], *args
+    )
+
+    flare_ids = flare_index.FLARE_IDS[flare_order]
+    dimming_ids = dimmings["dimming_id"].to_numpy()[dimming_order]
+
+    return {
+        (harpnum, cme_id): (
+            None if flare_position < 0 else flare_ids[flare_position],
+            None if dimming_position < 0 else dimming_ids[dimming_position],
+        )
+        for harpnum, cme_id, flare_position, dimming_position in zip(
+            args[0], cmes["cme_id"].to_numpy()[cme_order], flare_positions, dimming_positions
+        )
+    }
+
+def test_generate_catalogue_associations_match_baseline_on_sorted_input():
+    rng = np.random.default_rng(1)
+
+    def random_dates(n):
+        epochs = np.sort(1_325_376_000 + rng.integers(0, 48, n) * 12 * 60 + rng.choice([0, 0, 30], n))
+        return pd.to_datetime(epochs, unit="s").strftime("%Y-%m-%d %H:%M:%S").to_list()
+
+    for _ in range(10):
+        # Tables sorted by time, with ids in the same order, so that the
+        # baseline loop reads every HARP in time order
+        flares = [
+            (flare_id, harpnum, date, score)
+            for flare_id, (harpnum, date, score) in enumerate(
+                zip(rng.integers(1, 4, 150), random_dates(150), rng.choice([13.1, 21.0, 25.5, 31.2], 150)),
+                start=1,
+            )
+        ]
+        dimmings = [
+            (dimming_id, harpnum, date)
+            for dimming_id, (harpnum, date) in enumerate(zip(rng.integers(1, 4, 80), random_dates(80)), start=1)
+        ]
+        cmes = [
+            (cme_id, harpnum, date)
+            for cme_id, (harpnum, date) in enumerate(zip(rng.integers(1, 5, 60), random_dates(60)), start=1)
+        ]
+
+        assert engine_associations(flares, dimmings, cmes) == baseline_associations(flares, dimmings, cmes)
+
+def test_associations_match_walk_back():
+    rng = np.random.default_rng(0)
+
+    for _ in range(20):
+        event_groups = rng.integers(0, 5, 300)
+        event_epochs = rng.integers(0, 50, 300) * 60
+        event_ranks = -rng.choice([21.0, 25.5, 31.2], 300)
+        event_order = np.lexsort((event_epochs, event_groups))
+
+        anchor_groups = rng.integers(0, 6, 100)
+        anchor_epochs = rng.integers(0, 3_000, 100)
+        anchor_order = np.lexsort((anchor_epochs, anchor_groups))
+
+        args = (
+            event_groups[event_order],
+            event_epochs[event_order],
+            anchor_groups[anchor_order],
+            anchor_epochs[anchor_order],
+            12 * 60,
+            2.01 * 3600,
+            event_ranks[event_order],
+        )
+
+        anchor_events, time_diffs = associate_events(*args)
+
+        associated = anchor_events >= 0
+
+        assert np.all([
+            np.all(anchor_events == walk_back_associations(*args)),
+            np.all(time_diffs[associated] == args[3][associated] - args[1][anchor_events[associated]]),
+            np.all(time_diffs[~associated] == -1),
+            ])
+
+def test_window_bounds_are_excluded():
+    anchor_events, time_diffs = associate_events(
+        [1, 1, 1], [0, 100, 181], [1, 1], [200, 280], 19, 100
+    )
+
+    # Anchor 200: 181 is 19 s before (excluded), 100 is 100 s before (excluded)
+    # Anchor 280: 181 is 99 s before
+    assert np.all([
+        np.all(anchor_events == [-1, 2]),
+        np.all(time_diffs == [-1, 99]),
+        ])
+
+def test_events_are_used_once():
+    # Both events are claimed by the first anchor, which only chooses the
+    # closest one. The second anchor gets nothing
+    anchor_events, _ = associate_events([1, 1], [0, 50], [1, 1], [100, 110], 0, 200)
+
+    assert np.all(anchor_events == [1, -1])
+
+def test_unsorted_input_raises():
+    with pytest.raises(ValueError):
+        associate_events([1, 1], [50, 0], [1], [100], 0, 200)
+
+def test_no_events():
+    anchor_events, time_diffs = associate_events([], [], [1, 2], [100, 200], 0, 200)
+
+    assert np.all([
+        np.all(anchor_events == -1),
+        np.all(time_diffs == -1),
+        ])
+
+def test_flares_out_of_id_order():
+    # Flare 1 is in the window of the CME but was labelled after flare 2, which
+    # happened long before. Walked back in flare id order, as generate_catalogue
+    # used to, flare 2 ends the walk before flare 1 is reached
+    flare_index = FlareLabelIndex([1, 2], [10, 10], [20_000, 1_000], [31.5, 21.0])
+    flare_order = flare_index.HARPS_ORDER
+
+    anchor_events, _ = associate_events(
+        flare_index.HARPNUMS[flare_order],
+        flare_index.EPOCHS[flare_order],
+        [10],
+        [21_000],
+        12 * 60,
+        2.01 * 3600,
+        -flare_index.CLASS_SCORES[flare_order],
+    )
+
+    id_order_events = walk_back_associations(
+        np.array([10, 10]), np.array([20_000, 1_000]), np.array([10]), np.array([21_000]), 12 * 60, 2.01 * 3600, [-31.5, -21.0]
+    )
+
+    assert np.all([
+        flare_index.FLARE_IDS[flare_order][anchor_events] == [1],
+        id_order_events == [-1],
+        ])
+
+def test_top_choices_ties_keep_table_order():
+    # CME 7: levels 3, 1, 1 -> the first level 1. CME 5: only -1. CME 9: 4, 2
+    groups = [7, 7, 7, 5, 9, 9]
+    levels = [3, 1, 1, -1, 4, 2]
+
+    assert np.all(get_top_choices(groups, levels) == [1, 5])
+
+def test_no_top_choices():
+    assert len(get_top_choices([], [])) == 0
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from src.cmesrc.checkpoints import CheckpointStore, get_input_hash, map_with_checkpoints
+from src.cmesrc.scheduler import CostAwareScheduler
+
+def double(x):
+    return 2 * x
+
+def test_input_hash_depends_on_inputs_and_parameters():
+    df = pd.DataFrame({"A": [1, 2], "B": ["x", "y"]})
+
+    assert np.all([
+        get_input_hash(df, np.arange(3), 10) == get_input_hash(df.copy(), np.arange(3), 10),
+        get_input_hash(df, np.arange(3), 10) != get_input_hash(df, np.arange(3), 11),
+        get_input_hash(df, np.arange(3), 10) != get_input_hash(df.iloc[:1], np.arange(3), 10),
+        ])
+
+def test_store_save_load(tmp_path):
+    store = CheckpointStore("stage", "hash", directory=tmp_path)
+
+    store.save((0, 10), [1, 2, 3])
+
+    assert np.all([
+        store.has((0, 10)),
+        not store.has((10, 20)),
+        store.load((0, 10)) == [1, 2, 3]
+        ])
+
+    store.clear()
+
+    assert not (tmp_path / "stage").exists()
+
+def test_resume_skips_finished_partitions(tmp_path):
+    store = CheckpointStore("stage", "hash", directory=tmp_path)
+    partitions = [(0, 1), (1, 2), (2, 3)]
+    tasks = [1, 2, 3]
+
+    # A previous run finished the second partition (with a marker value)
+    store.save((1, 2), -1)
+
+    results = list(map_with_checkpoints(CostAwareScheduler(2), store, double, partitions, tasks))
+
+    assert np.all([
+        results == [2, -1, 6],
+        store.load((2, 3)) == 6
+        ])
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import pandas as pd
+from src.cmesrc.chunked import ChunkWriter, iter_chunks, read_chunks
+
+def test_chunks_round_trip(tmp_path):
+    path = tmp_path / "table.chunks"
+    csv_path = tmp_path / "table.csv"
+
+    chunks = [
+        pd.DataFrame({"A": [1, 2], "B": ["x", "y"]}),
+        pd.DataFrame({"A": [3], "B": ["z"]}),
+        ]
+
+    with ChunkWriter(path, csv_path) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    read_back = list(iter_chunks(path))
+    csv_table = pd.read_csv(csv_path)
+
+    assert np.all([
+        writer.N_CHUNKS == 2,
+        writer.N_ROWS == 3,
+        len(read_back) == 2,
+        read_back[1].equals(chunks[1]),
+        list(read_chunks(path)["A"]) == [1, 2, 3],
+        list(csv_table["B"]) == ["x", "y", "z"]
+        ])
+
+def test_empty_chunk_file(tmp_path):
+    path = tmp_path / "table.chunks"
+
+    with ChunkWriter(path):
+        pass
+
+    assert len(list(iter_chunks(path))) == 0 and read_chunks(path).empty
+
+def test_pickle_path_raises(tmp_path):
+    with pytest.raises(ValueError):
+        ChunkWriter(tmp_path / "table.pkl")
+
+    with pytest.raises(ValueError):
+        list(iter_chunks(tmp_path / "table.pkl"))
@@ -0,0 +1,76 @@
+import pytest
+import numpy as np
+from src.cmesrc.interval_index import IntervalIndex
+
+STARTS = np.array([0, 10, 10, 25, 100, 5])
+ENDS = np.array([20, 30, 11, 25, 1000, 6])
+
+def brute_force_overlaps(starts, ends, query_starts, query_ends):
+    pairs = [
+        (i, j)
+        for i, (query_start, query_end) in enumerate(zip(query_starts, query_ends))
+        for j, (start, end) in enumerate(zip(starts, ends))
+        if start <= query_end and end > query_start
+    ]
+
+    if len(pairs) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    return tuple(np.array(pairs).T)
+
+def test_point_query_is_half_open():
+    index = IntervalIndex(STARTS, ENDS)
+
+    query_indices, interval_indices = index.query_points([10, 20, 25, 999, 1000])
+
+    assert np.all([
+        np.all(interval_indices[query_indices == 0] == [0, 1, 2]),
+        np.all(interval_indices[query_indices == 1] == [1]),
+        np.all(interval_indices[query_indices == 2] == [1]),
+        np.all(interval_indices[query_indices == 3] == [4]),
+        len(interval_indices[query_indices == 4]) == 0
+        ])
+
+def test_point_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, 10_000, 500)
+    ends = starts + rng.integers(0, 2_000, 500)
+    times = rng.integers(-100, 12_000, 300)
+
+    index = IntervalIndex(starts, ends)
+
+    query_indices, interval_indices = index.query_points(times)
+    true_query_indices, true_interval_indices = brute_force_overlaps(starts, ends, times, times)
+
+    assert np.all([
+        np.all(query_indices == true_query_indices),
+        np.all(interval_indices == true_interval_indices)
+        ])
+
+def test_overlap_query_matches_brute_force():
+    rng = np.random.default_rng(1)
+    starts = rng.integers(0, 10_000, 500)
+    ends = starts + rng.integers(0, 2_000, 500)
+    query_ends = rng.integers(-100, 12_000, 300)
+    query_starts = query_ends - rng.integers(0, 500, 300)
+
+    index = IntervalIndex(starts, ends)
+
+    query_indices, interval_indices = index.query_overlaps(query_starts, query_ends)
+    true_query_indices, true_interval_indices = brute_force_overlaps(starts, ends, query_starts, query_ends)
+
+    assert np.all([
+        np.all(query_indices == true_query_indices),
+        np.all(interval_indices == true_interval_indices)
+        ])
+
+def test_no_matches():
+    index = IntervalIndex(STARTS, ENDS)
+
+    query_indices, interval_indices = index.query_points([-10, 5000])
+
+    assert len(query_indices) == 0 and len(interval_indices) == 0
+
+def test_invalid_intervals():
+    with pytest.raises(ValueError):
+        IntervalIndex([10], [5])
@@ -0,0 +1,74 @@
+import numpy as np
+from src.cmesrc.pa_index import CircularPAIndex
+from src.cmes.cmes import get_pa_diffs
+
+def get_random_index(seed=0):
+    rng = np.random.default_rng(seed)
+
+    epochs = rng.choice([0, 720, 1440, 2160], 300)
+    pas = rng.uniform(0, 360, 300)
+    pas[:5] = [0, 360, 359.5, 0.5, 180]
+    distances = rng.uniform(0, 1, 300)
+
+    return CircularPAIndex(epochs, pas, distances), rng
+
+def brute_force(index, cadence_positions, mask_function):
+    pairs = []
+
+    for query, cadence in enumerate(cadence_positions):
+        for record in range(len(index)):
+            if index.EPOCHS[record] == index.CADENCES[cadence] and mask_function(query, record):
+                pairs.append((query, record))
+
+    return np.array(pairs, dtype=int).reshape(-1, 2).T
+
+def test_pa_windows_match_brute_force():
+    index, rng = get_random_index()
+
+    cadences = rng.integers(0, 4, 200)
+    pas = rng.uniform(0, 360, 200)
+    pas[:4] = [0, 359.9, 1, 180]
+    half_widths = rng.uniform(0, 200, 200)
+    half_widths[:4] = [5, 5, 3, 180]
+
+    query_indices, record_indices = index.query_pa_windows(cadences, pas, half_widths)
+
+    expected = brute_force(
+        index,
+        cadences,
+        lambda query, record: get_pa_diffs(index.PA[record], pas[query], False) < half_widths[query]
+    )
+
+    assert np.all([
+        np.array_equal(query_indices, expected[0]),
+        np.array_equal(record_indices, expected[1]),
+        ])
+
+def test_distances_match_brute_force():
+    index, rng = get_random_index(1)
+
+    cadences = rng.integers(0, 4, 100)
+    max_distances = rng.uniform(0, 1.2, 100)
+
+    query_indices, record_indices = index.query_distances(cadences, max_distances)
+
+    expected = brute_force(
+        index,
+        cadences,
+        lambda query, record: index.DISTANCES[record] < max_distances[query]
+    )
+
+    assert np.all([
+        np.array_equal(query_indices, expected[0]),
+        np.array_equal(record_indices, expected[1]),
+        ])
+
+def test_nearest_cadences_prefer_earlier_on_ties():
+    index = CircularPAIndex([0, 720, 1440], [10, 20, 30], [0.1, 0.2, 0.3])
+
+    positions, gaps = index.get_nearest_cadences([-100, 360, 361, 1000, 5000])
+
+    assert np.all([
+        np.all(positions == [0, 0, 1, 1, 2]),
+        np.all(gaps == [100, 360, 359, 280, 3560])
+        ])
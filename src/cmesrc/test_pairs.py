@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from src.cmesrc.pairs import CandidatePairs
+
+EVENTS = pd.DataFrame({
+    "CME_ID": ["ID1", "ID2", "ID3"],
+    "CME_DATE": ["2012-01-01 00:00:00", "2012-01-02 00:00:00", "2012-01-03 00:00:00"],
+    "CME_PA": [10, 20, 30],
+    })
+HARPNUMS = np.array([100, 200, 300])
+EVENT_INDICES = [2, 0, 0, 2, 1]
+HARP_INDICES = [1, 2, 0, 0, 1]
+
+def test_pairs_are_sorted_by_event_and_harps():
+    pairs = CandidatePairs(EVENTS, HARPNUMS, EVENT_INDICES, HARP_INDICES)
+
+    assert np.all([
+        np.all(pairs.EVENT_INDICES == [0, 0, 1, 2, 2]),
+        np.all(pairs.HARP_INDICES == [0, 2, 1, 0, 1]),
+        len(pairs) == 5
+        ])
+
+def test_event_and_harps_slices():
+    pairs = CandidatePairs(EVENTS, HARPNUMS, EVENT_INDICES, HARP_INDICES)
+
+    assert np.all([
+        np.all(pairs.get_event_pairs(0) == [0, 1]),
+        np.all(pairs.get_event_pairs(1) == [2]),
+        np.all(pairs.get_event_pairs(2) == [3, 4]),
+        np.all(pairs.get_harp_pairs(0) == [0, 3]),
+        np.all(pairs.get_harp_pairs(1) == [2, 4]),
+        np.all(pairs.get_harp_pairs(2) == [1]),
+        np.all(pairs.get_pair_harpnums(pairs.get_harp_pairs(1)) == 200)
+        ])
+
+def test_to_frame_joins_event_columns():
+    pairs = CandidatePairs(EVENTS, HARPNUMS, EVENT_INDICES, HARP_INDICES)
+
+    frame = pairs.to_frame()
+
+    assert np.all([
+        list(frame.columns) == ["CME_ID", "CME_HARPNUM_ID", "CME_DATE", "HARPNUM", "CME_PA"],
+        list(frame["CME_HARPNUM_ID"]) == ["ID1100", "ID1300", "ID2200", "ID3100", "ID3200"],
+        list(frame["CME_PA"]) == [10, 10, 20, 30, 30],
+        isinstance(frame["CME_DATE"].iloc[0], Time),
+        frame["CME_DATE"].iloc[2] == Time("2012-01-02 00:00:00")
+        ])
+
+def test_to_frame_subset_without_parsing_dates():
+    pairs = CandidatePairs(EVENTS, HARPNUMS, EVENT_INDICES, HARP_INDICES)
+
+    frame = pairs.to_frame(pairs.get_harp_pairs(0), parse_dates=False)
+
+    assert np.all([
+        list(frame["CME_ID"]) == ["ID1", "ID3"],
+        list(frame["CME_DATE"]) == ["2012-01-01 00:00:00", "2012-01-03 00:00:00"]
+        ])
+
+def test_select_events():
+    pairs = CandidatePairs(EVENTS, HARPNUMS, EVENT_INDICES, HARP_INDICES)
+
+    selected_pairs = pairs.select_events([True, False, True])
+    frame = selected_pairs.to_frame(parse_dates=False)
+
+    assert np.all([
+        list(selected_pairs.EVENTS["CME_ID"]) == ["ID1", "ID3"],
+        list(frame["CME_HARPNUM_ID"]) == ["ID1100", "ID1300", "ID3100", "ID3200"],
+        np.all(selected_pairs.EVENT_OFFSETS == [0, 2, 4]),
+        ])
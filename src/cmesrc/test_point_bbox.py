@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 import astropy.units as u
-from src.cmesrc.classes import Point, BoundingBox, RotatedBoundingBox
+from src.cmesrc.classes import Point, BoundingBox, RotatedBoundingBox, BoundingBoxArray
 from src.cmesrc.exception_classes import InvalidBoundingBox
 from sunpy.coordinates import HeliographicStonyhurst, propagate_with_solar_surface
 from astropy.coordinates import SkyCoord
@@ -452,3 +452,89 @@ def test_rotated_boundingbox_exception():
 
     with pytest.raises(TypeError):
         bbox.rotate_bbox(DATE2)
+
+ARRAY_LON_MIN = np.array([-40, 10, -5, 60])
+ARRAY_LAT_MIN = np.array([20, -30, -5, 10])
+ARRAY_LON_MAX = np.array([-20, 30, 5, 80])
+ARRAY_LAT_MAX = np.array([40, -10, 5, 12])
+
+def test_boundingbox_array_matches_boundingbox():
+    bbox_array = BoundingBoxArray(
+            [DATE] * 4,
+            ARRAY_LON_MIN,
+            ARRAY_LAT_MIN,
+            ARRAY_LON_MAX,
+            ARRAY_LAT_MAX
+            )
+
+    bboxes = [
+        BoundingBox(DATE, lon_min, lat_min, lon_max, lat_max)
+        for lon_min, lat_min, lon_max, lat_max in zip(ARRAY_LON_MIN, ARRAY_LAT_MIN, ARRAY_LON_MAX, ARRAY_LAT_MAX)
+        ]
+
+    assert np.all([
+        np.allclose(np.transpose(bbox_array.get_centre_point()), [bbox.get_centre_point().get_raw_coords() for bbox in bboxes]),
+        np.allclose(np.transpose(bbox_array.get_cartesian_centre_point()), [bbox.get_cartesian_centre_point() for bbox in bboxes]),
+        np.allclose(bbox_array.get_position_angle(), [bbox.get_position_angle() for bbox in bboxes]),
+        np.allclose(bbox_array.get_distance_to_sun_centre(), [bbox.get_distance_to_sun_centre() for bbox in bboxes]),
+        np.all(bbox_array.get_raw_bbox() == np.array([bbox.get_raw_bbox() for bbox in bboxes]))
+        ])
+
+def test_boundingbox_array_invalid_boxes():
+    bbox_array = BoundingBoxArray(
+            None,
+            [10, 30],
+            [20, 20],
+            [20, 20],
+            [30, 30]
+            )
+
+    assert np.all(bbox_array.is_valid() == [True, False])
+
+def test_boundingbox_array_rotation_matches_boundingbox():
+    dates = ["2012-01-01 00:00:00", "2012-01-01 06:00:00", "2012-01-02 12:00:00"]
+    new_dates = ["2012-01-01 05:00:00", "2012-01-01 00:00:00", "2012-01-03 00:00:00"]
+    lon_min, lat_min, lon_max, lat_max = [-40, 10, 60], [-20, 5, 30], [-30, 20, 70], [-10, 15, 35]
+
+    bbox_array = BoundingBoxArray(dates, lon_min, lat_min, lon_max, lat_max)
+
+    for keep_shape in [False, True]:
+        rotated_array = bbox_array.rotate_bbox(new_dates, keep_shape=keep_shape)
+
+        rotated_bboxes = [
+            BoundingBox(*args).rotate_bbox(new_date, keep_shape=keep_shape)
+            for args, new_date in zip(zip(dates, lon_min, lat_min, lon_max, lat_max), new_dates)
+            ]
+
+        assert np.all([
+            np.allclose(rotated_array.get_raw_bbox(), [bbox.get_raw_bbox() for bbox in rotated_bboxes], atol=1e-9),
+            np.all(rotated_array.DATE == Time(new_dates))
+            ])
+
+def test_boundingbox_array_point_distance_matches_boundingbox():
+    lons = np.array([-50, -30, 0, 20, 70, 90, -25, 65])
+    lats = np.array([50, 0, -40, -20, 11, 5, 30, 30])
+
+    bbox_array = BoundingBoxArray(
+            [DATE] * 4,
+            ARRAY_LON_MIN,
+            ARRAY_LAT_MIN,
+            ARRAY_LON_MAX,
+            ARRAY_LAT_MAX
+            )
+
+    distances = bbox_array[:, None].get_spherical_point_distance(lons, lats)
+
+    expected_distances = [
+        [
+            BoundingBox(DATE, lon_min, lat_min, lon_max, lat_max).get_spherical_point_distance(Point(DATE, lon, lat))
+            for lon, lat in zip(lons, lats)
+            ]
+        for lon_min, lat_min, lon_max, lat_max in zip(ARRAY_LON_MIN, ARRAY_LAT_MIN, ARRAY_LON_MAX, ARRAY_LAT_MAX)
+        ]
+
+    assert np.all([
+        distances.shape == (4, 8),
+        np.array_equal(distances, expected_distances),
+        np.any(distances == 0)
+        ])
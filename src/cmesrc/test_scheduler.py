@@ -0,0 +1,51 @@
+import numpy as np
+from src.cmesrc.scheduler import split_by_cost, CostAwareScheduler
+
+def square(x):
+    return x**2
+
+def test_split_by_cost_balances_contiguous_ranges():
+    costs = [1, 1, 1, 1, 10, 1, 1, 1, 1, 1, 1]
+
+    ranges = split_by_cost(costs, 3)
+
+    range_costs = [sum(costs[start:end]) for start, end in ranges]
+
+    assert np.all([
+        ranges[0][0] == 0,
+        ranges[-1][1] == len(costs),
+        np.all([ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1)]),
+        max(range_costs) <= 14,
+        ])
+
+def test_split_by_cost_respects_boundaries_and_size():
+    costs = np.ones(20)
+    boundaries = [0, 3, 9, 10, 17, 20]
+
+    ranges = split_by_cost(costs, 2, boundaries=boundaries, max_size=5)
+
+    assert np.all([
+        np.all([start in boundaries and end in boundaries for start, end in ranges]),
+        ranges[0][0] == 0 and ranges[-1][1] == 20,
+        len(ranges) >= 4
+        ])
+
+def test_split_by_cost_empty():
+    assert split_by_cost([], 4) == []
+
+def test_scheduler_results_and_stats():
+    scheduler = CostAwareScheduler(n_workers=2)
+    tasks = list(range(10))
+
+    ordered = list(scheduler.map(square, tasks, costs=tasks))
+    unordered = list(scheduler.map(square, tasks, costs=tasks, ordered=False))
+
+    stats = scheduler.get_stats()
+
+    assert np.all([
+        ordered == [x**2 for x in tasks],
+        sorted(unordered) == [x**2 for x in tasks],
+        stats["n_tasks"] == 10,
+        stats["n_workers"] == 2,
+        0 <= stats["utilisation"] <= 1,
+        ])
@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+import concurrent.futures
+import multiprocessing
+import os
+import sqlite3
+import pytest
+from src.cmesrc.utils import (
+    backup_sql_to_file,
+    get_closest_harps_timestamp,
+    get_closest_record_indices,
+    create_processed_harps_ephemeris,
+    load_swan_subset,
+    read_sql_processed_bbox_bulk,
+    read_sql_to_memory,
+    round_to_cadence,
+    get_sql_rounded_timestamp,
+    to_epoch,
+)
+
+def test_closest_record_indices_match_bisect():
+    rng = np.random.default_rng(0)
+
+    record_keys = np.repeat([1, 5, 7], [20, 1, 15])
+    record_epochs = np.concatenate([
+        np.sort(rng.choice(np.arange(0, 100_000, 60), 20, replace=False)),
+        [50_000],
+        np.sort(rng.choice(np.arange(0, 100_000, 60), 15, replace=False)),
+        ])
+
+    query_keys = rng.choice([1, 5, 7], 200)
+    query_epochs = rng.integers(-1_000, 101_000, 200)
+
+    closest = get_closest_record_indices(record_keys, record_epochs, query_keys, query_epochs)
+
+    true_closest = []
+    for key, epoch in zip(query_keys, query_epochs):
+        key_indices = np.flatnonzero(record_keys == key)
+        harps_timestamps = list(record_epochs[key_indices])
+        closest_epoch = get_closest_harps_timestamp(harps_timestamps, epoch)
+        true_closest.append(key_indices[harps_timestamps.index(closest_epoch)])
+
+    assert np.all(closest == true_closest)
+
+def test_closest_record_ties_and_missing_keys():
+    record_keys = [1, 1, 1]
+    record_epochs = [0, 10, 20]
+
+    closest = get_closest_record_indices(record_keys, record_epochs, [1, 1, 1, 2], [5, 15, 30, 5])
+
+    assert np.all(closest == [0, 1, 2, -1])
+
+def test_closest_record_with_times():
+    timestamps = Time(["2012-01-01 00:00:00", "2012-01-01 00:12:00", "2012-01-01 00:24:00"])
+    cme_time = Time("2012-01-01 00:17:00")
+
+    closest = get_closest_record_indices([1, 1, 1], np.round(timestamps.unix), [1], [np.round(cme_time.unix)])
+
+    assert timestamps[closest[0]] == get_closest_harps_timestamp(list(timestamps), cme_time)
+
+def test_round_to_cadence():
+    dates = [
+        "2012-01-01 00:00:00",
+        "2012-01-01 00:06:00",
+        "2012-01-01 00:06:01",
+        "2012-01-01 00:17:59",
+        "2012-01-01 23:54:00",
+        "2012-01-01 23:54:01",
+        ]
+    rounded_dates = [
+        "2012-01-01 00:00:00",
+        "2012-01-01 00:00:00",
+        "2012-01-01 00:12:00",
+        "2012-01-01 00:12:00",
+        "2012-01-01 23:48:00",
+        "2012-01-02 00:00:00",
+        ]
+
+    assert np.all(round_to_cadence(to_epoch(dates)) == to_epoch(rounded_dates))
+
+def test_sql_rounded_timestamp_matches_round_to_cadence():
+    rng = np.random.default_rng(0)
+    epochs = np.concatenate([1_325_376_000 + rng.integers(0, 10**8, 1_000), 1_325_376_000 + np.arange(-721, 722)])
+    dates = pd.to_datetime(epochs, unit="s").strftime("%Y-%m-%d %H:%M:%S").to_list()
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE dates (date TEXT)")
+    conn.executemany("INSERT INTO dates VALUES (?)", [(date,) for date in dates])
+
+    rounded_dates = [
+        row[0] for row in conn.execute(f"SELECT {get_sql_rounded_timestamp('date')} FROM dates ORDER BY rowid")
+    ]
+
+    assert rounded_dates == pd.to_datetime(round_to_cadence(epochs), unit="s").strftime("%Y-%m-%d %H:%M:%S").to_list()
+
+def test_memory_database_round_trip(tmp_path):
+    source_path = str(tmp_path / "source.db")
+    output_path = str(tmp_path / "output.db")
+
+    source_conn = sqlite3.connect(source_path)
+    source_conn.execute("CREATE TABLE HARPS (harpnum INTEGER PRIMARY KEY)")
+    source_conn.executemany("INSERT INTO HARPS VALUES (?)", [(1,), (7,)])
+    source_conn.commit()
+    source_conn.close()
+
+    memory_conn = read_sql_to_memory(source_path)
+    memory_conn.execute("INSERT INTO HARPS VALUES (9)")
+    memory_conn.commit()
+
+    backup_sql_to_file(memory_conn, output_path)
+
+    output_harpnums = sqlite3.connect(output_path).execute("SELECT harpnum FROM HARPS").fetchall()
+    source_harpnums = sqlite3.connect(source_path).execute("SELECT harpnum FROM HARPS").fetchall()
+
+    assert np.all([
+        output_harpnums == [(1,), (7,), (9,)],
+        source_harpnums == [(1,), (7,)],
+        sorted(os.listdir(tmp_path)) == ["output.db", "source.db"],
+        ])
+
+def test_failed_backup_keeps_previous_file(tmp_path):
+    output_path = str(tmp_path / "output.db")
+
+    with open(output_path, "w") as file:
+        file.write("previous")
+
+    closed_conn = sqlite3.connect(":memory:")
+    closed_conn.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        backup_sql_to_file(closed_conn, output_path)
+
+    with open(output_path) as file:
+        previous = file.read()
+
+    assert np.all([
+        previous == "previous",
+        os.listdir(tmp_path) == ["output.db"],
+        ])
+
+def test_missing_database_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        read_sql_to_memory(str(tmp_path / "missing.db"))
+
+def test_load_swan_subset_in_spawned_workers(tmp_path):
+    swan_items = []
+
+    for harpnum, timestamps in [(1, ["2012-01-01 00:00:00", "2012-01-01 00:12:00"]), (7, ["2012-01-01 00:24:00"])]:
+        filepath = str(tmp_path / f"{harpnum}.csv")
+
+        with open(filepath, "w") as file:
+            file.write("Timestamp\tLONDTMIN\tLONDTMAX\tLATDTMIN\tLATDTMAX\tIRBB\tIS_TMFI\n")
+
+            for timestamp in timestamps:
+                file.write(f"{timestamp}\t-10.0\t10.0\t-5.0\t5.0\t0\t\n")
+
+        swan_items.append((harpnum, filepath))
+
+    staging_items = [
+        (str(tmp_path / f"staging_{i}.db"), swan_items[i::2]) for i in range(2)
+    ]
+
+    # Workers only import the module of the function, not a script
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        staging_paths = list(executor.map(load_swan_subset, staging_items))
+
+    rows = []
+
+    for staging_path in staging_paths:
+        rows.extend(sqlite3.connect(staging_path).execute("SELECT * FROM RAW_HARPS_BBOX").fetchall())
+
+    assert np.all([
+        staging_paths == [staging_path for staging_path, _ in staging_items],
+        sorted(rows) == [
+            (1, "2012-01-01 00:00:00", -10.0, 10.0, -5.0, 5.0, 0, 0),
+            (1, "2012-01-01 00:12:00", -10.0, 10.0, -5.0, 5.0, 0, 0),
+            (7, "2012-01-01 00:24:00", -10.0, 10.0, -5.0, 5.0, 0, 0),
+            ],
+        ])
+
+def test_bulk_bbox_read_fills_missing_ephemeris():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE PROCESSED_HARPS_BBOX (harpnum INTEGER, timestamp TEXT, LONDTMIN REAL, LONDTMAX REAL, LATDTMIN REAL, LATDTMAX REAL);
+        CREATE TABLE PROCESSED_HARPS_EPHEMERIS (harpnum INTEGER, epoch INTEGER, timestamp TEXT, LON_CEN REAL, LAT_CEN REAL, X_CEN REAL, Y_CEN REAL, PA REAL, DIST_SUN_CENTRE REAL);
+        """
+    )
+    conn.executemany(
+        "INSERT INTO PROCESSED_HARPS_BBOX VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (1, "2012-01-01 00:00:00", -30, -10, 5, 15),
+            (1, "2012-01-01 00:12:00", -29, -9, 5, 15),
+            (7, "2012-01-01 00:00:00", 20, 40, -25, -10),
+        ],
+    )
+    create_processed_harps_ephemeris(conn)
+
+    expected = read_sql_processed_bbox_bulk(conn)
+
+    conn.execute("DELETE FROM PROCESSED_HARPS_EPHEMERIS WHERE harpnum = 1 AND timestamp = '2012-01-01 00:12:00'")
+    filled = read_sql_processed_bbox_bulk(conn)
+
+    columns = ["LON_CEN", "LAT_CEN", "PA", "DIST_SUN_CENTRE"]
+
+    assert np.all([
+        np.all(np.isfinite(filled[columns].to_numpy())),
+        np.allclose(filled[columns].to_numpy(), expected[columns].to_numpy()),
+        ])
@@ -5,10 +5,11 @@ from bisect import bisect_left
 import sqlite3
 from tqdm import tqdm
 import numpy as np
-from os import walk, system, name
-from os.path import join
+from os import walk, system, name, remove, replace
+from os.path import join, exists
 import pandas as pd
 from src.cmesrc.config import DT_SWAN_DATA_DIR, SWAN_DATA_DIR, UPDATED_SWAN
+from src.cmesrc.classes import BoundingBoxArray
 
 def clear_screen(): # for windows
     if name == 'nt':
@@ -31,10 +32,99 @@ def parse_pandas_str_list(str_list: str) -> list:
     parsed_list = [int(item) for item in no_brackets_str_list]
     return parsed_list
 
+def to_epoch(dates) -> np.ndarray:
+    """
+    Converts dates (ISO strings, datetimes or astropy Time objects) to integer
+    unix epochs in seconds. Always returns an array.
+    """
+    if isinstance(dates, Time):
+        return np.round(np.atleast_1d(dates.unix)).astype(np.int64)
+
+    dates = np.atleast_1d(np.asarray(dates, dtype=object))
+
+    if len(dates) > 0 and isinstance(dates[0], Time):
+        return np.round(Time(list(dates)).unix).astype(np.int64)
+
+    parsed = pd.to_datetime(pd.Series(dates), format="ISO8601").to_numpy(
+        dtype="datetime64[s]"
+    )
+
+    return parsed.astype(np.int64)
+
+# Cadence of the SHARP records in seconds, at minutes 00, 12, 24, 36 and 48
+SHARP_CADENCE = 12 * 60
+
+def round_to_cadence(epochs, cadence: int = SHARP_CADENCE) -> np.ndarray:
+    """
+    Rounds integer epochs to the nearest multiple of the cadence, the earlier
+    one on ties. Always returns an array.
+    """
+    epochs = np.atleast_1d(np.asarray(epochs, dtype=np.int64))
+
+    remainders = epochs % cadence
+
+    return epochs - remainders + cadence * (2 * remainders > cadence)
+
+def get_sql_rounded_timestamp(date_column: str, cadence: int = SHARP_CADENCE) -> str:
+    """
+    SQLite expression of round_to_cadence for a column of ISO dates, as an
+    ISO timestamp, so a whole table can be rounded in a single statement.
+    Integer division keeps the earlier multiple on ties.
+    """
+    epoch = f"CAST(strftime('%s', {date_column}) AS INTEGER)"
+
+    return (
+        f"strftime('%Y-%m-%d %H:%M:%S', "
+        f"({epoch} + {(cadence - 1) // 2}) / {cadence} * {cadence}, 'unixepoch')"
+    )
+
 def get_closest_harps_timestamp(harps_timestamps, cme_time) -> Time:
     i = bisect_left(harps_timestamps, cme_time)
     return min(harps_timestamps[max(0, i-1): i+2], key=lambda t: abs(cme_time - t))
 
+def get_closest_record_indices(record_keys, record_epochs, query_keys, query_epochs) -> np.ndarray:
+    """
+    Vectorized get_closest_harps_timestamp for many HARPS at once (an as-of
+    join). Records must be sorted by key (e.g. harpnum) and then by epoch.
+    For each query returns the index of the record with the same key closest
+    in time, the earlier one on ties, or -1 if there are no records with that
+    key.
+    """
+    record_keys = np.asarray(record_keys, dtype=np.int64)
+    record_epochs = np.asarray(record_epochs, dtype=np.int64)
+    query_keys = np.atleast_1d(np.asarray(query_keys, dtype=np.int64))
+    query_epochs = np.atleast_1d(np.asarray(query_epochs, dtype=np.int64))
+
+    closest = np.full(len(query_keys), -1, dtype=np.int64)
+
+    if len(record_keys) == 0 or len(query_keys) == 0:
+        return closest
+
+    key_starts = np.searchsorted(record_keys, query_keys, side="left")
+    key_ends = np.searchsorted(record_keys, query_keys, side="right")
+
+    # Search on (key, epoch) at once through a single composite integer key
+    min_epoch = min(record_epochs.min(), query_epochs.min())
+    record_composite = (record_keys << 34) + (record_epochs - min_epoch)
+    query_composite = (query_keys << 34) + (query_epochs - min_epoch)
+
+    # First record of the same key at or after the query time
+    after = np.searchsorted(record_composite, query_composite, side="left")
+    before = after - 1
+
+    has_after = after < key_ends
+    has_before = before >= key_starts
+
+    after_diff = np.abs(record_epochs[np.minimum(after, len(record_epochs) - 1)] - query_epochs)
+    before_diff = np.abs(query_epochs - record_epochs[np.maximum(before, 0)])
+
+    use_before = has_before & (~has_after | (before_diff <= after_diff))
+
+    closest[has_after] = after[has_after]
+    closest[use_before] = before[use_before]
+
+    return closest
+
 def cache_swan_data() -> dict:
     clear_screen()
     print("\n==CACHING SWAN DATA.==\n")
@@ -122,6 +212,75 @@ def read_SWAN_filepath(filepath: str) -> pd.DataFrame:
 
     return df
 
+def load_swan_subset(staging_item):
+    """
+    Parses a subset of SWAN files and writes their bounding boxes to a
+    staging database owned by this worker only.
+
+    Parameters:
+    staging_item (tuple): The path of the staging database and a list of
+    (HARPNUM, SWAN file path) pairs to parse.
+
+    Returns:
+    str: The path of the staging database.
+    """
+    staging_path, swan_items = staging_item
+
+    staging_conn = sqlite3.connect(staging_path)
+    staging_conn.execute(
+        """
+    CREATE TABLE RAW_HARPS_BBOX (
+        harpnum INTEGER,
+        timestamp TEXT,
+        LONDTMIN REAL,
+        LONDTMAX REAL,
+        LATDTMIN REAL,
+        LATDTMAX REAL,
+        IRBB INTEGER,
+        IS_TMFI INTEGER
+    );
+    """
+    )
+
+    for harpnum, filepath in swan_items:
+        data = read_SWAN_filepath(filepath)
+        # Replace the NaN values with 0
+        data["IS_TMFI"] = data["IS_TMFI"].fillna(0)
+        bbox_data = [
+            (
+                int(harpnum),
+                str(timestamp)[:-4],
+                float(londtmin),
+                float(londtmax),
+                float(latdtmin),
+                float(latdtmax),
+                int(irbb),
+                int(is_tmfi),
+            )
+            for timestamp, londtmin, londtmax, latdtmin, latdtmax, irbb, is_tmfi in zip(
+                data["Timestamp"],
+                data["LONDTMIN"],
+                data["LONDTMAX"],
+                data["LATDTMIN"],
+                data["LATDTMAX"],
+                data["IRBB"],
+                data["IS_TMFI"],
+            )
+        ]
+
+        staging_conn.executemany(
+            """
+        INSERT INTO RAW_HARPS_BBOX (harpnum, timestamp, LONDTMIN, LONDTMAX, LATDTMIN, LATDTMAX, IRBB, IS_TMFI)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+            bbox_data,
+        )
+
+    staging_conn.commit()
+    staging_conn.close()
+
+    return staging_path
+
 def cache_updated_swan_data() -> dict:
     clear_screen()
     print("\n==CACHING UPDATED SWAN DATA.==\n")
@@ -144,6 +303,52 @@ def cache_updated_swan_data() -> dict:
     clear_screen()
     return data_dict
 
+def create_processed_harps_ephemeris(conn: sqlite3.Connection) -> None:
+    """
+    Fills PROCESSED_HARPS_EPHEMERIS with the quantities derived from each
+    PROCESSED_HARPS_BBOX row (centre point, projected centre, position angle
+    and distance to Sun centre) so matching stages can look them up by
+    (harpnum, epoch) instead of recomputing them.
+    """
+    bboxes = pd.read_sql(
+        """
+        SELECT harpnum, timestamp, LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX
+        FROM PROCESSED_HARPS_BBOX
+        """,
+        conn,
+    )
+
+    bbox_array = BoundingBoxArray(
+        None,
+        bboxes["LONDTMIN"].to_numpy(),
+        bboxes["LATDTMIN"].to_numpy(),
+        bboxes["LONDTMAX"].to_numpy(),
+        bboxes["LATDTMAX"].to_numpy(),
+    )
+
+    lon_cen, lat_cen = bbox_array.get_centre_point()
+    x_cen, y_cen = bbox_array.get_cartesian_centre_point()
+
+    ephemeris = pd.DataFrame(
+        {
+            "harpnum": bboxes["harpnum"].to_numpy(),
+            "epoch": to_epoch(bboxes["timestamp"].to_numpy()),
+            "timestamp": bboxes["timestamp"].to_numpy(),
+            "LON_CEN": lon_cen,
+            "LAT_CEN": lat_cen,
+            "X_CEN": x_cen,
+            "Y_CEN": y_cen,
+            "PA": bbox_array.get_position_angle(),
+            "DIST_SUN_CENTRE": bbox_array.get_distance_to_sun_centre(),
+        }
+    )
+
+    conn.execute("DELETE FROM PROCESSED_HARPS_EPHEMERIS;")
+    ephemeris.to_sql(
+        "PROCESSED_HARPS_EPHEMERIS", conn, if_exists="append", index=False
+    )
+    conn.commit()
+
 def read_sql_processed_bbox(harpnum: int, conn: sqlite3.Connection) -> pd.DataFrame:
     df = pd.read_sql(
         f"""
@@ -160,4 +365,106 @@ def read_sql_processed_bbox(harpnum: int, conn: sqlite3.Connection) -> pd.DataFr
 
     df.set_index("timestamp", drop=False, inplace=True)
 
-    return df
\ No newline at end of file
+    return df
+
+def read_sql_processed_bbox_bulk(conn: sqlite3.Connection, harpnums=None) -> pd.DataFrame:
+    """
+    Reads the processed bounding boxes of many HARPS (all of them if harpnums
+    is None) in a single query, with the precomputed ephemeris columns. The
+    timestamps are kept as strings, with their epochs in the epoch column, and
+    rows are sorted by harpnum and epoch, ready for get_closest_record_indices.
+    The ephemeris of the bounding boxes missing from PROCESSED_HARPS_EPHEMERIS
+    is computed from the bounding box.
+    """
+    harpnum_filter = ""
+
+    if harpnums is not None:
+        harpnum_filter = f"WHERE PHB.harpnum IN ({','.join(str(int(harpnum)) for harpnum in harpnums)})"
+
+    df = pd.read_sql(
+        f"""
+        SELECT PHB.harpnum, PHB.timestamp, CAST(strftime('%s', PHB.timestamp) AS INTEGER) AS epoch,
+        PHB.LONDTMIN, PHB.LATDTMIN, PHB.LONDTMAX, PHB.LATDTMAX,
+        PHE.LON_CEN, PHE.LAT_CEN, PHE.PA, PHE.DIST_SUN_CENTRE
+        FROM PROCESSED_HARPS_BBOX PHB
+        LEFT JOIN PROCESSED_HARPS_EPHEMERIS PHE
+        ON PHE.harpnum = PHB.harpnum AND PHE.epoch = CAST(strftime('%s', PHB.timestamp) AS INTEGER)
+        {harpnum_filter}
+        ORDER BY PHB.harpnum, epoch
+        """
+        , conn
+    )
+
+    # Bounding boxes missing from PROCESSED_HARPS_EPHEMERIS get their
+    # ephemeris computed here, as create_processed_harps_ephemeris would
+    missing = np.flatnonzero(
+        df[["LON_CEN", "LAT_CEN", "PA", "DIST_SUN_CENTRE"]].isna().any(axis=1).to_numpy()
+    )
+
+    if len(missing) > 0:
+        missing_bboxes = BoundingBoxArray(
+            None,
+            df["LONDTMIN"].to_numpy(dtype=float)[missing],
+            df["LATDTMIN"].to_numpy(dtype=float)[missing],
+            df["LONDTMAX"].to_numpy(dtype=float)[missing],
+            df["LATDTMAX"].to_numpy(dtype=float)[missing],
+        )
+
+        lon_cen, lat_cen = missing_bboxes.get_centre_point()
+
+        for column, values in [
+            ("LON_CEN", lon_cen),
+            ("LAT_CEN", lat_cen),
+            ("PA", missing_bboxes.get_position_angle()),
+            ("DIST_SUN_CENTRE", missing_bboxes.get_distance_to_sun_centre()),
+        ]:
+            df[column] = df[column].astype(float)
+            df.iloc[missing, df.columns.get_loc(column)] = values
+
+    return df
+
+def read_sql_to_memory(path: str) -> sqlite3.Connection:
+    """
+    Copies the database at path into a new in-memory connection with the
+    SQLite backup API.
+    """
+    # sqlite3.connect would create an empty database instead
+    if not exists(path):
+        raise FileNotFoundError(f"No database at {path}")
+
+    file_conn = sqlite3.connect(path)
+    memory_conn = sqlite3.connect(":memory:")
+
+    try:
+        file_conn.backup(memory_conn)
+    finally:
+        file_conn.close()
+
+    return memory_conn
+
+def backup_sql_to_file(conn: sqlite3.Connection, path: str) -> None:
+    """
+    Writes the whole database of conn to path in a single backup. It's written
+    to a temporary file next to path and then moved in place, so path is
+    either left as it was or fully written.
+    """
+    temp_path = f"{path}.tmp"
+
+    # A temporary file left by an interrupted run
+    if exists(temp_path):
+        remove(temp_path)
+
+    try:
+        file_conn = sqlite3.connect(temp_path)
+
+        try:
+            conn.backup(file_conn)
+        finally:
+            file_conn.close()
+
+        replace(temp_path, path)
+    except BaseException:
+        if exists(temp_path):
+            remove(temp_path)
+        raise
+
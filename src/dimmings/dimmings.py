@@ -1,7 +1,8 @@
-from src.cmesrc.classes import Point
+from src.cmesrc.classes import Point, get_position_angle
 import numpy as np
 from astropy.time import Time
 from src.harps.harps import Harps
+from src.cmes.cmes import get_pa_diffs
 
 class Dimming():
 
@@ -34,4 +35,41 @@ class OffDiskDimming():
     def get_ang_dist_harps(self, harps:Harps):
         rotated_harps = harps.rotate_bbox(self.DATE)
 
-        return np.abs(self.PA - harps.get_position_angle())
+        # Angular distance on the circle, so PAs at both sides of 0 deg are close
+        return get_pa_diffs(rotated_harps.get_position_angle(), self.PA, False)
+
+class OffDiskDimmingBatch():
+    """
+    Columnar version of OffDiskDimming for many dimmings. Holds the dates,
+    plane of the sky positions, distances to the Sun centre and PAs as arrays,
+    all computed in one pass.
+    """
+
+    def __init__(self, dates, x, y):
+        self.DATES = Time(dates)
+        self.EPOCHS = np.atleast_1d(self.DATES.unix)
+
+        self.X = np.atleast_1d(np.asarray(x, dtype=float))
+        self.Y = np.atleast_1d(np.asarray(y, dtype=float))
+
+        if not (self.EPOCHS.shape == self.X.shape == self.Y.shape):
+            raise ValueError("Dates, x and y must have the same shape")
+
+        self.R = np.sqrt(self.X**2 + self.Y**2)
+        self.PA = get_position_angle(self.X, self.Y)
+
+    def __len__(self):
+        return len(self.EPOCHS)
+
+    def get_pa_diffs(self, position_angles, dimming_indices) -> np.ndarray:
+        """
+        Angular distance on the circle between position angles (e.g. of
+        rotated HARPS) and the PA of the dimming of each one.
+        """
+        dimming_indices = np.asarray(dimming_indices, dtype=int)
+
+        return get_pa_diffs(
+            position_angles,
+            self.PA[dimming_indices],
+            np.zeros(len(dimming_indices), dtype=bool),
+        )
@@ -0,0 +1,46 @@
+from src.dimmings.dimmings import OffDiskDimming, OffDiskDimmingBatch
+from src.harps.harps import Harps
+import numpy as np
+import pytest
+
+DATE = "2012-01-01 00:00:00"
+X = np.array([1.1, -1.2, 0.5, -0.3, 1.0, 0.0])
+Y = np.array([0.2, 0.4, -1.3, -1.1, 0.0, 1.05])
+
+def test_batch_matches_off_disk_dimming():
+    batch = OffDiskDimmingBatch([DATE] * len(X), X, Y)
+
+    dimmings = [OffDiskDimming(DATE, x, y) for x, y in zip(X, Y)]
+
+    assert np.all([
+        np.allclose(batch.PA, [dimming.PA for dimming in dimmings]),
+        np.allclose(batch.R, [dimming.R for dimming in dimmings]),
+        ])
+
+def test_batch_pa_diffs_wrap_around():
+    batch = OffDiskDimmingBatch([DATE] * 2, [0.0, 1.2], [1.1, 0.0])
+
+    # PAs 0 and 270 deg
+    pa_diffs = batch.get_pa_diffs([355, 5, 90], [0, 0, 1])
+
+    assert np.allclose(pa_diffs, [5, 5, 180])
+
+def test_batch_shape_mismatch():
+    with pytest.raises(ValueError):
+        OffDiskDimmingBatch([DATE] * 2, [1.0, 1.0], [1.0])
+
+def test_ang_dist_harps_uses_rotated_harps():
+    # Dimming just east of north and HARPS just west of it, at both sides of
+    # PA 0/360 deg
+    dimming = OffDiskDimming("2012-01-01 12:00:00", -0.05, 1.1)
+    harps = Harps(DATE, 5, 60, 15, 70)
+
+    rotated_pa = harps.rotate_bbox(dimming.DATE).get_position_angle()
+    pa_diff = 360 - np.abs(dimming.PA - rotated_pa)
+
+    assert np.all([
+        dimming.PA < 5,
+        rotated_pa > 350,
+        np.isclose(dimming.get_ang_dist_harps(harps), pa_diff),
+        not np.isclose(pa_diff, 360 - np.abs(dimming.PA - harps.get_position_angle())),
+        ])
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class FlareLabelIndex:
+    """
+    Index over the flares labelled in the SWAN-SF data (or any other flare
+    list with an id, a HARPS, a date and a class score per flare), so that
+    they don't have to be re-derived from the label strings.
+
+    Flares are stored as plain arrays sorted by id, with a permutation
+    (HARPS_ORDER) sorting them by HARPNUM and epoch, so that the flares of a
+    HARPS are a contiguous slice with sorted epochs. If a flare id appears
+    more than once, the first one is kept.
+    """
+
+    def __init__(self, flare_ids, harpnums, epochs, class_scores):
+        flare_ids = np.atleast_1d(np.asarray(flare_ids, dtype=np.int64))
+        harpnums = np.atleast_1d(np.asarray(harpnums, dtype=np.int64))
+        epochs = np.atleast_1d(np.asarray(epochs, dtype=np.int64))
+        class_scores = np.atleast_1d(np.asarray(class_scores, dtype=float))
+
+        if not (flare_ids.shape == harpnums.shape == epochs.shape == class_scores.shape):
+            raise ValueError("Flare ids, HARPNUMs, epochs and class scores must have the same shape")
+
+        _, first_flares = np.unique(flare_ids, return_index=True)
+
+        self.FLARE_IDS = flare_ids[first_flares]
+        self.HARPNUMS = harpnums[first_flares]
+        self.EPOCHS = epochs[first_flares]
+        self.CLASS_SCORES = class_scores[first_flares]
+
+        # Flares of the same HARPS at the same time are sorted by id
+        self.HARPS_ORDER = np.lexsort((self.FLARE_IDS, self.EPOCHS, self.HARPNUMS))
+
+        harps_harpnums = self.HARPNUMS[self.HARPS_ORDER]
+
+        self._harpnums, self._harps_starts = np.unique(harps_harpnums, return_index=True)
+        self._harps_ends = np.append(self._harps_starts[1:], len(harps_harpnums))
+
+    def __len__(self):
+        return len(self.FLARE_IDS)
+
+    def get_harps_flares(self, harpnum) -> tuple:
+        """
+        Flares of a HARPS, sorted by epoch. Returns (epochs, flare ids, class
+        scores) arrays, empty if the HARPS has no flares.
+        """
+        position = np.searchsorted(self._harpnums, harpnum)
+
+        if position == len(self._harpnums) or self._harpnums[position] != harpnum:
+            indices = self.HARPS_ORDER[:0]
+        else:
+            indices = self.HARPS_ORDER[
+                self._harps_starts[position] : self._harps_ends[position]
+            ]
+
+        return self.EPOCHS[indices], self.FLARE_IDS[indices], self.CLASS_SCORES[indices]
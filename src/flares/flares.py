@@ -1,5 +1,79 @@
 from src.cmesrc.classes import Point
+from src.cmesrc.utils import SHARP_CADENCE
+import numpy as np
+import pandas as pd
+
+# Points of each GOES class letter, the magnitude is added to them so that
+# e.g. M1.5 scores 31.5
+CLASS_LETTER_SCORES = {
+    "A": 0,
+    "B": 10,
+    "C": 20,
+    "M": 30,
+    "X": 40,
+}
+
 class Flare():
     def __init__(self, date, lon, lat, xr_class=None):
         self.point = Point(date, lon, lat)
         self.XR_CLASS = xr_class
+
+def get_flare_class_scores(flare_classes) -> np.ndarray:
+    """
+    Scores of many GOES classes at once: the score of the class letter plus
+    the magnitude. Missing or malformed classes score NaN.
+    """
+    flare_classes = pd.Series(np.asarray(flare_classes, dtype=object))
+    flare_classes = flare_classes.where(flare_classes.notna(), "").astype(str).str.strip()
+
+    letter_scores = flare_classes.str[:1].map(CLASS_LETTER_SCORES)
+    magnitudes = pd.to_numeric(flare_classes.str[1:], errors="coerce")
+
+    return (letter_scores + magnitudes).to_numpy(dtype=float)
+
+def get_duplicate_flares(
+    harpnums,
+    epochs,
+    class_scores,
+    other_harpnums,
+    other_epochs,
+    other_class_scores,
+    tolerance: int = SHARP_CADENCE,
+) -> np.ndarray:
+    """
+    Mask of the flares that are also in the other flares, listed under any id:
+    same HARPS, same class score and dates at most tolerance seconds apart.
+    The SWAN-SF flare dates are the timestamps of the SHARP records the flares
+    are labelled in, so they only agree with the GOES peak times up to the
+    SHARP cadence.
+    """
+    def to_frame(harpnums, epochs, class_scores):
+        return pd.DataFrame(
+            {
+                "HARPNUM": np.asarray(harpnums, dtype=np.int64),
+                "EPOCH": np.asarray(epochs, dtype=np.int64),
+                # Class scores have a single decimal, so they're compared as
+                # integers
+                "CLASS_SCORE": np.round(np.asarray(class_scores, dtype=float) * 10).astype(np.int64),
+            }
+        )
+
+    flares = to_frame(harpnums, epochs, class_scores)
+    flares["ROW"] = np.arange(len(flares))
+
+    other_flares = to_frame(other_harpnums, other_epochs, other_class_scores)
+    other_flares["DUPLICATE"] = True
+
+    closest_flares = pd.merge_asof(
+        flares.sort_values("EPOCH"),
+        other_flares.sort_values("EPOCH"),
+        on="EPOCH",
+        by=["HARPNUM", "CLASS_SCORE"],
+        tolerance=tolerance,
+        direction="nearest",
+    )
+
+    duplicates = np.zeros(len(flares), dtype=bool)
+    duplicates[closest_flares["ROW"].to_numpy()] = closest_flares["DUPLICATE"].notna().to_numpy()
+
+    return duplicates
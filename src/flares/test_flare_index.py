@@ -0,0 +1,49 @@
+from src.flares.flare_index import FlareLabelIndex
+import numpy as np
+
+FLARE_IDS = np.array([7, 3, 9, 3, 12, 5])
+HARPNUMS = np.array([20, 10, 10, 30, 20, 10])
+EPOCHS = np.array([500, 300, 100, 900, 400, 300])
+CLASS_SCORES = np.array([21.0, 31.5, 15.0, 40.0, 22.2, 11.0])
+
+def test_keeps_first_flare():
+    index = FlareLabelIndex(FLARE_IDS, HARPNUMS, EPOCHS, CLASS_SCORES)
+
+    assert np.all([
+        len(index) == 5,
+        np.all(index.FLARE_IDS == [3, 5, 7, 9, 12]),
+        np.all(index.HARPNUMS == [10, 10, 20, 10, 20]),
+        np.allclose(index.CLASS_SCORES, [31.5, 11.0, 21.0, 15.0, 22.2]),
+        len(index.get_harps_flares(30)[0]) == 0,
+        ])
+
+def test_harps_flares_sorted_by_epoch():
+    index = FlareLabelIndex(FLARE_IDS, HARPNUMS, EPOCHS, CLASS_SCORES)
+
+    epochs, flare_ids, class_scores = index.get_harps_flares(10)
+    no_epochs, no_flare_ids, _ = index.get_harps_flares(40)
+
+    assert np.all([
+        np.all(epochs == [100, 300, 300]),
+        np.all(flare_ids == [9, 3, 5]),
+        np.allclose(class_scores, [15.0, 31.5, 11.0]),
+        len(no_epochs) == 0,
+        len(no_flare_ids) == 0,
+        ])
+
+def test_harps_order():
+    index = FlareLabelIndex(FLARE_IDS, HARPNUMS, EPOCHS, CLASS_SCORES)
+
+    assert np.all([
+        np.all(index.HARPNUMS[index.HARPS_ORDER] == [10, 10, 10, 20, 20]),
+        np.all(index.EPOCHS[index.HARPS_ORDER] == [100, 300, 300, 400, 500]),
+        ])
+
+def test_empty_index():
+    index = FlareLabelIndex([], [], [], [])
+
+    assert np.all([
+        len(index) == 0,
+        len(index.HARPS_ORDER) == 0,
+        len(index.get_harps_flares(10)[0]) == 0,
+        ])
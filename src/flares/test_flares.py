@@ -0,0 +1,32 @@
+from src.flares.flares import get_duplicate_flares, get_flare_class_scores
+import numpy as np
+
+def test_flare_class_scores():
+    scores = get_flare_class_scores(["A2.0", "B1.3", "C9.9", "M1.5", "X10.2", "X1"])
+
+    assert np.allclose(scores, [2.0, 11.3, 29.9, 31.5, 50.2, 41])
+
+def test_flare_class_scores_invalid_classes():
+    scores = get_flare_class_scores(["", None, np.nan, "Z1.0", "M", "M1.5"])
+
+    assert np.all([
+        np.all(np.isnan(scores[:5])),
+        np.isclose(scores[5], 31.5),
+        ])
+
+def test_duplicate_flares():
+    duplicates = get_duplicate_flares(
+        [1, 1, 1, 2, 1, 1],
+        [0, 1000, 5000, 0, 9000, 20000],
+        [31.5, 31.5, 20.1, 31.5, 20.1, 41.0],
+        [1, 1, 2, 1],
+        [700, 5720, 3000, 9000],
+        [31.5, 20.1, 31.5, 20.2],
+    )
+
+    # Same HARPS and class within a SHARP cadence, another HARPS, another
+    # class and no flare near in time
+    assert list(duplicates) == [True, True, True, False, False, False]
+
+def test_duplicate_flares_without_other_flares():
+    assert list(get_duplicate_flares([1], [0], [31.5], [], [], [])) == [False]
@@ -0,0 +1,194 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from src.cmesrc.classes import get_cartesian_coords, get_position_angle
+
+SECONDS_PER_DAY = 86400
+
+# Upper bound of the solar rotation rate in Stonyhurst longitude (deg/day).
+# The differential rotation is at most ~14.4 deg/day sidereal at the equator.
+MAX_ROTATION_RATE = 15
+
+# Extra margin (deg) added to the envelopes and to the PA criterion to be safe
+# against the rounding of rotated coordinates
+ENVELOPE_MARGIN = 1
+
+
+class HarpsDailyEnvelopes:
+    """
+    Per HARPS and per day (UTC), the smallest longitude-latitude rectangle
+    containing all its bounding boxes.
+
+    Used to discard CME-HARPS pairs that can't be spatially consistent before
+    rotating anything. For a CME at time t on day d, spatial matching uses the
+    closest HARPS record to t, rotated to t. If the HARPS has a record on day d
+    the closest one is less than a day away, so it is within the envelopes of
+    days d - 1, d and d + 1, and rotating it moves it at most a day's worth of
+    rotation in longitude. That rectangle holds every position the HARPS centre
+    can have in spatial matching.
+    """
+
+    def __init__(self, harpnums, days, lon_min, lat_min, lon_max, lat_max):
+        order = np.lexsort((days, harpnums))
+
+        self.HARPNUMS = np.asarray(harpnums, dtype=np.int64)[order]
+        self.DAYS = np.asarray(days, dtype=np.int64)[order]
+        self.LON_MIN = np.asarray(lon_min, dtype=float)[order]
+        self.LAT_MIN = np.asarray(lat_min, dtype=float)[order]
+        self.LON_MAX = np.asarray(lon_max, dtype=float)[order]
+        self.LAT_MAX = np.asarray(lat_max, dtype=float)[order]
+
+        self._KEYS = self._get_keys(self.HARPNUMS, self.DAYS)
+
+    def __len__(self):
+        return len(self.HARPNUMS)
+
+    @staticmethod
+    def _get_keys(harpnums, days) -> np.ndarray:
+        return (np.asarray(harpnums, dtype=np.int64) << 32) + np.asarray(
+            days, dtype=np.int64
+        )
+
+    @classmethod
+    def from_sql(cls, conn: sqlite3.Connection):
+        """
+        Builds the envelopes from PROCESSED_HARPS_BBOX in a single grouped
+        query.
+        """
+        envelopes = pd.read_sql(
+            f"""
+            SELECT harpnum,
+            CAST(strftime('%s', timestamp) AS INTEGER) / {SECONDS_PER_DAY} AS day,
+            MIN(LONDTMIN) AS LON_MIN, MIN(LATDTMIN) AS LAT_MIN,
+            MAX(LONDTMAX) AS LON_MAX, MAX(LATDTMAX) AS LAT_MAX
+            FROM PROCESSED_HARPS_BBOX
+            GROUP BY harpnum, day
+            """,
+            conn,
+        )
+
+        return cls(
+            envelopes["harpnum"].to_numpy(),
+            envelopes["day"].to_numpy(),
+            envelopes["LON_MIN"].to_numpy(),
+            envelopes["LAT_MIN"].to_numpy(),
+            envelopes["LON_MAX"].to_numpy(),
+            envelopes["LAT_MAX"].to_numpy(),
+        )
+
+    def _lookup(self, harpnums, days) -> np.ndarray:
+        """
+        Index of the envelope of each (harpnum, day), or -1 if there is none.
+        """
+        keys = self._get_keys(harpnums, days)
+        positions = np.searchsorted(self._KEYS, keys)
+        positions = np.minimum(positions, len(self._KEYS) - 1)
+
+        return np.where(self._KEYS[positions] == keys, positions, -1)
+
+    def get_reachable_boxes(self, harpnums, epochs) -> tuple:
+        """
+        For each (harpnum, epoch), the longitude-latitude rectangle holding all
+        the positions the HARPS can have at that time in spatial matching.
+        Returns (lon_min, lat_min, lon_max, lat_max, known), where known is
+        False if the HARPS has no record on that day (nothing can be said).
+        """
+        days = np.asarray(epochs, dtype=np.int64) // SECONDS_PER_DAY
+
+        same_day = self._lookup(harpnums, days)
+        known = same_day >= 0
+
+        lon_min = np.full(len(days), np.inf)
+        lat_min = np.full(len(days), np.inf)
+        lon_max = np.full(len(days), -np.inf)
+        lat_max = np.full(len(days), -np.inf)
+
+        for day_offset in [-1, 0, 1]:
+            envelope = self._lookup(harpnums, days + day_offset)
+            found = envelope >= 0
+
+            lon_min[found] = np.minimum(lon_min[found], self.LON_MIN[envelope[found]])
+            lat_min[found] = np.minimum(lat_min[found], self.LAT_MIN[envelope[found]])
+            lon_max[found] = np.maximum(lon_max[found], self.LON_MAX[envelope[found]])
+            lat_max[found] = np.maximum(lat_max[found], self.LAT_MAX[envelope[found]])
+
+        # Up to a day of rotation in either direction
+        lon_min = lon_min - MAX_ROTATION_RATE - ENVELOPE_MARGIN
+        lon_max = lon_max + MAX_ROTATION_RATE + ENVELOPE_MARGIN
+        lat_min = lat_min - ENVELOPE_MARGIN
+        lat_max = lat_max + ENVELOPE_MARGIN
+
+        return lon_min, lat_min, lon_max, lat_max, known
+
+    def get_possible_pairs(
+        self, harpnums, epochs, cme_pas, cme_widths, cme_halo, extra_width
+    ) -> np.ndarray:
+        """
+        Mask of the CME-HARPS pairs that may be spatially consistent, i.e.
+        HARPS PA within CME_PA +- (CME_WIDTH / 2 + extra_width) for some
+        position the HARPS can have. False only when that is impossible.
+
+        Halo CMEs are never discarded, any on-disk position can be within the
+        halo distance criterion.
+        """
+        cme_pas = np.asarray(cme_pas, dtype=float)
+        half_widths = np.asarray(cme_widths, dtype=float) / 2 + extra_width
+        cme_halo = np.asarray(cme_halo, dtype=bool)
+
+        lon_min, lat_min, lon_max, lat_max, known = self.get_reachable_boxes(
+            harpnums, epochs
+        )
+
+        # Rectangles containing the disk centre can have any PA, and the
+        # corners only give the PA extremes for rectangles within +-90 deg
+        contains_centre = (lon_min <= 0) & (lon_max >= 0) & (lat_min <= 0) & (lat_max >= 0)
+        on_disk = (lon_min >= -90) & (lon_max <= 90)
+
+        can_discard = (
+            known
+            & on_disk
+            & ~contains_centre
+            & ~cme_halo
+            & np.isfinite(cme_pas)
+            & (half_widths < 180)
+        )
+
+        # Pairs that can't be discarded get a dummy rectangle (avoids infinities)
+        lon_min, lat_min, lon_max, lat_max = [
+            np.where(can_discard, bound, default)
+            for bound, default in zip([lon_min, lat_min, lon_max, lat_max], [10, 10, 20, 20])
+        ]
+
+        # PA of the rectangle centre and of its corners. The rectangle is in a
+        # half plane, so its PAs are an arc of at most 180 deg around the centre
+        reference_pa = get_position_angle(
+            *get_cartesian_coords((lon_min + lon_max) / 2, (lat_min + lat_max) / 2)
+        )
+
+        min_offset = np.full(len(cme_pas), np.inf)
+        max_offset = np.full(len(cme_pas), -np.inf)
+
+        for lon in [lon_min, lon_max]:
+            for lat in [lat_min, lat_max]:
+                corner_pa = get_position_angle(*get_cartesian_coords(lon, lat))
+                offset = (corner_pa - reference_pa + 180) % 360 - 180
+
+                min_offset = np.minimum(min_offset, offset)
+                max_offset = np.maximum(max_offset, offset)
+
+        # Angular distance from the CME PA to the arc of possible PAs
+        cme_offset = (cme_pas - reference_pa + 180) % 360 - 180
+
+        pa_distance = np.where(
+            cme_offset < min_offset,
+            np.minimum(min_offset - cme_offset, 360 - (max_offset - cme_offset)),
+            np.where(
+                cme_offset > max_offset,
+                np.minimum(cme_offset - max_offset, 360 - (cme_offset - min_offset)),
+                0,
+            ),
+        )
+
+        impossible = pa_distance >= half_widths + ENVELOPE_MARGIN
+
+        return ~(can_discard & impossible)
@@ -0,0 +1,108 @@
+from src.harps.envelopes import HarpsDailyEnvelopes, SECONDS_PER_DAY
+from src.cmesrc.classes import BoundingBoxArray
+from src.cmesrc.utils import get_closest_record_indices
+from src.cmes.cmes import get_pa_diffs
+from astropy.time import Time
+import numpy as np
+
+EXTRA_CME_WIDTH = 10
+DAY = 15000
+
+def get_envelopes(harpnums, epochs, lon_min, lat_min, lon_max, lat_max):
+    harpnums = np.asarray(harpnums)
+    days = np.asarray(epochs) // SECONDS_PER_DAY
+    keys = np.unique(np.stack([harpnums, days]), axis=1)
+
+    envelopes = []
+
+    for harpnum, day in keys.T:
+        mask = (harpnums == harpnum) & (days == day)
+        envelopes.append([
+            harpnum,
+            day,
+            np.min(lon_min[mask]),
+            np.min(lat_min[mask]),
+            np.max(lon_max[mask]),
+            np.max(lat_max[mask]),
+            ])
+
+    return HarpsDailyEnvelopes(*np.array(envelopes).T)
+
+def test_opposite_pa_is_pruned_and_halo_is_kept():
+    # HARPS at ~(40, 20) deg, on the west limb side (PA ~ 300 deg)
+    epochs = DAY * SECONDS_PER_DAY + np.array([0, 43200])
+    envelopes = get_envelopes(
+        [1, 1], epochs, np.array([38, 40]), np.array([18, 18]), np.array([42, 44]), np.array([22, 22])
+    )
+
+    cme_epoch = DAY * SECONDS_PER_DAY + 3600
+
+    keep = envelopes.get_possible_pairs(
+        [1, 1, 1, 2],
+        [cme_epoch, cme_epoch, cme_epoch, cme_epoch],
+        [90, 300, np.nan, 90],
+        [20, 20, 360, 20],
+        [False, False, True, False],
+        EXTRA_CME_WIDTH,
+    )
+
+    assert np.all(keep == [False, True, True, True])
+
+def test_pruned_pairs_are_never_spatially_consistent():
+    rng = np.random.default_rng(0)
+
+    n_harps = 12
+    records_per_harps = 12
+    start = DAY * SECONDS_PER_DAY
+
+    harpnums = np.repeat(np.arange(n_harps), records_per_harps)
+    epochs = start + np.tile(np.arange(records_per_harps) * 6 * 3600, n_harps)
+
+    lon_cen = np.repeat(rng.uniform(-70, 20, n_harps), records_per_harps)
+    lat_cen = np.repeat(rng.uniform(-30, 30, n_harps), records_per_harps)
+    lon_cen = lon_cen + (epochs - start) / SECONDS_PER_DAY * 13
+    half_size = np.repeat(rng.uniform(1, 5, n_harps), records_per_harps)
+
+    lon_min, lon_max = lon_cen - half_size, lon_cen + half_size
+    lat_min, lat_max = lat_cen - half_size, lat_cen + half_size
+
+    envelopes = get_envelopes(harpnums, epochs, lon_min, lat_min, lon_max, lat_max)
+
+    n_cmes = 40
+    cme_epochs = start + rng.integers(0, records_per_harps * 6 * 3600, n_cmes)
+    cme_pas = rng.uniform(0, 360, n_cmes)
+    cme_widths = rng.uniform(10, 120, n_cmes)
+
+    pair_cmes = np.repeat(np.arange(n_cmes), n_harps)
+    pair_harps = np.tile(np.arange(n_harps), n_cmes)
+
+    keep = envelopes.get_possible_pairs(
+        pair_harps,
+        cme_epochs[pair_cmes],
+        cme_pas[pair_cmes],
+        cme_widths[pair_cmes],
+        np.zeros(len(pair_cmes), dtype=bool),
+        EXTRA_CME_WIDTH,
+    )
+
+    # Same positions as spatial matching: closest record rotated to the CME
+    closest = get_closest_record_indices(harpnums, epochs, pair_harps, cme_epochs[pair_cmes])
+
+    records = BoundingBoxArray(
+        Time(epochs[closest], format="unix").iso,
+        lon_min[closest],
+        lat_min[closest],
+        lon_max[closest],
+        lat_max[closest],
+    )
+    rotated = records.rotate_bbox(Time(cme_epochs[pair_cmes], format="unix").iso)
+
+    pa_diffs = get_pa_diffs(
+        rotated.get_position_angle(), cme_pas[pair_cmes], np.zeros(len(pair_cmes), dtype=bool)
+    )
+    consistent = pa_diffs < cme_widths[pair_cmes] / 2 + EXTRA_CME_WIDTH
+
+    assert np.all([
+        np.sum(~keep) > 0,
+        not np.any(consistent & ~keep)
+        ])
@@ -1,34 +1,55 @@
 import sys
-from tqdm import tqdm
-import bisect
-from datetime import datetime, timedelta
+import argparse
+import numpy as np
 import pandas as pd
-import sqlite3
-import subprocess
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
 from src.cmesrc.config import (
     CMESRC_DB,
     CMESRC_BBOXES,
-    HARPNUM_TO_NOAA,
     LASCO_CME_DATABASE,
-    SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_PICKLE,
+    SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS,
     DIMMINGS_MATCHED_TO_HARPS_PICKLE,
+    OFF_DISK_DIMMINGS_MATCHED_TO_HARPS_PICKLE,
     FLARES_MATCHED_TO_HARPS_PICKLE,
+    GOES_FLARES_MATCHED_TO_HARPS_PICKLE,
 )
-from src.cmesrc.utils import read_SWAN_filepath, filepaths_updated_swan_data
+from src.cmesrc.utils import (
+    backup_sql_to_file,
+    read_sql_to_memory,
+    get_sql_rounded_timestamp,
+    to_epoch,
+)
+from src.flares.flare_index import FlareLabelIndex
+from src.flares.flares import get_duplicate_flares
+from src.cmesrc.chunked import iter_chunks
+from src.cmesrc.association import associate_events, get_top_choices
 
 
 def clear_screen():
     os.system("cls" if os.name == "nt" else "clear")
 
 
-# Copy CMESRC_BBOXES to CMESRC_DB
-os.system(f"cp {CMESRC_BBOXES} {CMESRC_DB}")
+parser = argparse.ArgumentParser(
+    description="Builds cmesrc.db from the outputs of the matching stages"
+)
+parser.add_argument(
+    "--off-disk-dimmings",
+    action="store_true",
+    help="Load the off-disk dimmings matched by match_off_disk_dimmings_to_harps.py",
+)
+parser.add_argument(
+    "--goes-flares",
+    action="store_true",
+    help="Load the GOES flares matched by match_goes_flares_to_harps.py",
+)
+args = parser.parse_args()
 
-# Create CMESRC_BBOXES
-new_conn = sqlite3.connect(CMESRC_DB)
+
+# The catalogue is built in memory, starting from a copy of CMESRC_BBOXES,
+# and only written to CMESRC_DB once it's complete
+new_conn = read_sql_to_memory(CMESRC_BBOXES)
 new_cur = new_conn.cursor()
 
 clear_screen()
@@ -62,22 +83,23 @@ for i, row in no_duplicates.drop_duplicates(subset=["CME_ID"], keep="first").ite
 
 # Spatially consistent CME-HARP associations
 
-df = pd.read_pickle(SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_PICKLE)
-df = df[df["HARPS_SPAT_CONSIST"]]
+# Written in chunks by spatial_matching.py, read one chunk at a time
+for df in iter_chunks(SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS):
+    df = df[df["HARPS_SPAT_CONSIST"]]
 
-for cme_id, harpnum in df[["CME_ID", "HARPNUM"]].values:
-    cme_id = int(cme_id[2:])
-    harpnum = int(harpnum)
+    for cme_id, harpnum in df[["CME_ID", "HARPNUM"]].values:
+        cme_id = int(cme_id[2:])
+        harpnum = int(harpnum)
 
-    # Add the match to CMES_HARPS_SPATIALLY_CONSIST
+        # Add the match to CMES_HARPS_SPATIALLY_CONSIST
 
-    new_cur.execute(
-        """
-                INSERT INTO CMES_HARPS_SPATIALLY_CONSIST (harpnum, cme_id)
-                VALUES (?, ?)
-                """,
-        (harpnum, cme_id),
-    )
+        new_cur.execute(
+            """
+                    INSERT INTO CMES_HARPS_SPATIALLY_CONSIST (harpnum, cme_id)
+                    VALUES (?, ?)
+                    """,
+            (harpnum, cme_id),
+        )
 
 new_conn.commit()
 
@@ -105,6 +127,33 @@ for i, row in dimmings[dimmings["MATCH"]].iterrows():
 
 new_conn.commit()
 
+# Off-disk dimmings, matched to near-limb HARPS by position angle. Their
+# table is separate since they have no longitude or latitude. Only loaded when
+# asked for, so a stale output of the stage is never picked up
+
+if args.off_disk_dimmings:
+    off_disk_dimmings = pd.read_pickle(OFF_DISK_DIMMINGS_MATCHED_TO_HARPS_PICKLE)
+    off_disk_dimmings = off_disk_dimmings[off_disk_dimmings["MATCH"]]
+
+    new_cur.executemany(
+        """
+        INSERT INTO OFF_DISK_DIMMINGS (dimming_id, harpnum, harps_dimming_pa_diff, dimming_start_date, dimming_peak_date, dimming_x, dimming_y, dimming_pa)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        zip(
+            off_disk_dimmings["dimming_id"].astype(int).to_list(),
+            off_disk_dimmings["HARPNUM"].astype(int).to_list(),
+            off_disk_dimmings["HARPS_DIMMING_PA_DIFF"].astype(float).to_list(),
+            off_disk_dimmings["start_time"].astype(str).str.split(".").str[0].to_list(),
+            off_disk_dimmings["max_detection_time"].astype(str).str.split(".").str[0].to_list(),
+            off_disk_dimmings["DIMMING_X"].astype(float).to_list(),
+            off_disk_dimmings["DIMMING_Y"].astype(float).to_list(),
+            off_disk_dimmings["DIMMING_PA"].astype(float).to_list(),
+        ),
+    )
+
+    new_conn.commit()
+
 # Now flares
 flares = pd.read_pickle(FLARES_MATCHED_TO_HARPS_PICKLE)
 
@@ -130,97 +179,85 @@ for i, row in flares.iterrows():
 
 new_conn.commit()
 
-# Now calculate their closest processed_harps_bbox timestamps
-# Note it says "image_timestamps" because originally I was doing it
-# with SDOML images but it's more appropriate to do it with
-# SHARP timestamps
-# So in the database they are still referred to as image_timestamp but they're
-# SHARPs timestamps
-
-print("Calculating closest timestamps for dimmings, flares and CMEs...")
-
+# GOES flares matched by match_goes_flares_to_harps.py, only loaded when
+# asked for. The SWAN-SF flares take precedence: GOES flares already in the
+# table as the same flare (HARPS, peak time and class), under any id, are
+# left out. Any other GOES flare with the id of a SWAN-SF flare is a
+# different flare and can't be stored under that id, so it raises
 
-def closest_timestamp(target, sorted_timestamps):
-    index = bisect.bisect_left(sorted_timestamps, target)
-    if index == 0:
-        return sorted_timestamps[0]
-    if index == len(sorted_timestamps):
-        return sorted_timestamps[-1]
-    before = sorted_timestamps[index - 1]
-    after = sorted_timestamps[index]
-    if after - target < target - before:
-        return after
-    else:
-        return before
+if args.goes_flares:
+    goes_flares = pd.read_pickle(GOES_FLARES_MATCHED_TO_HARPS_PICKLE)
 
+    loaded_flares = pd.read_sql(
+        "SELECT harpnum, flare_date, flare_class_score FROM FLARES WHERE harpnum IS NOT NULL",
+        new_conn,
+    )
 
-def formatted_timestamp(timestamp):
-    """
-    Format it to be the same hour and the closest minutes out
-    of 00, 12, 24, 36, 48
+    duplicate_flares = get_duplicate_flares(
+        goes_flares["HARPNUM"].to_numpy(),
+        to_epoch(goes_flares["FLARE_DATE"].to_numpy()),
+        goes_flares["FLARE_CLASS_SCORE"].to_numpy(),
+        loaded_flares["harpnum"].to_numpy(),
+        to_epoch(loaded_flares["flare_date"].to_numpy()),
+        loaded_flares["flare_class_score"].to_numpy(),
+    )
 
-    Using datetime
-    """
-    minutes = [0, 12, 24, 36, 48]
+    print(f"GOES FLARES ALREADY IN SWAN-SF: {np.sum(duplicate_flares)}")
 
-    # Check if already is a datetime
-    if not isinstance(timestamp, datetime):
-        datetime_timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-    else:
-        datetime_timestamp = timestamp
+    goes_flares = goes_flares[~duplicate_flares]
 
-    # The candidate timestamps will be either same timestamp but
-    # with 00 minutes, 12 minutes, 36 minutes, 48 minutes or the next hour with 00 minutes
-    # All with 0 seconds
+    loaded_flare_ids = pd.read_sql("SELECT flare_id FROM FLARES", new_conn)["flare_id"]
+    colliding_flares = goes_flares["FLARE_ID"].isin(loaded_flare_ids).to_numpy()
 
-    candidate_timestamps = [
-        datetime_timestamp.replace(minute=minute).replace(second=0)
-        for minute in minutes
-    ]
+    if np.any(colliding_flares):
+        print(goes_flares[colliding_flares].sort_values("FLARE_ID"))
+        raise ValueError("GOES flares with the id of a different SWAN-SF flare found")
 
-    candidate_timestamps.append(
-        datetime_timestamp.replace(minute=0).replace(second=0) + timedelta(hours=1)
+    new_cur.executemany(
+        """
+        INSERT INTO flares (flare_id, HARPNUM, flare_date, flare_lon, flare_lat, flare_class_score, flare_class, flare_ar, flare_ar_source, flare_verification)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        zip(
+            goes_flares["FLARE_ID"].astype(int).to_list(),
+            goes_flares["HARPNUM"].astype(int).to_list(),
+            [flare_date.iso[:-4] for flare_date in goes_flares["FLARE_DATE"]],
+            goes_flares["FLARE_LON"].astype(object).where(goes_flares["FLARE_LON"].notna(), None).to_list(),
+            goes_flares["FLARE_LAT"].astype(object).where(goes_flares["FLARE_LAT"].notna(), None).to_list(),
+            goes_flares["FLARE_CLASS_SCORE"].astype(float).to_list(),
+            goes_flares["FLARE_CLASS"].to_list(),
+            goes_flares["FLARE_AR"].astype(object).where(goes_flares["FLARE_AR"].notna(), None).to_list(),
+            goes_flares["FLARE_AR_SOURCE"].to_list(),
+            goes_flares["FLARE_VERIFICATION"].to_list(),
+        ),
     )
 
-    # Sort them
-
-    candidate_timestamps = sorted(candidate_timestamps)
+    new_conn.commit()
 
-    # Now we use bisect to find the closest minute
-
-    new_timestamp = closest_timestamp(datetime_timestamp, candidate_timestamps)
+# Now calculate their closest processed_harps_bbox timestamps
+# Note it says "image_timestamps" because originally I was doing it
+# with SDOML images but it's more appropriate to do it with
+# SHARP timestamps
+# So in the database they are still referred to as image_timestamp but they're
+# SHARPs timestamps
 
-    return new_timestamp
+print("Calculating closest timestamps for dimmings, flares and CMEs...")
 
 
-# Dimmings
-for row in tqdm(
-    new_cur.execute("SELECT dimming_id, dimming_start_date FROM dimmings").fetchall()
-):
-    dimming_timestamp = datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")
-    image_timestamp = formatted_timestamp(dimming_timestamp)
+def update_image_timestamps(table, date_column):
+    """
+    Sets the image_timestamp of every row of the table to its date rounded to
+    the nearest SHARP cadence (the earlier one on ties), computed by SQLite in
+    a single UPDATE.
+    """
     new_cur.execute(
-        "UPDATE dimmings SET image_timestamp = ? WHERE dimming_id = ?",
-        (image_timestamp.strftime("%Y-%m-%d %H:%M:%S"), row[0]),
+        f"UPDATE {table} SET image_timestamp = {get_sql_rounded_timestamp(date_column)}"
     )
 
-# Same for flares
-for row in tqdm(new_cur.execute("SELECT flare_id, flare_date FROM flares").fetchall()):
-    flare_timestamp = datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")
-    image_timestamp = formatted_timestamp(flare_timestamp)
-    new_cur.execute(
-        "UPDATE flares SET image_timestamp = ? WHERE flare_id = ?",
-        (image_timestamp.strftime("%Y-%m-%d %H:%M:%S"), row[0]),
-    )
 
-# And for cmes
-for row in tqdm(new_cur.execute("SELECT cme_id, cme_date FROM cmes").fetchall()):
-    cme_timestamp = datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")
-    image_timestamp = formatted_timestamp(cme_timestamp)
-    new_cur.execute(
-        "UPDATE cmes SET image_timestamp = ? WHERE cme_id = ?",
-        (image_timestamp.strftime("%Y-%m-%d %H:%M:%S"), row[0]),
-    )
+update_image_timestamps("dimmings", "dimming_start_date")
+update_image_timestamps("flares", "flare_date")
+update_image_timestamps("cmes", "cme_date")
 
 new_conn.commit()
 
@@ -232,235 +269,179 @@ print("Associating dimmings, flares and CMEs")
 association_threshold = 2.01
 min_time_before = 12 / 60
 
-results = {}
+# All the verified flares, indexed by HARPS and sorted by time, read at once.
+# They must be walked in time order: in flare id (rowid) order, an old flare
+# labelled after a recent one ended the walk back from a CME before the
+# recent one was reached
+verified_flares = pd.read_sql(
+    "SELECT flare_id, harpnum, flare_date, flare_class_score FROM FLARES WHERE harpnum IS NOT NULL AND flare_verification != 'Non-verified'",
+    new_conn,
+)
+flare_label_index = FlareLabelIndex(
+    verified_flares["flare_id"].to_numpy(),
+    verified_flares["harpnum"].to_numpy(),
+    to_epoch(verified_flares["flare_date"].to_numpy()),
+    verified_flares["flare_class_score"].to_numpy(),
+)
+flare_order = flare_label_index.HARPS_ORDER
 
-harps = new_cur.execute("SELECT DISTINCT harpnum from PROCESSED_HARPS_BBOX").fetchall()
+# All the dimmings and the spatially consistent CMEs of the HARPS with
+# bounding boxes, sorted by HARPS and time (and id on ties)
+dimmings_data = pd.read_sql(
+    "SELECT dimming_id, harpnum, dimming_start_date FROM DIMMINGS WHERE harpnum IS NOT NULL",
+    new_conn,
+)
+dimming_epochs = to_epoch(dimmings_data["dimming_start_date"].to_numpy())
+dimming_order = np.lexsort(
+    (dimmings_data["dimming_id"].to_numpy(), dimming_epochs, dimmings_data["harpnum"].to_numpy())
+)
 
-new_cur.execute("DELETE FROM CMES_HARPS_EVENTS")
+present_at_cme_data = pd.read_sql(
+    """
+    SELECT sch.harpnum, c.cme_id, c.cme_date from CMES_HARPS_SPATIALLY_CONSIST as sch
+    INNER JOIN CMES as c
+    ON sch.cme_id = c.cme_id
+    WHERE sch.harpnum IN (SELECT DISTINCT harpnum from PROCESSED_HARPS_BBOX)
+    """,
+    new_conn,
+)
+cme_epochs = to_epoch(present_at_cme_data["cme_date"].to_numpy())
+cme_order = np.lexsort(
+    (present_at_cme_data["cme_id"].to_numpy(), cme_epochs, present_at_cme_data["harpnum"].to_numpy())
+)
+cme_harpnums = present_at_cme_data["harpnum"].to_numpy()[cme_order]
+cme_epochs = cme_epochs[cme_order]
+
+# Each CME takes, out of the events of its HARPS between min_time_before and
+# association_threshold hours before it and not used by an earlier CME, the
+# flare with the highest class (then the closest) and the closest dimming
+
+flare_positions, flare_seconds_diffs = associate_events(
+    flare_label_index.HARPNUMS[flare_order],
+    flare_label_index.EPOCHS[flare_order],
+    cme_harpnums,
+    cme_epochs,
+    min_time_before * 3600,
+    association_threshold * 3600,
+    event_ranks=-flare_label_index.CLASS_SCORES[flare_order],
+)
 
-for harp in tqdm(harps):
-    harp = harp[0]
+dimming_positions, dimming_seconds_diffs = associate_events(
+    dimmings_data["harpnum"].to_numpy()[dimming_order],
+    dimming_epochs[dimming_order],
+    cme_harpnums,
+    cme_epochs,
+    min_time_before * 3600,
+    association_threshold * 3600,
+)
 
-    flare_data = new_cur.execute(
-        "SELECT flare_date, flare_id, flare_class_score FROM FLARES WHERE harpnum = ? AND flare_verification != 'Non-verified'",
-        (harp,),
-    ).fetchall()
-    flare_timestamps, flare_ids, flare_class_scores = (
-        zip(*flare_data) if flare_data else ([], [], [])
-    )
+has_flare = flare_positions >= 0
+has_dimming = dimming_positions >= 0
 
-    dimming_data = new_cur.execute(
-        "SELECT dimming_start_date, dimming_id FROM DIMMINGS WHERE harpnum = ?", (harp,)
-    ).fetchall()
-    dimming_timestamps, dimming_ids = zip(*dimming_data) if dimming_data else ([], [])
+closest_flare_ids = np.full(len(cme_epochs), None, dtype=object)
+closest_flare_ids[has_flare] = flare_label_index.FLARE_IDS[flare_order][
+    flare_positions[has_flare]
+].tolist()
 
-    present_at_cme_data = new_cur.execute(
-        """
-        SELECT c.cme_date, c.cme_id from CMES_HARPS_SPATIALLY_CONSIST as sch
-        INNER JOIN CMES as c
-        ON sch.cme_id = c.cme_id
-        WHERE sch.harpnum = ? 
-    """,
-        (harp,),
-    ).fetchall()
-    present_at_cme_timestamps, present_at_cme_ids = (
-        zip(*present_at_cme_data) if present_at_cme_data else ([], [])
-    )
+closest_dimming_ids = np.full(len(cme_epochs), None, dtype=object)
+closest_dimming_ids[has_dimming] = dimmings_data["dimming_id"].to_numpy()[dimming_order][
+    dimming_positions[has_dimming]
+].tolist()
 
-    # Convert to datetime objects
-    flare_timestamps = [
-        datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in flare_timestamps
-    ]
-    dimming_timestamps = [
-        datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in dimming_timestamps
-    ]
-    present_at_cme_timestamps = [
-        datetime.strptime(t, "%Y-%m-%d %H:%M:%S") for t in present_at_cme_timestamps
-    ]
-
-    used_flare_ids = set()
-    used_dimming_ids = set()
-
-    for cme_timestamp, cme_id in zip(present_at_cme_timestamps, present_at_cme_ids):
-        # For Flares
-        closest_flare_id = None
-        closest_flare_hours_diff = -1
-        if flare_timestamps:
-            flare_index = bisect.bisect_right(flare_timestamps, cme_timestamp)
-            matching_flares = []
-
-            while flare_index > 0:
-                flare_index -= 1
-                flare_timestamp = flare_timestamps[flare_index]
-                hour_diff = (cme_timestamp - flare_timestamp).total_seconds() / 3600
-                if min_time_before < hour_diff < association_threshold:
-                    if flare_ids[flare_index] not in used_flare_ids:
-                        used_flare_ids.add(flare_ids[flare_index])
-                        matching_flares.append(
-                            (
-                                hour_diff,
-                                flare_ids[flare_index],
-                                flare_class_scores[flare_index],
-                            )
-                        )
-                elif hour_diff > association_threshold:
-                    break
-
-            if matching_flares:
-                closest_flare = sorted(matching_flares, key=lambda x: (-x[2], x[0]))[0]
-                closest_flare_hours_diff, closest_flare_id, _ = closest_flare
-
-        # For Dimmings
-        closest_dimming_id = None
-        closest_dimming_hours_diff = -1
-        if dimming_timestamps:
-            dimming_index = bisect.bisect_right(dimming_timestamps, cme_timestamp)
-            matching_dimmings = []
-
-            while dimming_index > 0:
-                dimming_index -= 1
-                dimming_timestamp = dimming_timestamps[dimming_index]
-                hour_diff = (cme_timestamp - dimming_timestamp).total_seconds() / 3600
-                if min_time_before < hour_diff < association_threshold:
-                    if dimming_ids[dimming_index] not in used_dimming_ids:
-                        used_dimming_ids.add(dimming_ids[dimming_index])
-                        matching_dimmings.append(
-                            (hour_diff, dimming_ids[dimming_index])
-                        )
-                elif hour_diff > association_threshold:
-                    break
-
-            if matching_dimmings:
-                closest_dimming = min(matching_dimmings, key=lambda x: x[0])
-                closest_dimming_hours_diff, closest_dimming_id = closest_dimming
-
-        results[(harp, cme_id)] = {
-            "closest_flare_id": closest_flare_id,
-            "closest_flare_hours_diff": closest_flare_hours_diff,
-            "closest_dimming_id": closest_dimming_id,
-            "closest_dimming_hours_diff": closest_dimming_hours_diff,
-        }
-
-for (harp, cme_id), event in tqdm(results.items()):
-    new_cur.execute(
-        """
-        INSERT INTO CMES_HARPS_EVENTS (harpnum, cme_id, flare_id, flare_hours_diff, dimming_id, dimming_hours_diff)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """,
-        (
-            harp,
-            cme_id,
-            event["closest_flare_id"],
-            event["closest_flare_hours_diff"],
-            event["closest_dimming_id"],
-            event["closest_dimming_hours_diff"],
-        ),
-    )
+new_cur.execute("DELETE FROM CMES_HARPS_EVENTS")
+
+new_cur.executemany(
+    """
+    INSERT INTO CMES_HARPS_EVENTS (harpnum, cme_id, flare_id, flare_hours_diff, dimming_id, dimming_hours_diff)
+    VALUES (?, ?, ?, ?, ?, ?)
+""",
+    zip(
+        cme_harpnums.tolist(),
+        present_at_cme_data["cme_id"].to_numpy()[cme_order].tolist(),
+        closest_flare_ids.tolist(),
+        np.where(has_flare, flare_seconds_diffs / 3600, -1).tolist(),
+        closest_dimming_ids.tolist(),
+        np.where(has_dimming, dimming_seconds_diffs / 3600, -1).tolist(),
+    ),
+)
 
 new_conn.commit()
 
 # Now in order to find every match we can choose all rows for each CME and sort
 # first by which have a dimming and then by flare class
 
-# Let's see how many potential matches there are
-
-unique_cmes = new_cur.execute(
-    "SELECT DISTINCT cme_id from CMES_HARPS_SPATIALLY_CONSIST"
-).fetchall()
-
-# Now let's get the matches
-
 
 def get_verfification_level(has_dimming, has_flare, flare_class, flare_threshold=25):
-    if has_dimming:
-        if has_flare:
-            if flare_class > flare_threshold:
-                return 1
-            else:
-                return 3
-        else:
-            return 5
-    else:
-        if has_flare:
-            if flare_class > flare_threshold:
-                return 2
-            else:
-                return 4
-        else:
-            return -1
-
-
-def verif_level_from_row(row):
-    has_dimming = row["has_dimming"]
-    has_flare = 0 if pd.isnull(row["flare_id"]) else 1
-    flare_class = (
-        None if pd.isnull(row["flare_class_score"]) else row["flare_class_score"]
+    """
+    Verification level of CME-HARP candidates, from 1 (dimming and a flare
+    above the threshold) to 5 (only a dimming), -1 without events. Takes
+    scalars or arrays.
+    """
+    has_dimming = np.asarray(has_dimming, dtype=bool)
+    has_flare = np.asarray(has_flare, dtype=bool)
+    strong_flare = has_flare & (np.asarray(flare_class, dtype=float) > flare_threshold)
+
+    return np.select(
+        [
+            has_dimming & strong_flare,
+            has_dimming & has_flare,
+            has_dimming,
+            strong_flare,
+            has_flare,
+        ],
+        [1, 3, 5, 2, 4],
+        default=-1,
     )
-    harpnum = row["harpnum"]
 
-    return get_verfification_level(has_dimming, has_flare, flare_class)
 
+# All the candidates of all the CMEs in one query, in table order within
+# each CME
 
-matches = dict()
-
-for unique_cme in tqdm(unique_cmes):
-    query = f"""
+candidates = pd.read_sql(
+    """
     SELECT CHSC.cme_id, CHSC.harpnum, CHE.flare_id, CHE.dimming_id, F.flare_class_score from CMES_HARPS_SPATIALLY_CONSIST CHSC
     LEFT JOIN CMES_HARPS_EVENTS CHE ON CHSC.cme_id = CHE.cme_id AND CHSC.harpnum = CHE.harpnum
     LEFT JOIN FLARES F ON CHE.flare_id = F.flare_id
-    WHERE CHSC.cme_id = {unique_cme[0]}
-    """
-
-    df = pd.read_sql_query(query, new_conn)
-
-    # Need to replace dimming_id here with either 0 or 1
-
-    df["has_dimming"] = df["dimming_id"].apply(lambda x: 0 if pd.isnull(x) else 1)
-
-    sorted_df = df.sort_values(by=["has_dimming", "flare_class_score"], ascending=False)
-
-    # Apply verif_level_from_row to each row
-
-    df["verif_level"] = df.apply(verif_level_from_row, axis=1)
-
-    sorted_df = df.sort_values(by=["verif_level"], ascending=True)
-
-    # But we don't want verification level -1
-
-    sorted_df = sorted_df[sorted_df["verif_level"] != -1]
-
-    # And if this is empty, well there's no match so we continue
-
-    if sorted_df.empty:
-        continue
+    ORDER BY CHSC.cme_id, CHSC.rowid
+    """,
+    new_conn,
+)
 
-    # Otherwise we can continue
+verif_levels = get_verfification_level(
+    candidates["dimming_id"].notna().to_numpy(),
+    candidates["flare_id"].notna().to_numpy(),
+    candidates["flare_class_score"].to_numpy(dtype=float),
+)
 
-    top_choice = sorted_df.iloc[0]
+# But we don't want verification level -1. The top choice of each CME is the
+# candidate with the lowest level. On ties it's the first one in table order;
+# the per-CME loop this replaced sorted with an unstable sort, so its choice on
+# ties wasn't defined
 
-    verification_level = top_choice["verif_level"]
-    harpnum = top_choice["harpnum"]
+cme_ids = candidates["cme_id"].to_numpy()
+top_choices = get_top_choices(cme_ids, verif_levels)
 
-    # There's a match!
-    matches[unique_cme[0]] = {
-        "harpnum": harpnum,
-        "verification_level": verification_level,
-    }
+association_method = "automatic"
+independent_verfied = 0
 
 new_cur.execute("DELETE FROM FINAL_CME_HARP_ASSOCIATIONS")
 
-# Iterate through key, value pairs of matches
-for cme_id, values in tqdm(matches.items()):
-    harpnum = int(values["harpnum"])
-    verification_score = int(values["verification_level"])
+new_cur.executemany(
+    "INSERT INTO FINAL_CME_HARP_ASSOCIATIONS (cme_id, harpnum, verification_score, association_method, independent_verified) VALUES (?, ?, ?, ?, ?)",
+    (
+        (cme_id, harpnum, verification_score, association_method, independent_verfied)
+        for cme_id, harpnum, verification_score in zip(
+            cme_ids[top_choices].tolist(),
+            candidates["harpnum"].to_numpy()[top_choices].tolist(),
+            verif_levels[top_choices].tolist(),
+        )
+    ),
+)
 
-    association_method = "automatic"
-    independent_verfied = 0
+new_conn.commit()
 
-    # Add to database
-    new_cur.execute(
-        "INSERT INTO FINAL_CME_HARP_ASSOCIATIONS (cme_id, harpnum, verification_score, association_method, independent_verified) VALUES (?, ?, ?, ?, ?)",
-        (cme_id, harpnum, verification_score, association_method, independent_verfied),
-    )
+# Write the whole catalogue to CMESRC_DB in a single backup
 
-new_conn.commit()
+print("Saving catalogue")
+
+backup_sql_to_file(new_conn, CMESRC_DB)
@@ -1,10 +1,15 @@
-from src.cmesrc.utils import read_SWAN_filepath, filepaths_updated_swan_data
+from src.cmesrc.utils import (
+    filepaths_updated_swan_data,
+    create_processed_harps_ephemeris,
+    load_swan_subset,
+)
 """
 This script prepares the database for the CMESRC project by:
 1. Creating necessary tables.
 2. Loading data from SWAN files into the database.
 3. Calculating areas and overlaps for HARPS.
 4. Processing HARPS bounding boxes.
+5. Precomputing the derived HARPS positions (ephemeris) used by the matching stages.
 """
 
 import sys
@@ -12,6 +17,8 @@ from tqdm import tqdm
 import pandas as pd
 import sqlite3
 import os
+import tempfile
+import concurrent.futures
 
 
 def clear_screen():
@@ -24,486 +31,553 @@ from src.cmesrc.config import (
     CMESRC_BBOXES,
     CMESRC_DB,
     HARPNUM_TO_NOAA,
+    INTERIM_DATA_DIR,
 )
 
-# Print a message to indicate the start of the pre-data loading script
-print("Pre-data loading script")
+# Number of processes parsing SWAN files. Each one writes to its own staging
+# database because SQLite only allows a single writer.
+N_INGESTION_WORKERS = 4
 
-# If the script is called by 'make all', it means we need to recreate the database
-if os.path.exists(CMESRC_BBOXES):
-    os.remove(CMESRC_BBOXES)
-if os.path.exists(CMESRC_DB):
-    os.remove(CMESRC_DB)
 
-# Create the CMESRC_BBOXES database if it doesn't exist
-new_conn = sqlite3.connect(CMESRC_BBOXES)
-new_cur = new_conn.cursor()
+def main():
+    # Print a message to indicate the start of the pre-data loading script
+    print("Pre-data loading script")
 
-new_cur.executescript(
-    """
-CREATE TABLE HARPS (
-  harpnum INTEGER PRIMARY KEY,                    -- Unique identifier for each HARP region
-  start TEXT NOT NULL, -- Start timestamp of the HARP region
-  end TEXT NOT NULL,  -- End timestamp of the HARP region
-  area FLOAT, -- Refers to the area of the HARP region
-  n_noaas INTEGER, -- Refers to the maximum number of NOAA active regions in the HARP region
-  CHECK (area >= 0),
-  CHECK (end >= start)
-);
-CREATE TABLE CMES (
-  cme_id INTEGER NOT NULL PRIMARY KEY,            -- Unique identifier for each CME
-  cme_date TEXT NOT NULL,                         -- Date and time of the CME
-  cme_pa REAL,                                    -- Position angle of the CME
-  cme_width REAL NOT NULL,                        -- Width of the CME
-  cme_halo INTEGER,                               -- Indicator for Halo CMEs (1 for Halo, else NULL)
-  cme_seen_in INTEGER NOT NULL,                   -- Where the CME was observed (e.g., C2, C3)
-  cme_three_points INTEGER NOT NULL,              -- Number of observed points for the CME
-  cme_quality INTEGER NOT NULL,                   -- Quality rating for the CME observation
-  image_timestamp TEXT, -- Timestamp of the associated image
-  CHECK (
-    ((cme_pa IS NULL) = (cme_halo = 1))           -- Ensure Halo CMEs don't have a position angle
-  )
-);
-CREATE TABLE FLARES (
-  flare_id INTEGER NOT NULL PRIMARY KEY,          -- Unique identifier for each flare
-  harpnum INTEGER REFERENCES HARPS (harpnum),     -- Associated HARP region
-  flare_date TEXT NOT NULL,                       -- Date and time of the flare
-  flare_lon REAL,                                 -- Longitude of the flare
-  flare_lat REAL,                                 -- Latitude of the flare
-  flare_class_score REAL NOT NULL,                -- Score indicating the class of the flare
-  flare_class TEXT NOT NULL,                      -- Class of the flare (e.g., M1, X2)
-  flare_ar INTEGER,                               -- Active Region number of the flare
-  flare_ar_source TEXT,                           -- Source of the Active Region number
-  flare_verification TEXT,                        -- Verification status of the flare information
-  image_timestamp TEXT, -- Timestamp of the associated image
-  CHECK (
-    (flare_ar IS NULL AND flare_lon IS NOT NULL AND flare_lat IS NOT NULL) OR
-    (flare_ar IS NOT NULL)                        -- Ensure either flare_ar or both flare_lon and flare_lat are provided
-  )
-);
-CREATE TABLE RAW_HARPS_BBOX (
-    -- Reference to the harpnum column in the harps table
-    harpnum INTEGER REFERENCES HARPS (harpnum), 
-    -- Reference to the timestamp column in the images table
-    timestamp TEXT, 
-    -- Minimum longitude of BBOX
-    LONDTMIN REAL, 
-    -- Maximum longitude of BBOX
-    LONDTMAX REAL, 
-    -- Minimum latitude of BBOX
-    LATDTMIN REAL, 
-    -- Maximum latitude of BBOX
-    LATDTMAX REAL, 
-    -- Is Rotated Bounding Box? Specifies if the BBOX is calculated using differential solar rotation because it was missing from the SHARP dataset
-    IRBB INTEGER, 
-    -- Is trusted magnetic field data?
-    IS_TMFI INTEGER,
-    PRIMARY KEY (harpnum, timestamp),
-    -- Need to check that the timestamp has minutes 12, 24, 36, 48, or 00
-    CHECK (strftime('%M', timestamp) IN ('12', '24', '36', '48', '00'))
-);
-CREATE TABLE FINAL_CME_HARP_ASSOCIATIONS (
-  cme_id INTEGER UNIQUE NOT NULL REFERENCES CMES(cme_id),                 -- Unique identifier for each CME
-  harpnum INTEGER NOT NULL REFERENCES HARPS(harpnum),                       -- Associated HARP region
-  association_method TEXT NOT NULL,               -- Method used to determine the association
-  verification_score REAL,                        -- Confidence score of the association
-  independent_verified INTEGER NOT NULL DEFAULT 0, -- Verification level for association (0 if only by me, 1 if verified by external)
-  PRIMARY KEY (cme_id, harpnum)                   -- Unique pairing of CME and HARP
-);
-CREATE TABLE OVERLAPS (
-    harpnum_a INTEGER REFERENCES HARPS(harpnum),
-    harpnum_b INTEGER REFERENCES HARPS(harpnum),
-    mean_overlap REAL,
-    mean_pixel_overlap REAL,
-    ocurrence_percentage REAL,
-    pixel_ocurrence_percentage REAL,
-    harpnum_a_area REAL,
-    harpnum_a_pixel_area REAL,
-    harpnum_b_area REAL,
-    coexistence REAL
-);
-CREATE TABLE OVERLAP_RECORDS (
-            harpnum_a INTEGER REFERENCES HARPS(harpnum),
-            harpnum_b INTEGER REFERENCES HARPS(harpnum),
-            decision STRING,
-            mean_overlap REAL,
-            std_overlap REAL,
-            ocurrence_percentage REAL,
-            harpnum_a_area REAL,
-            harpnum_b_area REAL,
-            b_over_a_area_ratio REAL,
-            PRIMARY KEY (harpnum_a, harpnum_b),
-            CHECK (harpnum_a_area < harpnum_b_area),
-            CHECK (decision IN ('MERGED A WITH B', 'DELETED A IN FAVOR OF B'))
-);
-CREATE TABLE PROCESSED_HARPS_BBOX(
-    -- Reference to the harpnum column in the harps table
-    harpnum INTEGER REFERENCES HARPS (harpnum), 
-    -- Reference to the timestamp column in the images table
-    timestamp TEXT, 
-    -- Minimum longitude of BBOX
-    LONDTMIN REAL, 
-    -- Maximum longitude of BBOX
-    LONDTMAX REAL, 
-    -- Minimum latitude of BBOX
-    LATDTMIN REAL, 
-    -- Maximum latitude of BBOX
-    LATDTMAX REAL, 
-    -- Is Rotated Bounding Box? Specifies if the BBOX is calculated using differential solar rotation because it was missing from the SHARP dataset
-    IRBB INTEGER, 
-    -- Is trusted magnetic field data?
-    IS_TMFI INTEGER,
-    PRIMARY KEY (harpnum, timestamp),
-    -- Need to check that the timestamp has minutes 12, 24, 36, 48, or 00
-    CHECK (strftime('%M', timestamp) IN ('12', '24', '36', '48', '00'))
-);
-CREATE TABLE IF NOT EXISTS CMES_HARPS_EVENTS (
-	harpnum	INTEGER,
-	cme_id	INTEGER,
-	flare_id	INTEGER REFERENCES FLARES(flare_id),
-	flare_hours_diff	INTEGER NOT NULL,
-	dimming_id	INTEGER REFERENCES DIMMINGS(dimming_id),
-	dimming_hours_diff	INTEGER NOT NULL,
-	FOREIGN KEY(harpnum,cme_id) REFERENCES CMES_HARPS_SPATIALLY_CONSIST(harpnum,cme_id),
-	PRIMARY KEY(harpnum,cme_id)
-);
-CREATE TABLE IF NOT EXISTS CMES_HARPS_SPATIALLY_CONSIST (
-	harpnum	INTEGER NOT NULL REFERENCES HARPS(harpnum),
-	cme_id	INTEGER NOT NULL REFERENCES CMES(cme_id),
-	PRIMARY KEY(harpnum,cme_id)
-);
-CREATE TABLE IF NOT EXISTS DIMMINGS (
-	dimming_id	INTEGER NOT NULL,
-	harpnum	INTEGER REFERENCES HARPS(harpnum),
-	harps_dimming_dist	REAL NOT NULL,
-	dimming_start_date	TEXT NOT NULL,
-	dimming_peak_date	TEXT NOT NULL,
-	dimming_lon	REAL NOT NULL,
-	dimming_lat	REAL NOT NULL,
-	image_timestamp	TEXT,
-	PRIMARY KEY(dimming_id)
-);
-CREATE TABLE NOAA_HARPNUM_MAPPING (
-        noaa INTEGER,
-        harpnum INTEGER REFERENCES HARPS (harpnum),
-        PRIMARY KEY (noaa, harpnum)
-        );
-CREATE TABLE NOAAS (
-    noaa INTEGER PRIMARY KEY
-);
-"""
-)
+    # If the script is called by 'make all', it means we need to recreate the database
+    if os.path.exists(CMESRC_BBOXES):
+        os.remove(CMESRC_BBOXES)
+    if os.path.exists(CMESRC_DB):
+        os.remove(CMESRC_DB)
 
-new_conn.commit()
-
-# Now, read the data from SWAN files and load it into the database
-
-swan_filepaths = filepaths_updated_swan_data()
-new_cur.execute("DELETE FROM RAW_HARPS_BBOX;")
-
-# tqdm should clear after finishing
-for harpnum in tqdm(
-    swan_filepaths.keys(), desc="Reading SWAN data", unit="HARP", leave=False
-):
-    filepath = swan_filepaths[harpnum]
-    data = read_SWAN_filepath(filepath)
-    # Replace the NaN values with 0
-    data["IS_TMFI"] = data["IS_TMFI"].fillna(0)
-    bbox_data = [
-        (
-            int(harpnum),
-            str(row["Timestamp"])[:-4],
-            float(row["LONDTMIN"]),
-            float(row["LONDTMAX"]),
-            float(row["LATDTMIN"]),
-            float(row["LATDTMAX"]),
-            int(row["IRBB"]),
-            int(row["IS_TMFI"]),
-        )
-        for i, row in data.iterrows()
-    ]
+    # Create the CMESRC_BBOXES database if it doesn't exist
+    new_conn = sqlite3.connect(CMESRC_BBOXES)
+    new_cur = new_conn.cursor()
 
-    # Insert the data into the database RAW_HARPS_BBOX table
-    new_cur.executemany(
+    new_cur.executescript(
         """
-    INSERT INTO RAW_HARPS_BBOX (harpnum, timestamp, LONDTMIN, LONDTMAX, LATDTMIN, LATDTMAX, IRBB, IS_TMFI)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
-    """,
-        bbox_data,
+    CREATE TABLE HARPS (
+      harpnum INTEGER PRIMARY KEY,                    -- Unique identifier for each HARP region
+      start TEXT NOT NULL, -- Start timestamp of the HARP region
+      end TEXT NOT NULL,  -- End timestamp of the HARP region
+      area FLOAT, -- Refers to the area of the HARP region
+      n_noaas INTEGER, -- Refers to the maximum number of NOAA active regions in the HARP region
+      CHECK (area >= 0),
+      CHECK (end >= start)
+    );
+    CREATE TABLE CMES (
+      cme_id INTEGER NOT NULL PRIMARY KEY,            -- Unique identifier for each CME
+      cme_date TEXT NOT NULL,                         -- Date and time of the CME
+      cme_pa REAL,                                    -- Position angle of the CME
+      cme_width REAL NOT NULL,                        -- Width of the CME
+      cme_halo INTEGER,                               -- Indicator for Halo CMEs (1 for Halo, else NULL)
+      cme_seen_in INTEGER NOT NULL,                   -- Where the CME was observed (e.g., C2, C3)
+      cme_three_points INTEGER NOT NULL,              -- Number of observed points for the CME
+      cme_quality INTEGER NOT NULL,                   -- Quality rating for the CME observation
+      image_timestamp TEXT, -- Timestamp of the associated image
+      CHECK (
+        ((cme_pa IS NULL) = (cme_halo = 1))           -- Ensure Halo CMEs don't have a position angle
+      )
+    );
+    CREATE TABLE FLARES (
+      flare_id INTEGER NOT NULL PRIMARY KEY,          -- Unique identifier for each flare
+      harpnum INTEGER REFERENCES HARPS (harpnum),     -- Associated HARP region
+      flare_date TEXT NOT NULL,                       -- Date and time of the flare
+      flare_lon REAL,                                 -- Longitude of the flare
+      flare_lat REAL,                                 -- Latitude of the flare
+      flare_class_score REAL NOT NULL,                -- Score indicating the class of the flare
+      flare_class TEXT NOT NULL,                      -- Class of the flare (e.g., M1, X2)
+      flare_ar INTEGER,                               -- Active Region number of the flare
+      flare_ar_source TEXT,                           -- Source of the Active Region number
+      flare_verification TEXT,                        -- Verification status of the flare information
+      image_timestamp TEXT, -- Timestamp of the associated image
+      CHECK (
+        (flare_ar IS NULL AND flare_lon IS NOT NULL AND flare_lat IS NOT NULL) OR
+        (flare_ar IS NOT NULL)                        -- Ensure either flare_ar or both flare_lon and flare_lat are provided
+      )
+    );
+    CREATE TABLE RAW_HARPS_BBOX (
+        -- Reference to the harpnum column in the harps table
+        harpnum INTEGER REFERENCES HARPS (harpnum), 
+        -- Reference to the timestamp column in the images table
+        timestamp TEXT, 
+        -- Minimum longitude of BBOX
+        LONDTMIN REAL, 
+        -- Maximum longitude of BBOX
+        LONDTMAX REAL, 
+        -- Minimum latitude of BBOX
+        LATDTMIN REAL, 
+        -- Maximum latitude of BBOX
+        LATDTMAX REAL, 
+        -- Is Rotated Bounding Box? Specifies if the BBOX is calculated using differential solar rotation because it was missing from the SHARP dataset
+        IRBB INTEGER, 
+        -- Is trusted magnetic field data?
+        IS_TMFI INTEGER,
+        PRIMARY KEY (harpnum, timestamp),
+        -- Need to check that the timestamp has minutes 12, 24, 36, 48, or 00
+        CHECK (strftime('%M', timestamp) IN ('12', '24', '36', '48', '00'))
+    );
+    CREATE TABLE FINAL_CME_HARP_ASSOCIATIONS (
+      cme_id INTEGER UNIQUE NOT NULL REFERENCES CMES(cme_id),                 -- Unique identifier for each CME
+      harpnum INTEGER NOT NULL REFERENCES HARPS(harpnum),                       -- Associated HARP region
+      association_method TEXT NOT NULL,               -- Method used to determine the association
+      verification_score REAL,                        -- Confidence score of the association
+      independent_verified INTEGER NOT NULL DEFAULT 0, -- Verification level for association (0 if only by me, 1 if verified by external)
+      PRIMARY KEY (cme_id, harpnum)                   -- Unique pairing of CME and HARP
+    );
+    CREATE TABLE OVERLAPS (
+        harpnum_a INTEGER REFERENCES HARPS(harpnum),
+        harpnum_b INTEGER REFERENCES HARPS(harpnum),
+        mean_overlap REAL,
+        mean_pixel_overlap REAL,
+        ocurrence_percentage REAL,
+        pixel_ocurrence_percentage REAL,
+        harpnum_a_area REAL,
+        harpnum_a_pixel_area REAL,
+        harpnum_b_area REAL,
+        coexistence REAL
+    );
+    CREATE TABLE OVERLAP_RECORDS (
+                harpnum_a INTEGER REFERENCES HARPS(harpnum),
+                harpnum_b INTEGER REFERENCES HARPS(harpnum),
+                decision STRING,
+                mean_overlap REAL,
+                std_overlap REAL,
+                ocurrence_percentage REAL,
+                harpnum_a_area REAL,
+                harpnum_b_area REAL,
+                b_over_a_area_ratio REAL,
+                PRIMARY KEY (harpnum_a, harpnum_b),
+                CHECK (harpnum_a_area < harpnum_b_area),
+                CHECK (decision IN ('MERGED A WITH B', 'DELETED A IN FAVOR OF B'))
+    );
+    CREATE TABLE PROCESSED_HARPS_BBOX(
+        -- Reference to the harpnum column in the harps table
+        harpnum INTEGER REFERENCES HARPS (harpnum), 
+        -- Reference to the timestamp column in the images table
+        timestamp TEXT, 
+        -- Minimum longitude of BBOX
+        LONDTMIN REAL, 
+        -- Maximum longitude of BBOX
+        LONDTMAX REAL, 
+        -- Minimum latitude of BBOX
+        LATDTMIN REAL, 
+        -- Maximum latitude of BBOX
+        LATDTMAX REAL, 
+        -- Is Rotated Bounding Box? Specifies if the BBOX is calculated using differential solar rotation because it was missing from the SHARP dataset
+        IRBB INTEGER, 
+        -- Is trusted magnetic field data?
+        IS_TMFI INTEGER,
+        PRIMARY KEY (harpnum, timestamp),
+        -- Need to check that the timestamp has minutes 12, 24, 36, 48, or 00
+        CHECK (strftime('%M', timestamp) IN ('12', '24', '36', '48', '00'))
+    );
+    CREATE TABLE PROCESSED_HARPS_EPHEMERIS(
+        -- Reference to the harpnum column in the harps table
+        harpnum INTEGER REFERENCES HARPS (harpnum),
+        -- Unix time of the timestamp, used for fast lookups
+        epoch INTEGER,
+        -- Same timestamp as in PROCESSED_HARPS_BBOX
+        timestamp TEXT,
+        -- Centre point of the BBOX
+        LON_CEN REAL,
+        LAT_CEN REAL,
+        -- Centre point of the BBOX projected onto the plane of the sky (solar radii)
+        X_CEN REAL,
+        Y_CEN REAL,
+        -- Position angle of the centre point (deg)
+        PA REAL,
+        -- Distance of the projected centre point to Sun centre (solar radii)
+        DIST_SUN_CENTRE REAL,
+        PRIMARY KEY (harpnum, epoch)
+    );
+    CREATE TABLE IF NOT EXISTS CMES_HARPS_EVENTS (
+    	harpnum	INTEGER,
+    	cme_id	INTEGER,
+    	flare_id	INTEGER REFERENCES FLARES(flare_id),
+    	flare_hours_diff	INTEGER NOT NULL,
+    	dimming_id	INTEGER REFERENCES DIMMINGS(dimming_id),
+    	dimming_hours_diff	INTEGER NOT NULL,
+    	FOREIGN KEY(harpnum,cme_id) REFERENCES CMES_HARPS_SPATIALLY_CONSIST(harpnum,cme_id),
+    	PRIMARY KEY(harpnum,cme_id)
+    );
+    CREATE TABLE IF NOT EXISTS CMES_HARPS_SPATIALLY_CONSIST (
+    	harpnum	INTEGER NOT NULL REFERENCES HARPS(harpnum),
+    	cme_id	INTEGER NOT NULL REFERENCES CMES(cme_id),
+    	PRIMARY KEY(harpnum,cme_id)
+    );
+    CREATE TABLE IF NOT EXISTS DIMMINGS (
+    	dimming_id	INTEGER NOT NULL,
+    	harpnum	INTEGER REFERENCES HARPS(harpnum),
+    	harps_dimming_dist	REAL NOT NULL,
+    	dimming_start_date	TEXT NOT NULL,
+    	dimming_peak_date	TEXT NOT NULL,
+    	dimming_lon	REAL NOT NULL,
+    	dimming_lat	REAL NOT NULL,
+    	image_timestamp	TEXT,
+    	PRIMARY KEY(dimming_id)
+    );
+    CREATE TABLE IF NOT EXISTS OFF_DISK_DIMMINGS (
+    	dimming_id	INTEGER NOT NULL,
+    	harpnum	INTEGER REFERENCES HARPS(harpnum),
+    	harps_dimming_pa_diff	REAL NOT NULL,
+    	dimming_start_date	TEXT NOT NULL,
+    	dimming_peak_date	TEXT NOT NULL,
+    	dimming_x	REAL NOT NULL,
+    	dimming_y	REAL NOT NULL,
+    	dimming_pa	REAL NOT NULL,
+    	PRIMARY KEY(dimming_id)
+    );
+    CREATE TABLE NOAA_HARPNUM_MAPPING (
+            noaa INTEGER,
+            harpnum INTEGER REFERENCES HARPS (harpnum),
+            PRIMARY KEY (noaa, harpnum)
+            );
+    CREATE TABLE NOAAS (
+        noaa INTEGER PRIMARY KEY
+    );
+    """
     )
 
-new_conn.commit()
+    new_conn.commit()
+
+    # Now, read the data from SWAN files and load it into the database
+
+    swan_filepaths = filepaths_updated_swan_data()
+    new_cur.execute("DELETE FROM RAW_HARPS_BBOX;")
+
+    # Split the HARPS into disjoint subsets, one per worker. Each worker parses
+    # its files in parallel and writes them to its own staging database. The
+    # staging databases are then merged in a single transaction.
+    swan_items = sorted(swan_filepaths.items())
+    swan_subsets = [swan_items[i::N_INGESTION_WORKERS] for i in range(N_INGESTION_WORKERS)]
+
+    with tempfile.TemporaryDirectory(dir=INTERIM_DATA_DIR) as staging_dir:
+        staging_items = [
+            (os.path.join(staging_dir, f"staging_{i}.db"), subset)
+            for i, subset in enumerate(swan_subsets)
+            if len(subset) > 0
+        ]
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=N_INGESTION_WORKERS
+        ) as executor:
+            futures = [
+                executor.submit(load_swan_subset, staging_item)
+                for staging_item in staging_items
+            ]
+
+            staging_paths = [
+                future.result()
+                for future in tqdm(
+                    concurrent.futures.as_completed(futures),
+                    total=len(futures),
+                    desc="Reading SWAN data",
+                    unit="worker",
+                    leave=False,
+                )
+            ]
 
-new_cur.execute("DELETE FROM HARPS;")
-new_cur.execute(
-    "SELECT harpnum, min(timestamp) as start, max(timestamp) as end FROM RAW_HARPS_BBOX GROUP BY harpnum;"
-)
+        new_conn.commit()
 
-data = new_cur.fetchall()
+        # ATTACH is not allowed inside a transaction so attach everything first
+        staging_names = [f"staging_{i}" for i in range(len(staging_paths))]
 
-data = [(int(row[0]), str(row[1]), str(row[2])) for row in data]
+        for staging_name, staging_path in zip(staging_names, staging_paths):
+            new_cur.execute(f"ATTACH DATABASE ? AS {staging_name};", (staging_path,))
 
-for row in data:
+        with new_conn:
+            for staging_name in staging_names:
+                new_cur.execute(
+                    f"""
+                INSERT INTO RAW_HARPS_BBOX (harpnum, timestamp, LONDTMIN, LONDTMAX, LATDTMIN, LATDTMAX, IRBB, IS_TMFI)
+                SELECT harpnum, timestamp, LONDTMIN, LONDTMAX, LATDTMIN, LATDTMAX, IRBB, IS_TMFI
+                FROM {staging_name}.RAW_HARPS_BBOX
+                ORDER BY harpnum, timestamp;
+                """
+                )
+
+        for staging_name in staging_names:
+            new_cur.execute(f"DETACH DATABASE {staging_name};")
+
+    new_cur.execute("DELETE FROM HARPS;")
     new_cur.execute(
-        """
-    INSERT INTO HARPS (harpnum, start, end)
-    VALUES (?, ?, ?);
-    """,
-        row,
+        "SELECT harpnum, min(timestamp) as start, max(timestamp) as end FROM RAW_HARPS_BBOX GROUP BY harpnum;"
     )
 
-new_conn.commit()
+    data = new_cur.fetchall()
 
-# Now, read the HARPs-NOAA mapping and load it into the database
+    data = [(int(row[0]), str(row[1]), str(row[2])) for row in data]
 
-new_cur.execute("DELETE FROM NOAA_HARPNUM_MAPPING;")
-new_cur.execute("DELETE FROM NOAAS;")
+    for row in data:
+        new_cur.execute(
+            """
+        INSERT INTO HARPS (harpnum, start, end)
+        VALUES (?, ?, ?);
+        """,
+            row,
+        )
 
-noaatoharp = pd.read_csv(HARPNUM_TO_NOAA, sep=" ", header=0)
+    new_conn.commit()
 
+    # Now, read the HARPs-NOAA mapping and load it into the database
 
-def parse_noaa_lists(noaa_list):
-    return [int(noaa) for noaa in noaa_list.split(",")]
+    new_cur.execute("DELETE FROM NOAA_HARPNUM_MAPPING;")
+    new_cur.execute("DELETE FROM NOAAS;")
 
+    noaatoharp = pd.read_csv(HARPNUM_TO_NOAA, sep=" ", header=0)
 
-noaatoharp["noaa_list"] = noaatoharp["NOAA_ARS"].apply(parse_noaa_lists)
 
-for _, row in noaatoharp.iterrows():
-    for noaa in row["noaa_list"]:
-        if int(row["HARPNUM"]) > 7331.5:
-            continue
-        try:
-            new_cur.execute(
-                """
-                INSERT INTO NOAA_HARPNUM_MAPPING (noaa, harpnum)
-                VALUES (?, ?)
-            """,
-                (int(noaa), int(row["HARPNUM"])),
-            )
-        except sqlite3.IntegrityError as e:
-            print(f"Integrity error for {noaa}, {row['HARPNUM']}")
-
-new_cur.execute(
-    """
-INSERT INTO NOAAS (noaa)
-SELECT DISTINCT noaa
-FROM NOAA_HARPNUM_MAPPING
-"""
-)
+    def parse_noaa_lists(noaa_list):
+        return [int(noaa) for noaa in noaa_list.split(",")]
 
-# Now, calculate areas and overlaps for HARPS
 
-clear_screen()
-print("Data pre-loading: Calculating areas and overlaps")
+    noaatoharp["noaa_list"] = noaatoharp["NOAA_ARS"].apply(parse_noaa_lists)
 
-new_cur.execute(
-    """
-WITH AREAS AS (
-                SELECT harpnum,
-                COALESCE(AVG(NULLIF(100.0 * ((PI()/180.0 * (LONDTMAX - LONDTMIN) * ABS(SIN(PI()/180.0 * LATDTMAX) - SIN(PI()/180.0 * LATDTMIN))) / (2.0 * PI())), 0)),0) AS area
-                FROM RAW_HARPS_BBOX
-                GROUP BY harpnum
+    for _, row in noaatoharp.iterrows():
+        for noaa in row["noaa_list"]:
+            if int(row["HARPNUM"]) > 7331.5:
+                continue
+            try:
+                new_cur.execute(
+                    """
+                    INSERT INTO NOAA_HARPNUM_MAPPING (noaa, harpnum)
+                    VALUES (?, ?)
+                """,
+                    (int(noaa), int(row["HARPNUM"])),
                 )
-UPDATE HARPS
-SET area = (SELECT area FROM AREAS WHERE AREAS.harpnum = HARPS.harpnum);
-                """
-)
+            except sqlite3.IntegrityError as e:
+                print(f"Integrity error for {noaa}, {row['HARPNUM']}")
 
-new_cur.execute(
-    """
-UPDATE HARPS
-SET n_noaas = (SELECT COUNT(noaa)
-               FROM NOAA_HARPNUM_MAPPING
-               WHERE NOAA_HARPNUM_MAPPING.harpnum = HARPS.harpnum)
+    new_cur.execute(
+        """
+    INSERT INTO NOAAS (noaa)
+    SELECT DISTINCT noaa
+    FROM NOAA_HARPNUM_MAPPING
     """
-)
+    )
 
+    # Now, calculate areas and overlaps for HARPS
+
+    clear_screen()
+    print("Data pre-loading: Calculating areas and overlaps")
+
+    new_cur.execute(
+        """
+    WITH AREAS AS (
+                    SELECT harpnum,
+                    COALESCE(AVG(NULLIF(100.0 * ((PI()/180.0 * (LONDTMAX - LONDTMIN) * ABS(SIN(PI()/180.0 * LATDTMAX) - SIN(PI()/180.0 * LATDTMIN))) / (2.0 * PI())), 0)),0) AS area
+                    FROM RAW_HARPS_BBOX
+                    GROUP BY harpnum
+                    )
+    UPDATE HARPS
+    SET area = (SELECT area FROM AREAS WHERE AREAS.harpnum = HARPS.harpnum);
+                    """
+    )
 
-new_conn.commit()
+    new_cur.execute(
+        """
+    UPDATE HARPS
+    SET n_noaas = (SELECT COUNT(noaa)
+                   FROM NOAA_HARPNUM_MAPPING
+                   WHERE NOAA_HARPNUM_MAPPING.harpnum = HARPS.harpnum)
+        """
+    )
 
-# Calculating the overlaps involves several steps:
-# 1. Remove HARPS that are too large
 
-new_cur.execute("CREATE INDEX IF NOT EXISTS idx_harps_area ON HARPS (area);")
-new_cur.execute("CREATE INDEX IF NOT EXISTS idx_harps_harpnum ON HARPS (area);")
+    new_conn.commit()
 
-new_cur.execute("DROP TABLE IF EXISTS NO_BIG_HARPS;")
-new_cur.execute(
-    """
-CREATE TEMPORARY TABLE NO_BIG_HARPS AS
-                SELECT RHB.* FROM RAW_HARPS_BBOX RHB
-                INNER JOIN HARPS H ON RHB.harpnum = H.harpnum
-                WHERE H.area < 18
-                """
-)
+    # Calculating the overlaps involves several steps:
+    # 1. Remove HARPS that are too large
 
-# 2. Trim bounding boxes that extend beyond the solar limb
+    new_cur.execute("CREATE INDEX IF NOT EXISTS idx_harps_area ON HARPS (area);")
+    new_cur.execute("CREATE INDEX IF NOT EXISTS idx_harps_harpnum ON HARPS (area);")
 
-new_cur.execute(
-    "CREATE INDEX IF NOT EXISTS idx_no_big_harps_harpnum ON NO_BIG_HARPS (LONDTMIN);"
-)
-new_cur.execute(
-    "CREATE INDEX IF NOT EXISTS idx_no_big_harps_harpnum ON NO_BIG_HARPS (LONDTMAX);"
-)
+    new_cur.execute("DROP TABLE IF EXISTS NO_BIG_HARPS;")
+    new_cur.execute(
+        """
+    CREATE TEMPORARY TABLE NO_BIG_HARPS AS
+                    SELECT RHB.* FROM RAW_HARPS_BBOX RHB
+                    INNER JOIN HARPS H ON RHB.harpnum = H.harpnum
+                    WHERE H.area < 18
+                    """
+    )
+
+    # 2. Trim bounding boxes that extend beyond the solar limb
+
+    new_cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_no_big_harps_harpnum ON NO_BIG_HARPS (LONDTMIN);"
+    )
+    new_cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_no_big_harps_harpnum ON NO_BIG_HARPS (LONDTMAX);"
+    )
 
-new_cur.execute("DROP TABLE IF EXISTS TRIMMED_HARPS_BBOX;")
-new_cur.execute(
+    new_cur.execute("DROP TABLE IF EXISTS TRIMMED_HARPS_BBOX;")
+    new_cur.execute(
+        """
+    CREATE TEMPORARY TABLE TRIMMED_HARPS_BBOX AS
+    SELECT NBH.* FROM NO_BIG_HARPS NBH
     """
-CREATE TEMPORARY TABLE TRIMMED_HARPS_BBOX AS
-SELECT NBH.* FROM NO_BIG_HARPS NBH
-"""
-)
+    )
 
-# Now whenever LONDTMIN < -90 we set it to -90
-# Whenever LONDTMAX > 90 we set it to 90
-# And if LONTMIN<-90 AND LONDTMIN < -90 we drop that row
-# And if LONTMIN>90 AND LONDTMIN > -90 we drop that row
+    # Now whenever LONDTMIN < -90 we set it to -90
+    # Whenever LONDTMAX > 90 we set it to 90
+    # And if LONTMIN<-90 AND LONDTMIN < -90 we drop that row
+    # And if LONTMIN>90 AND LONDTMIN > -90 we drop that row
 
-new_cur.execute(
+    new_cur.execute(
+        """
+    DELETE FROM TRIMMED_HARPS_BBOX
+    WHERE (LONDTMIN < -90 AND LONDTMAX < -90)
+    OR (LONDTMIN > 90 AND LONDTMAX > 90)
     """
-DELETE FROM TRIMMED_HARPS_BBOX
-WHERE (LONDTMIN < -90 AND LONDTMAX < -90)
-OR (LONDTMIN > 90 AND LONDTMAX > 90)
-"""
-)
+    )
 
-new_cur.execute(
+    new_cur.execute(
+        """
+    UPDATE TRIMMED_HARPS_BBOX
+    SET LONDTMIN = -90
+    WHERE LONDTMIN < -90
     """
-UPDATE TRIMMED_HARPS_BBOX
-SET LONDTMIN = -90
-WHERE LONDTMIN < -90
-"""
-)
+    )
 
-new_cur.execute(
+    new_cur.execute(
+        """
+    UPDATE TRIMMED_HARPS_BBOX
+    SET LONDTMAX = 90
+    WHERE LONDTMAX > 90
     """
-UPDATE TRIMMED_HARPS_BBOX
-SET LONDTMAX = 90
-WHERE LONDTMAX > 90
-"""
-)
+    )
 
-# 3. Calculate the actual overlaps between HARPS
+    # 3. Calculate the actual overlaps between HARPS
 
-# Print a message to indicate the start of overlap calculation
-print("Calculating overlaps...")
-new_cur.executescript(
+    # Print a message to indicate the start of overlap calculation
+    print("Calculating overlaps...")
+    new_cur.executescript(
+        """
+    -- Create an index on HARPS_BBOX for the join in the temp_overlap creation step
+    CREATE INDEX IF NOT EXISTS idx_thbb_harpnum_timestamp ON TRIMMED_HARPS_BBOX(harpnum, timestamp);
+
+    -- Create temporary table with overlap info
+    CREATE TEMPORARY TABLE temp_overlap AS
+    SELECT
+        a.harpnum AS harpnum1,
+        b.harpnum AS harpnum2,
+        a.timestamp AS timestamp,
+        100.0 * CASE WHEN a.LONDTMIN < b.LONDTMAX AND a.LONDTMAX > b.LONDTMIN AND a.LATDTMIN < b.LATDTMAX AND a.LATDTMAX > b.LATDTMIN
+            THEN (MIN(a.LONDTMAX, b.LONDTMAX) - MAX(a.LONDTMIN, b.LONDTMIN)) * ABS((SIN(PI() / 180.0 * MIN(a.LATDTMAX, b.LATDTMAX)) - SIN(PI() / 180.0 * MAX(a.LATDTMIN, b.LATDTMIN))))
+            ELSE 0
+        END / ((2.0 * PI() / (100.0 * PI() / 180.0)) * H.area) AS overlap_percent
+    FROM TRIMMED_HARPS_BBOX a
+    JOIN TRIMMED_HARPS_BBOX b ON a.timestamp = b.timestamp AND a.harpnum != b.harpnum
+    JOIN HARPS H ON H.harpnum = a.harpnum;
+
+    -- Create an index on temp_overlap for the window function in the temp_largest_overlap creation step
+    CREATE INDEX IF NOT EXISTS idx_temp_overlap_harpnum1_timestamp_overlap ON temp_overlap(harpnum1, timestamp, overlap_percent DESC);
+
+    DROP TABLE IF EXISTS avg_overlap;
+    DROP TABLE IF EXISTS OVERLAPS;
+
+    CREATE TEMP TABLE avg_overlap AS
+        SELECT tpo.harpnum1 as harpnum_a, tpo.harpnum2 as harpnum_b, AVG(tpo.overlap_percent) AS mean_overlap,
+        (100.0 * (COUNT(tpo.timestamp) - 1) * 12.0 * 60.0) / (1.0 * NULLIF(strftime('%s', H.end) - strftime('%s', H.start), 0)) AS ocurrence_percentage
+        FROM temp_overlap tpo
+        JOIN HARPS H ON H.harpnum = tpo.harpnum1
+        WHERE tpo.overlap_percent > 0
+        GROUP BY harpnum1, harpnum2;
+
+    CREATE TABLE OVERLAPS AS
+        SELECT ao.*,
+        -- Standard deviation of the overlap
+        SQRT(SUM((tpo.overlap_percent - ao.mean_overlap) * (tpo.overlap_percent - ao.mean_overlap)) / (COUNT(tpo.timestamp) - 1)) AS std_overlap
+        FROM avg_overlap ao
+        INNER JOIN TEMP_OVERLAP tpo ON ao.harpnum_a = tpo.harpnum1 AND ao.harpnum_b = tpo.harpnum2
+        GROUP BY harpnum_a, harpnum_b;
     """
--- Create an index on HARPS_BBOX for the join in the temp_overlap creation step
-CREATE INDEX IF NOT EXISTS idx_thbb_harpnum_timestamp ON TRIMMED_HARPS_BBOX(harpnum, timestamp);
-
--- Create temporary table with overlap info
-CREATE TEMPORARY TABLE temp_overlap AS
-SELECT
-    a.harpnum AS harpnum1,
-    b.harpnum AS harpnum2,
-    a.timestamp AS timestamp,
-    100.0 * CASE WHEN a.LONDTMIN < b.LONDTMAX AND a.LONDTMAX > b.LONDTMIN AND a.LATDTMIN < b.LATDTMAX AND a.LATDTMAX > b.LATDTMIN
-        THEN (MIN(a.LONDTMAX, b.LONDTMAX) - MAX(a.LONDTMIN, b.LONDTMIN)) * ABS((SIN(PI() / 180.0 * MIN(a.LATDTMAX, b.LATDTMAX)) - SIN(PI() / 180.0 * MAX(a.LATDTMIN, b.LATDTMIN))))
-        ELSE 0
-    END / ((2.0 * PI() / (100.0 * PI() / 180.0)) * H.area) AS overlap_percent
-FROM TRIMMED_HARPS_BBOX a
-JOIN TRIMMED_HARPS_BBOX b ON a.timestamp = b.timestamp AND a.harpnum != b.harpnum
-JOIN HARPS H ON H.harpnum = a.harpnum;
-
--- Create an index on temp_overlap for the window function in the temp_largest_overlap creation step
-CREATE INDEX IF NOT EXISTS idx_temp_overlap_harpnum1_timestamp_overlap ON temp_overlap(harpnum1, timestamp, overlap_percent DESC);
-
-DROP TABLE IF EXISTS avg_overlap;
-DROP TABLE IF EXISTS OVERLAPS;
-
-CREATE TEMP TABLE avg_overlap AS
-    SELECT tpo.harpnum1 as harpnum_a, tpo.harpnum2 as harpnum_b, AVG(tpo.overlap_percent) AS mean_overlap,
-    (100.0 * (COUNT(tpo.timestamp) - 1) * 12.0 * 60.0) / (1.0 * NULLIF(strftime('%s', H.end) - strftime('%s', H.start), 0)) AS ocurrence_percentage
-    FROM temp_overlap tpo
-    JOIN HARPS H ON H.harpnum = tpo.harpnum1
-    WHERE tpo.overlap_percent > 0
-    GROUP BY harpnum1, harpnum2;
-
-CREATE TABLE OVERLAPS AS
-    SELECT ao.*,
-    -- Standard deviation of the overlap
-    SQRT(SUM((tpo.overlap_percent - ao.mean_overlap) * (tpo.overlap_percent - ao.mean_overlap)) / (COUNT(tpo.timestamp) - 1)) AS std_overlap
-    FROM avg_overlap ao
-    INNER JOIN TEMP_OVERLAP tpo ON ao.harpnum_a = tpo.harpnum1 AND ao.harpnum_b = tpo.harpnum2
-    GROUP BY harpnum_a, harpnum_b;
-"""
-)
+    )
 
-new_conn.commit()
+    new_conn.commit()
 
-overlaps = pd.read_sql_query(
-    """
-                             SELECT O.*, H1.area as harpnum_a_area, H2.area as harpnum_b_area, H2.area / H1.area as b_over_a_area_ratio FROM OVERLAPS O
-                             INNER JOIN HARPS H1 ON O.harpnum_a = H1.harpnum
-                             INNER JOIN HARPS H2 ON O.harpnum_b = H2.harpnum
-                             """,
-    new_conn,
-)
+    overlaps = pd.read_sql_query(
+        """
+                                 SELECT O.*, H1.area as harpnum_a_area, H2.area as harpnum_b_area, H2.area / H1.area as b_over_a_area_ratio FROM OVERLAPS O
+                                 INNER JOIN HARPS H1 ON O.harpnum_a = H1.harpnum
+                                 INNER JOIN HARPS H2 ON O.harpnum_b = H2.harpnum
+                                 """,
+        new_conn,
+    )
 
-bad_overlaps = overlaps[
-    ((overlaps["mean_overlap"] > 50) & (overlaps["ocurrence_percentage"] > 50))
-    | (overlaps["mean_overlap"] == 100)
-]
+    bad_overlaps = overlaps[
+        ((overlaps["mean_overlap"] > 50) & (overlaps["ocurrence_percentage"] > 50))
+        | (overlaps["mean_overlap"] == 100)
+    ]
 
-for index, row in bad_overlaps.iterrows():
-    occurence_percentage = row["ocurrence_percentage"]
-    mean_overlap = row["mean_overlap"]
-    harpnum_a = row["harpnum_a"]
-    harpnum_b = row["harpnum_b"]
-    harpnum_a_area = row["harpnum_a_area"]
-    harpnum_b_area = row["harpnum_b_area"]
+    for index, row in bad_overlaps.iterrows():
+        occurence_percentage = row["ocurrence_percentage"]
+        mean_overlap = row["mean_overlap"]
+        harpnum_a = row["harpnum_a"]
+        harpnum_b = row["harpnum_b"]
+        harpnum_a_area = row["harpnum_a_area"]
+        harpnum_b_area = row["harpnum_b_area"]
+
+        if occurence_percentage > 70 and mean_overlap > 90:
+            decision = "MERGED A WITH B"
+        else:
+            decision = "DELETED A IN FAVOR OF B"
+
+        new_cur.execute(
+            "INSERT OR IGNORE INTO OVERLAP_RECORDS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                harpnum_a,
+                harpnum_b,
+                decision,
+                mean_overlap,
+                row["std_overlap"],
+                occurence_percentage,
+                harpnum_a_area,
+                harpnum_b_area,
+                row["b_over_a_area_ratio"],
+            ),
+        )
 
-    if occurence_percentage > 70 and mean_overlap > 90:
-        decision = "MERGED A WITH B"
-    else:
-        decision = "DELETED A IN FAVOR OF B"
+    new_conn.commit()
 
-    new_cur.execute(
-        "INSERT OR IGNORE INTO OVERLAP_RECORDS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            harpnum_a,
-            harpnum_b,
-            decision,
-            mean_overlap,
-            row["std_overlap"],
-            occurence_percentage,
-            harpnum_a_area,
-            harpnum_b_area,
-            row["b_over_a_area_ratio"],
-        ),
-    )
+    # Print a message to indicate the start of creating the processed_harps_bbox table
+    print("Creating processed_harps_bbox table...")
+    # Now fill processed_harps_bbox
 
-new_conn.commit()
+    new_cur.executescript(
+        """
+    DROP TABLE IF EXISTS PROCESSED_HARPS_BBOX;
 
-# Print a message to indicate the start of creating the processed_harps_bbox table
-print("Creating processed_harps_bbox table...")
-# Now fill processed_harps_bbox
+    CREATE TABLE PROCESSED_HARPS_BBOX AS
+                          SELECT RHB.* FROM RAW_HARPS_BBOX RHB
+                          INNER JOIN HARPS H
+                          ON RHB.harpnum = H.harpnum
+                          WHERE H.area < 18 AND RHB.harpnum NOT IN (SELECT harpnum_a FROM OVERLAP_RECORDS);
 
-new_cur.executescript(
+    DELETE FROM PROCESSED_HARPS_BBOX
+    WHERE (LONDTMIN < -90 AND LONDTMAX < -90)
+    OR (LONDTMIN > 90 AND LONDTMAX > 90);
+
+    UPDATE PROCESSED_HARPS_BBOX
+    SET LONDTMIN = -90
+    WHERE LONDTMIN < -90;
+
+    UPDATE PROCESSED_HARPS_BBOX
+    SET LONDTMAX = 90
+    WHERE LONDTMAX > 90;
     """
-DROP TABLE IF EXISTS PROCESSED_HARPS_BBOX;
+    )
 
-CREATE TABLE PROCESSED_HARPS_BBOX AS
-                      SELECT RHB.* FROM RAW_HARPS_BBOX RHB
-                      INNER JOIN HARPS H
-                      ON RHB.harpnum = H.harpnum
-                      WHERE H.area < 18 AND RHB.harpnum NOT IN (SELECT harpnum_a FROM OVERLAP_RECORDS);
+    new_conn.commit()
 
-DELETE FROM PROCESSED_HARPS_BBOX
-WHERE (LONDTMIN < -90 AND LONDTMAX < -90)
-OR (LONDTMIN > 90 AND LONDTMAX > 90);
+    # Print a message to indicate the start of the ephemeris calculation
+    print("Calculating processed_harps_bbox ephemeris...")
 
-UPDATE PROCESSED_HARPS_BBOX
-SET LONDTMIN = -90
-WHERE LONDTMIN < -90;
+    create_processed_harps_ephemeris(new_conn)
 
-UPDATE PROCESSED_HARPS_BBOX
-SET LONDTMAX = 90
-WHERE LONDTMAX > 90;
-"""
-)
+    clear_screen()
 
-new_conn.commit()
 
-clear_screen()
+if __name__ == "__main__":
+    main()
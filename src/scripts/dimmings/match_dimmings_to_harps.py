@@ -1,13 +1,16 @@
 import pandas as pd
 from astropy.time import Time
 from tqdm import tqdm
-from src.harps.harps import Harps
-from src.dimmings.dimmings import Dimming
+from src.cmesrc.classes import BoundingBoxArray
 from src.cmesrc.utils import (
     clear_screen,
-    get_closest_harps_timestamp,
-    read_sql_processed_bbox,
+    get_closest_record_indices,
+    read_sql_processed_bbox_bulk,
+    to_epoch,
 )
+from src.cmesrc.interval_index import IntervalIndex
+from src.cmesrc.scheduler import CostAwareScheduler, split_by_cost
+from src.cmesrc.checkpoints import CheckpointStore, get_input_hash, map_with_checkpoints
 import numpy as np
 from src.cmesrc.config import (
     RAW_DIMMINGS_CATALOGUE,
@@ -17,7 +20,6 @@ from src.cmesrc.config import (
 )
 
 import sqlite3
-from bisect import bisect_right
 
 conn = sqlite3.connect(CMESRC_BBOXES)
 cur = conn.cursor()
@@ -26,6 +28,67 @@ DEG_TO_RAD = np.pi / 180
 HALF_POINTS_DIST = 5 * DEG_TO_RAD
 NO_POINTS_DIST = 10 * DEG_TO_RAD
 
+# Relative cost of a pair that needs rotating and of one that doesn't
+ROTATION_COST = 1
+LOOKUP_COST = 0.02
+N_WORKERS = 4
+TASKS_PER_WORKER = 16
+
+
+def get_dimming_distances(dimmings_harps_rows):
+    """
+    Distances between dimmings and HARPS for a block of dimming-HARPS rows.
+    The HARPS bounding boxes more than an hour away from the dimming are
+    rotated to the dimming time in one batch, then all the distances are
+    computed at once.
+    """
+    LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX = (
+        dimmings_harps_rows[
+            [
+                "HARPS_RAW_LONDTMIN",
+                "HARPS_RAW_LATDTMIN",
+                "HARPS_RAW_LONDTMAX",
+                "HARPS_RAW_LATDTMAX",
+            ]
+        ]
+        .to_numpy(dtype=float)
+        .T.copy()
+    )
+
+    needs_rotation = np.flatnonzero(
+        np.abs(
+            dimmings_harps_rows["DIMMING_EPOCH"].to_numpy()
+            - dimmings_harps_rows["HARPS_RAW_EPOCH"].to_numpy()
+        )
+        > 3600
+    )
+
+    if len(needs_rotation) > 0:
+        rotated_bboxes = BoundingBoxArray(
+            dimmings_harps_rows["HARPS_RAW_DATE"].to_numpy()[needs_rotation],
+            LONDTMIN[needs_rotation],
+            LATDTMIN[needs_rotation],
+            LONDTMAX[needs_rotation],
+            LATDTMAX[needs_rotation],
+        ).rotate_bbox(dimmings_harps_rows["DIMMING_DATE"].to_numpy()[needs_rotation])
+
+        # Rotations giving an invalid bounding box keep the original one
+        rotated = rotated_bboxes.is_valid()
+        rotated_bboxes = rotated_bboxes[rotated]
+        rotated_indices = needs_rotation[rotated]
+
+        LONDTMIN[rotated_indices] = rotated_bboxes.LON_MIN
+        LATDTMIN[rotated_indices] = rotated_bboxes.LAT_MIN
+        LONDTMAX[rotated_indices] = rotated_bboxes.LON_MAX
+        LATDTMAX[rotated_indices] = rotated_bboxes.LAT_MAX
+
+    bboxes = BoundingBoxArray(None, LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX)
+
+    return bboxes.get_spherical_point_distance(
+        dimmings_harps_rows["longitude"].to_numpy(),
+        dimmings_harps_rows["latitude"].to_numpy(),
+    )
+
 
 def gather_dimming_distances():
     clear_screen()
@@ -61,21 +124,13 @@ def gather_dimming_distances():
         conn,
     )
 
-    harps_lifetime_start_times = pd.to_datetime(
-        harps_lifetime_database["start"]
-    ).to_numpy()
-    harps_lifetime_end_times = pd.to_datetime(harps_lifetime_database["end"]).to_numpy()
+    harps_lifetime_start_epochs = to_epoch(harps_lifetime_database["start"].to_numpy())
+    harps_lifetime_end_epochs = to_epoch(harps_lifetime_database["end"].to_numpy())
     harpsnums = harps_lifetime_database["harpnum"].to_numpy()
 
-    # We need to sort both start and end times because we will perform a binary
-    # search But we also need to keep track of the original indices so we can
-    # extract the proper HARPS regions
-
-    sorted_start_indices = np.argsort(harps_lifetime_start_times)
-    sorted_end_indices = np.argsort(harps_lifetime_end_times)
-
-    harps_lifetime_start_times_sorted = harps_lifetime_start_times[sorted_start_indices]
-    harps_lifetime_end_times_sorted = harps_lifetime_end_times[sorted_end_indices]
+    harps_lifetime_index = IntervalIndex(
+        harps_lifetime_start_epochs, harps_lifetime_end_epochs
+    )
 
     ##################################
 
@@ -88,32 +143,21 @@ def gather_dimming_distances():
     print("===DIMMINGS===")
     print("==Finding HARPs present at dimming time==")
 
-    full_list_of_matches = []
-    new_data_rows = []
-
-    for dimming_id, dimming_data in tqdm(
-        raw_dimmings_catalogue.iterrows(), total=raw_dimmings_catalogue.shape[0]
-    ):
-        dimming_time = dimming_data["max_detection_time"]
-
-        start_index = bisect_right(harps_lifetime_start_times_sorted, dimming_time)
-        end_index = bisect_right(harps_lifetime_end_times_sorted, dimming_time)
-
-        start_indices = sorted_start_indices[:start_index]
-        end_indices = sorted_end_indices[end_index:]
-
-        harps = harpsnums[np.intersect1d(start_indices, end_indices)]
-
-        full_list_of_matches.append((dimming_id, list(harps)))
+    detection_times = Time(list(raw_dimmings_catalogue["max_detection_time"]))
+    dimming_epochs = to_epoch(detection_times)
+    detection_dates = detection_times.iso
 
-    for i, (dimming_id, harpnum_list) in enumerate(full_list_of_matches):
-        for harpnum in harpnum_list:
-            new_row = raw_dimmings_catalogue.loc[dimming_id].to_dict()
-            new_row["HARPNUM"] = harpnum
-            new_row["DIMMING_HARPNUM_ID"] = f"ID{dimming_id}{harpnum}"
-            new_data_rows.append(new_row)
+    # Pairs of (dimming index, HARPS index) for every HARPS present at the
+    # time of the dimming
+    dimming_indices, harps_indices = harps_lifetime_index.query_points(dimming_epochs)
 
-    dimmings_harps_df = pd.DataFrame.from_records(new_data_rows)
+    dimmings_harps_df = raw_dimmings_catalogue.iloc[dimming_indices].reset_index(drop=True)
+    dimmings_harps_df["HARPNUM"] = harpsnums[harps_indices]
+    dimmings_harps_df["DIMMING_HARPNUM_ID"] = (
+        "ID"
+        + dimmings_harps_df["dimming_id"].astype(str)
+        + dimmings_harps_df["HARPNUM"].astype(str)
+    )
 
     #######################################################
 
@@ -129,56 +173,37 @@ def gather_dimming_distances():
     print("===DIMMINGS===")
     print("==Getting closest timestamp for HARPs==")
 
-    # Group by HARPNUM
-
-    grouped_by_harps = dimmings_harps_df.groupby("HARPNUM")
-
-    harps_indices = None
-    ALL_LONDTMIN = []
-    ALL_LATDTMIN = []
-    ALL_LONDTMAX = []
-    ALL_LATDTMAX = []
-    ALL_RAW_HARPS_TIMES = []
-
-    for harpnum, group in tqdm(grouped_by_harps, total=grouped_by_harps.ngroups):
-        harps_data = read_sql_processed_bbox(harpnum, conn)
-        harps_timestamps = harps_data["Timestamp"].to_numpy()
-
-        dimming_times = group["max_detection_time"].to_numpy()
-
-        if harps_indices is None:
-            harps_indices = group.index
-        else:
-            harps_indices = harps_indices.append(group.index)
+    # Closest HARPS record (the earlier one on ties) of every pair, in one
+    # as-of join over the bounding boxes of all the HARPS
+    harps_records = read_sql_processed_bbox_bulk(
+        conn, np.unique(dimmings_harps_df["HARPNUM"])
+    )
 
-        dimmings_closest_time_indices = []
+    pair_epochs = dimming_epochs[dimming_indices]
 
-        for dimming_time in dimming_times:
-            closest_time_index = get_closest_harps_timestamp(
-                harps_timestamps, dimming_time
-            )
-            dimmings_closest_time_indices.append(closest_time_index)
+    closest_records = get_closest_record_indices(
+        harps_records["harpnum"].to_numpy(),
+        harps_records["epoch"].to_numpy(),
+        dimmings_harps_df["HARPNUM"].to_numpy(),
+        pair_epochs,
+    )
 
-        LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX = (
-            harps_data.loc[
-                dimmings_closest_time_indices,
-                ["LONDTMIN", "LATDTMIN", "LONDTMAX", "LATDTMAX"],
-            ]
-            .to_numpy()
-            .T
-        )
+    if np.any(closest_records < 0):
+        raise ValueError("Some HARPS have no bounding boxes")
 
-        ALL_LONDTMIN.extend(list(LONDTMIN))
-        ALL_LATDTMIN.extend(list(LATDTMIN))
-        ALL_LONDTMAX.extend(list(LONDTMAX))
-        ALL_LATDTMAX.extend(list(LATDTMAX))
-        ALL_RAW_HARPS_TIMES.extend(list(dimmings_closest_time_indices))
+    for column in ["LONDTMIN", "LATDTMIN", "LONDTMAX", "LATDTMAX"]:
+        dimmings_harps_df[f"HARPS_RAW_{column}"] = harps_records[column].to_numpy()[
+            closest_records
+        ]
 
-    dimmings_harps_df.at[harps_indices, "HARPS_RAW_LONDTMIN"] = ALL_LONDTMIN
-    dimmings_harps_df.at[harps_indices, "HARPS_RAW_LATDTMIN"] = ALL_LATDTMIN
-    dimmings_harps_df.at[harps_indices, "HARPS_RAW_LONDTMAX"] = ALL_LONDTMAX
-    dimmings_harps_df.at[harps_indices, "HARPS_RAW_LATDTMAX"] = ALL_LATDTMAX
-    dimmings_harps_df.at[harps_indices, "HARPS_RAW_DATE"] = ALL_RAW_HARPS_TIMES
+    # A Time object per row, as read_sql_processed_bbox gives them, created
+    # once per distinct record
+    unique_records, unique_positions = np.unique(closest_records, return_inverse=True)
+    unique_harps_times = np.asarray(
+        Time(list(harps_records["timestamp"].to_numpy()[unique_records]), format="iso"),
+        dtype=object,
+    )
+    dimmings_harps_df["HARPS_RAW_DATE"] = unique_harps_times[unique_positions]
 
     ##########################################################################
 
@@ -191,27 +216,60 @@ def gather_dimming_distances():
     print("===DIMMINGS===")
     print("==Rotating bounding boxes and calculating distances==")
 
-    for idx, data in tqdm(
-        dimmings_harps_df.iterrows(), total=dimmings_harps_df.shape[0]
-    ):
-        dimming_data = data[["max_detection_time", "longitude", "latitude"]]
-        harps_data = data[
-            [
-                "HARPS_RAW_DATE",
-                "HARPS_RAW_LONDTMIN",
-                "HARPS_RAW_LATDTMIN",
-                "HARPS_RAW_LONDTMAX",
-                "HARPS_RAW_LATDTMAX",
-                "HARPNUM",
-            ]
-        ].to_numpy()
+    distance_inputs = pd.DataFrame(
+        {
+            "DIMMING_EPOCH": pair_epochs,
+            "DIMMING_DATE": detection_dates[dimming_indices],
+            "longitude": dimmings_harps_df["longitude"].to_numpy(),
+            "latitude": dimmings_harps_df["latitude"].to_numpy(),
+            "HARPS_RAW_EPOCH": harps_records["epoch"].to_numpy()[closest_records],
+            "HARPS_RAW_DATE": harps_records["timestamp"].to_numpy()[closest_records],
+            "HARPS_RAW_LONDTMIN": dimmings_harps_df["HARPS_RAW_LONDTMIN"].to_numpy(),
+            "HARPS_RAW_LATDTMIN": dimmings_harps_df["HARPS_RAW_LATDTMIN"].to_numpy(),
+            "HARPS_RAW_LONDTMAX": dimmings_harps_df["HARPS_RAW_LONDTMAX"].to_numpy(),
+            "HARPS_RAW_LATDTMAX": dimmings_harps_df["HARPS_RAW_LATDTMAX"].to_numpy(),
+        }
+    )
 
-        harps = Harps(*harps_data)
-        dimming = Dimming(*dimming_data)
+    # Pairs more than an hour away from the closest HARPS record need the
+    # bounding box rotated, which dominates the cost
+    time_gaps = np.abs(
+        distance_inputs["HARPS_RAW_EPOCH"].to_numpy()
+        - distance_inputs["DIMMING_EPOCH"].to_numpy()
+    )
+    pair_costs = np.where(time_gaps > 3600, ROTATION_COST, LOOKUP_COST)
 
-        harps_dimming_dist = harps.get_spherical_point_distance(dimming.point)
+    row_ranges = split_by_cost(pair_costs, TASKS_PER_WORKER * N_WORKERS)
+    tasks = [distance_inputs.iloc[start:end] for start, end in row_ranges]
+    task_costs = [pair_costs[start:end].sum() for start, end in row_ranges]
 
-        dimmings_harps_df.at[idx, "HARPS_DIMMING_DISTANCE"] = harps_dimming_dist
+    scheduler = CostAwareScheduler(n_workers=N_WORKERS)
+
+    # Finished blocks are checkpointed, keyed by the inputs and the parameters
+    # of the split, so an interrupted run restarts where it stopped
+    checkpoint_store = CheckpointStore(
+        "match_dimmings_to_harps",
+        get_input_hash(distance_inputs, row_ranges),
+    )
+
+    dimmings_harps_df["HARPS_DIMMING_DISTANCE"] = np.concatenate(
+        [np.array([], dtype=float)]
+        + list(
+            tqdm(
+                map_with_checkpoints(
+                    scheduler,
+                    checkpoint_store,
+                    get_dimming_distances,
+                    row_ranges,
+                    tasks,
+                    task_costs,
+                ),
+                total=len(tasks),
+            )
+        )
+    )
+
+    scheduler.print_stats()
 
     ##########################################
     # Now we calculate scores for the distance
@@ -224,38 +282,34 @@ def gather_dimming_distances():
 
     distances = dimmings_harps_df["HARPS_DIMMING_DISTANCE"].to_numpy()
 
-    dimmings_harps_df["POSITION_SCORES"] = np.piecewise(
-        distances,
-        [distances <= NO_POINTS_DIST, distances > NO_POINTS_DIST],
-        [
-            lambda x: 100 * np.exp(-(np.log(2) / HALF_POINTS_DIST**2) * x**2),
-            lambda x: 0,
-        ],
+    dimmings_harps_df["POSITION_SCORES"] = np.where(
+        distances <= NO_POINTS_DIST,
+        100 * np.exp(-(np.log(2) / HALF_POINTS_DIST**2) * distances**2),
+        0,
     )
 
-    unmatched_dimmings = 0
-    matched_dimmings = 0
-
     scored_data = dimmings_harps_df.copy()
 
-    for dimming_id, group in tqdm(dimmings_harps_df.groupby("dimming_id")):
-        filtered_group = group[group["POSITION_SCORES"] > 0].copy()
-
-        scored_data.loc[group.index, "MATCH"] = False
-
-        if len(filtered_group) == 0:
-            unmatched_dimmings += 1
-            continue
+    # Each dimming matches its HARPS with the highest positive score, the
+    # first one in row order on ties. Rows are sorted by dimming and by
+    # decreasing score (stable), so the match is the first candidate row of
+    # each dimming
+    scores = scored_data["POSITION_SCORES"].to_numpy()
+    dimming_codes, dimming_uniques = pd.factorize(scored_data["dimming_id"])
 
-        filtered_group.sort_values(
-            by=["POSITION_SCORES"], ascending=[False], inplace=True
-        )
-
-        matching_index = filtered_group.index[0]
+    candidates = np.flatnonzero(scores > 0)
+    candidates = candidates[
+        np.lexsort((-scores[candidates], dimming_codes[candidates]))
+    ]
+    _, first_candidates = np.unique(dimming_codes[candidates], return_index=True)
 
-        scored_data.loc[matching_index, "MATCH"] = True
+    scored_data["MATCH"] = False
+    scored_data.loc[
+        scored_data.index[candidates[first_candidates]], "MATCH"
+    ] = True
 
-        matched_dimmings += 1
+    matched_dimmings = len(first_candidates)
+    unmatched_dimmings = len(dimming_uniques) - matched_dimmings
 
     clear_screen()
 
@@ -281,6 +335,9 @@ def gather_dimming_distances():
     scored_data.to_csv(DIMMINGS_MATCHED_TO_HARPS, index=False)
     scored_data.to_pickle(DIMMINGS_MATCHED_TO_HARPS_PICKLE)
 
+    # All the outputs are written, the checkpoints are not needed anymore
+    checkpoint_store.clear()
+
 
 if __name__ == "__main__":
     clear_screen()
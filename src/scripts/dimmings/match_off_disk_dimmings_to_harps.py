@@ -0,0 +1,265 @@
+import pandas as pd
+from src.dimmings.dimmings import OffDiskDimmingBatch
+from src.cmesrc.classes import BoundingBoxArray
+from src.cmesrc.utils import (
+    clear_screen,
+    get_closest_record_indices,
+    read_sql_processed_bbox_bulk,
+    to_epoch,
+)
+from src.cmesrc.interval_index import IntervalIndex
+import numpy as np
+from src.cmesrc.config import (
+    RAW_DIMMINGS_CATALOGUE,
+    OFF_DISK_DIMMINGS_MATCHED_TO_HARPS,
+    OFF_DISK_DIMMINGS_MATCHED_TO_HARPS_PICKLE,
+    CMESRC_BBOXES,
+)
+
+import argparse
+import sqlite3
+
+# Plane of the sky position of the dimmings without longitude and latitude,
+# in solar radii from the Sun centre. These columns are optional, catalogues
+# without them have no off-disk dimmings to match
+X_COLUMN = "x"
+Y_COLUMN = "y"
+
+# Only HARPS whose (rotated) centre is at least this far from the Sun centre,
+# in solar radii, are near enough to the limb to match off-disk dimmings.
+# 0.85 solar radii is arcsin(0.85) ~ 58 deg from the disk centre, so these are
+# the HARPS within ~30 deg of the limb
+NEAR_LIMB_MIN_DIST = 0.85
+
+# Maximum difference between the PAs of the dimming and of the HARPS centre.
+# An off-disk dimming is seen above the limb over the region, not over its
+# centre, and a HARPS near the limb spans several degrees of PA. This is the
+# 10 deg margin added to the CME widths in spatial matching plus 5 deg for
+# the extent of the HARPS
+MAX_PA_DIFF = 15
+
+# Columns added to the catalogue columns of every dimming-HARPS pair, besides
+# the MATCH flag
+PAIR_COLUMNS = [
+    "HARPNUM",
+    "DIMMING_X",
+    "DIMMING_Y",
+    "DIMMING_PA",
+    "DIMMING_DISTANCE_TO_SUN_CENTRE",
+    "HARPS_RAW_DATE",
+    "HARPS_PA",
+    "HARPS_DISTANCE_TO_SUN_CENTRE",
+    "HARPS_DIMMING_PA_DIFF",
+]
+
+
+def get_rotated_harps_positions(harps_records, closest_records, dimming_dates, dimming_epochs):
+    """
+    Position angle and distance to the Sun centre of the closest HARPS record
+    of each pair, with the bounding box rotated to the dimming time when they
+    are more than an hour apart. All the rotations are done in one batch.
+    """
+    HARPS_PA = harps_records["PA"].to_numpy(dtype=float)[closest_records]
+    HARPS_DISTANCE_TO_SUN_CENTRE = harps_records["DIST_SUN_CENTRE"].to_numpy(dtype=float)[
+        closest_records
+    ]
+
+    needs_rotation = np.flatnonzero(
+        np.abs(dimming_epochs - harps_records["epoch"].to_numpy()[closest_records]) > 3600
+    )
+
+    if len(needs_rotation) > 0:
+        rotated_records = closest_records[needs_rotation]
+
+        rotated_bboxes = BoundingBoxArray(
+            list(harps_records["timestamp"].to_numpy()[rotated_records]),
+            harps_records["LONDTMIN"].to_numpy()[rotated_records],
+            harps_records["LATDTMIN"].to_numpy()[rotated_records],
+            harps_records["LONDTMAX"].to_numpy()[rotated_records],
+            harps_records["LATDTMAX"].to_numpy()[rotated_records],
+        ).rotate_bbox(dimming_dates[needs_rotation])
+
+        # Rotations giving an invalid bounding box keep the original one
+        rotated = rotated_bboxes.is_valid()
+        rotated_bboxes = rotated_bboxes[rotated]
+        rotated_indices = needs_rotation[rotated]
+
+        HARPS_PA[rotated_indices] = rotated_bboxes.get_position_angle()
+        HARPS_DISTANCE_TO_SUN_CENTRE[rotated_indices] = rotated_bboxes.get_distance_to_sun_centre()
+
+    return HARPS_PA, HARPS_DISTANCE_TO_SUN_CENTRE
+
+
+def match_off_disk_dimmings(
+    conn: sqlite3.Connection,
+    raw_dimmings_catalogue: pd.DataFrame,
+    x_column: str = X_COLUMN,
+    y_column: str = Y_COLUMN,
+) -> pd.DataFrame:
+    """
+    Matches the off-disk dimmings of the catalogue to the HARPS of the
+    database. Returns all the dimming-HARPS pairs, with the MATCH flag.
+    """
+    clear_screen()
+
+    print("===OFF-DISK DIMMINGS===")
+    print("==Matching off-disk dimmings to HARPs==")
+
+    #########################################
+    # Read in the off-disk dimmings catalogue
+    #########################################
+
+    if not {x_column, y_column}.issubset(raw_dimmings_catalogue.columns):
+        print(f"NO {x_column} AND {y_column} COLUMNS IN THE DIMMINGS CATALOGUE, NO OFF-DISK DIMMINGS TO MATCH")
+
+        raw_dimmings_catalogue = raw_dimmings_catalogue.assign(
+            **{x_column: np.nan, y_column: np.nan}
+        )
+
+    # The dimmings without longitude or latitude are the ones dropped by
+    # match_dimmings_to_harps.py
+    off_disk_catalogue = raw_dimmings_catalogue[
+        raw_dimmings_catalogue[["longitude", "latitude"]].isna().any(axis=1)
+        & raw_dimmings_catalogue[[x_column, y_column]].notna().all(axis=1)
+    ].reset_index(drop=True)
+
+    if len(off_disk_catalogue) == 0:
+        return off_disk_catalogue.assign(
+            **{column: [] for column in PAIR_COLUMNS}, MATCH=np.zeros(0, dtype=bool)
+        )
+
+    off_disk_dimmings = OffDiskDimmingBatch(
+        off_disk_catalogue["max_detection_time"].to_list(),
+        off_disk_catalogue[x_column].to_numpy(),
+        off_disk_catalogue[y_column].to_numpy(),
+    )
+
+    dimming_epochs = to_epoch(off_disk_dimmings.DATES)
+    dimming_dates = off_disk_dimmings.DATES.iso
+
+    #########################################
+
+    ##################################
+    # Read in HARPs lifetime catalogue
+    ##################################
+
+    harps_lifetime_database = pd.read_sql(
+        """
+                                        SELECT * FROM HARPS
+                                        WHERE harpnum IN (SELECT DISTINCT harpnum FROM PROCESSED_HARPS_BBOX)
+                                        """,
+        conn,
+    )
+
+    harps_lifetime_index = IntervalIndex(
+        to_epoch(harps_lifetime_database["start"].to_numpy()),
+        to_epoch(harps_lifetime_database["end"].to_numpy()),
+    )
+    harpsnums = harps_lifetime_database["harpnum"].to_numpy()
+
+    ##################################
+
+    ###################################################################
+    # Find HARPs present at the time of the dimming and their positions
+    ###################################################################
+
+    clear_screen()
+
+    print("===OFF-DISK DIMMINGS===")
+    print("==Rotating HARPs to dimming time==")
+
+    dimming_indices, harps_indices = harps_lifetime_index.query_points(dimming_epochs)
+
+    pairs = off_disk_catalogue.iloc[dimming_indices].reset_index(drop=True)
+    pairs["HARPNUM"] = harpsnums[harps_indices]
+
+    harps_records = read_sql_processed_bbox_bulk(conn, np.unique(pairs["HARPNUM"]))
+
+    closest_records = get_closest_record_indices(
+        harps_records["harpnum"].to_numpy(),
+        harps_records["epoch"].to_numpy(),
+        pairs["HARPNUM"].to_numpy(),
+        dimming_epochs[dimming_indices],
+    )
+
+    if np.any(closest_records < 0):
+        raise ValueError("Some HARPS have no bounding boxes")
+
+    HARPS_PA, HARPS_DISTANCE_TO_SUN_CENTRE = get_rotated_harps_positions(
+        harps_records,
+        closest_records,
+        dimming_dates[dimming_indices],
+        dimming_epochs[dimming_indices],
+    )
+
+    pairs["DIMMING_X"] = off_disk_dimmings.X[dimming_indices]
+    pairs["DIMMING_Y"] = off_disk_dimmings.Y[dimming_indices]
+    pairs["DIMMING_PA"] = off_disk_dimmings.PA[dimming_indices]
+    pairs["DIMMING_DISTANCE_TO_SUN_CENTRE"] = off_disk_dimmings.R[dimming_indices]
+    pairs["HARPS_RAW_DATE"] = harps_records["timestamp"].to_numpy()[closest_records]
+    pairs["HARPS_PA"] = HARPS_PA
+    pairs["HARPS_DISTANCE_TO_SUN_CENTRE"] = HARPS_DISTANCE_TO_SUN_CENTRE
+    pairs["HARPS_DIMMING_PA_DIFF"] = off_disk_dimmings.get_pa_diffs(HARPS_PA, dimming_indices)
+
+    ###################################################################
+
+    ###########################################
+    # Match each dimming to the closest HARP in PA
+    ###########################################
+
+    clear_screen()
+
+    print("===OFF-DISK DIMMINGS===")
+    print("==Matching dimmings to near-limb HARPs==")
+
+    pa_diffs = pairs["HARPS_DIMMING_PA_DIFF"].to_numpy()
+
+    candidates = np.flatnonzero(
+        (HARPS_DISTANCE_TO_SUN_CENTRE >= NEAR_LIMB_MIN_DIST) & (pa_diffs < MAX_PA_DIFF)
+    )
+
+    # The match is the candidate with the smallest PA difference, the first
+    # one in row order on ties
+    candidates = candidates[np.lexsort((pa_diffs[candidates], dimming_indices[candidates]))]
+    _, first_candidates = np.unique(dimming_indices[candidates], return_index=True)
+
+    pairs["MATCH"] = False
+    pairs.loc[candidates[first_candidates], "MATCH"] = True
+
+    matched_dimmings = len(first_candidates)
+    unmatched_dimmings = len(off_disk_dimmings) - matched_dimmings
+
+    clear_screen()
+
+    print(f"MATCHED OFF-DISK DIMMINGS: {matched_dimmings}")
+    print(f"UNMATCHED OFF-DISK DIMMINGS: {unmatched_dimmings}")
+
+    pairs.sort_values(
+        by=["dimming_id", "HARPS_DIMMING_PA_DIFF"], ascending=[True, True], inplace=True
+    )
+
+    if np.any(pairs[pairs["MATCH"]].duplicated(subset=["dimming_id"], keep=False)):
+        raise ValueError("Duplicate matches found")
+
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--x-column", default=X_COLUMN)
+    parser.add_argument("--y-column", default=Y_COLUMN)
+    args = parser.parse_args()
+
+    clear_screen()
+
+    pairs = match_off_disk_dimmings(
+        sqlite3.connect(CMESRC_BBOXES),
+        pd.read_csv(RAW_DIMMINGS_CATALOGUE),
+        args.x_column,
+        args.y_column,
+    )
+
+    pairs.to_csv(OFF_DISK_DIMMINGS_MATCHED_TO_HARPS, index=False)
+    pairs.to_pickle(OFF_DISK_DIMMINGS_MATCHED_TO_HARPS_PICKLE)
+
+    clear_screen()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+import pytest
+import src.scripts.dimmings.match_off_disk_dimmings_to_harps as match_off_disk_dimmings_to_harps
+from src.scripts.dimmings.match_off_disk_dimmings_to_harps import match_off_disk_dimmings
+from src.cmesrc.utils import create_processed_harps_ephemeris
+
+START = "2012-01-01 00:00:00"
+END = "2012-01-01 06:00:00"
+
+# HARPNUM: (LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX)
+HARPS_BBOXES = {
+    1: (70, -5, 80, 5),  # West limb, PA 270
+    2: (20, -5, 30, 5),  # West of the disk centre, PA 270 but too far from the limb
+    3: (-5, 60, 5, 70),  # North limb, PA 0
+    4: (-80, -5, -70, 5),  # East limb, PA 90
+}
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(match_off_disk_dimmings_to_harps, "clear_screen", lambda: None)
+
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE HARPS (harpnum INTEGER PRIMARY KEY, start TEXT, end TEXT);
+        CREATE TABLE PROCESSED_HARPS_BBOX (harpnum INTEGER, timestamp TEXT, LONDTMIN REAL, LONDTMAX REAL, LATDTMIN REAL, LATDTMAX REAL);
+        CREATE TABLE PROCESSED_HARPS_EPHEMERIS (harpnum INTEGER, epoch INTEGER, timestamp TEXT, LON_CEN REAL, LAT_CEN REAL, X_CEN REAL, Y_CEN REAL, PA REAL, DIST_SUN_CENTRE REAL);
+        """
+    )
+
+    for harpnum, (lon_min, lat_min, lon_max, lat_max) in HARPS_BBOXES.items():
+        conn.execute("INSERT INTO HARPS VALUES (?, ?, ?)", (harpnum, START, END))
+
+        for timestamp in [START, "2012-01-01 00:12:00"]:
+            conn.execute(
+                "INSERT INTO PROCESSED_HARPS_BBOX VALUES (?, ?, ?, ?, ?, ?)",
+                (harpnum, timestamp, lon_min, lon_max, lat_min, lat_max),
+            )
+
+    create_processed_harps_ephemeris(conn)
+
+    return conn
+
+def test_off_disk_dimmings_matching(conn):
+    dimmings = pd.DataFrame(
+        {
+            "dimming_id": [1, 2, 3, 4, 5, 6],
+            "start_time": ["2012-01-01 00:00:00.0"] * 6,
+            "max_detection_time": ["2012-01-01 00:12:00"] * 4 + ["2012-01-01 03:00:00"] * 2,
+            "longitude": [np.nan] * 5 + [10],
+            "latitude": [np.nan] * 5 + [10],
+            "x": [1.1, -0.1, 0.0, -1.1, 1.1, 0.5],
+            "y": [0.05, 1.1, -1.2, 0.35, 0.0, 0.5],
+        }
+    )
+
+    pairs = match_off_disk_dimmings(conn, dimmings)
+    matches = pairs[pairs["MATCH"]]
+
+    # 1: PA 272.6, matches the west limb HARPS but not the one near the centre
+    # 2: PA 5.2, matches the north limb HARPS (PA 360) across 0 deg
+    # 3: PA 180, no HARPS near that PA
+    # 4: PA 72.3, 17.7 deg from the east limb HARPS, more than MAX_PA_DIFF
+    # 5: PA 270, 3 hours after the closest HARPS records, which are rotated
+    # 6: Has longitude and latitude, not an off-disk dimming
+    assert np.all([
+        list(zip(matches["dimming_id"], matches["HARPNUM"])) == [(1, 1), (2, 3), (5, 1)],
+        set(pairs["dimming_id"]) == {1, 2, 3, 4, 5},
+        np.isclose(matches["HARPS_DIMMING_PA_DIFF"].iloc[1], 5.19, atol=0.01),
+        np.all(pairs.loc[pairs["HARPNUM"] == 2, "HARPS_DISTANCE_TO_SUN_CENTRE"] < match_off_disk_dimmings_to_harps.NEAR_LIMB_MIN_DIST),
+        np.isclose(pairs.loc[(pairs["dimming_id"] == 4) & (pairs["HARPNUM"] == 4), "HARPS_DIMMING_PA_DIFF"].iloc[0], 17.65, atol=0.01),
+        # Rotated to 3 hours later, so further west than the record
+        pairs.loc[(pairs["dimming_id"] == 5) & (pairs["HARPNUM"] == 1), "HARPS_DISTANCE_TO_SUN_CENTRE"].iloc[0] > 0.967,
+        ])
+
+def test_catalogue_without_positions(conn):
+    dimmings = pd.DataFrame(
+        {
+            "dimming_id": [1],
+            "start_time": ["2012-01-01 00:00:00.0"],
+            "max_detection_time": ["2012-01-01 00:12:00"],
+            "longitude": [np.nan],
+            "latitude": [np.nan],
+        }
+    )
+
+    pairs = match_off_disk_dimmings(conn, dimmings)
+
+    assert len(pairs) == 0 and "MATCH" in pairs.columns
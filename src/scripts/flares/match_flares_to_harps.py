@@ -1,85 +1,147 @@
+import os
 import pandas as pd
+from astropy.time import Time
 from tqdm import tqdm
-from src.harps.harps import Harps
-from src.cmesrc.utils import filepaths_updated_swan_data, read_SWAN_filepath
+from src.cmesrc.utils import filepaths_updated_swan_data
+from src.cmesrc.scheduler import CostAwareScheduler
+from src.flares.flares import get_flare_class_scores
 import numpy as np
 import json
 from src.cmesrc.config import FLARES_MATCHED_TO_HARPS, FLARES_MATCHED_TO_HARPS_PICKLE
 
-
-def flare_class_to_number(fclass):
-    class_letters = {
-        "A": 0,
-        "B": 10,
-        "C": 20,
-        "M": 30,
-        "X": 40,
+N_WORKERS = 4
+
+FLARE_CLASSES = ["B", "C", "M", "X"]
+
+# Only these columns of the SWAN files are read
+SWAN_FLARE_COLUMNS = (
+    ["Timestamp", "LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"]
+    + [f"{fclass}FLARE" for fclass in FLARE_CLASSES]
+    + [f"{fclass}FLARE_LABEL" for fclass in FLARE_CLASSES]
+)
+
+FLARE_COLUMNS = [
+    "HARPNUM",
+    "FLARE_ID",
+    "FLARE_DATE",
+    "FLARE_LON",
+    "FLARE_LAT",
+    "FLARE_CLASS_SCORE",
+    "FLARE_CLASS",
+    "FLARE_AR",
+    "FLARE_AR_SOURCE",
+    "FLARE_VERIFICATION",
+]
+
+
+def extract_harps_flares(harps_file) -> dict:
+    """
+    Flares of a single SWAN file, given as (harpnum, filepath). Returns the
+    FLARE_COLUMNS as lists, in the order of the rows of the file and, within a
+    row, of the flare classes and labels. FLARE_DATE is left as the timestamp
+    string.
+
+    The flare position is the centre of the HARPS bounding box of the row. All
+    the labels of the file are parsed with a single json.loads.
+    """
+    harpnum, filepath = harps_file
+
+    harp_data = pd.read_csv(filepath, sep="\t", usecols=SWAN_FLARE_COLUMNS)
+
+    flare_flags = harp_data[[f"{fclass}FLARE" for fclass in FLARE_CLASSES]].to_numpy()
+    flare_rows = np.flatnonzero(flare_flags.any(axis=1))
+
+    # (row, class) of every flaring class of every flaring row, in row order
+    # and then in FLARE_CLASSES order
+    rows, classes = np.nonzero(flare_flags[flare_rows].astype(bool))
+    rows = flare_rows[rows]
+
+    labels = harp_data[[f"{fclass}FLARE_LABEL" for fclass in FLARE_CLASSES]].to_numpy()[
+        rows, classes
+    ]
+
+    # A label holds one or more ";" separated flares, all of them are parsed
+    # as a single JSON array
+    flares_per_label = [label.count(";") + 1 for label in labels]
+    flares = json.loads("[" + ",".join(labels).replace(";", ",") + "]")
+
+    flare_harps_rows = np.repeat(rows, flares_per_label)
+
+    lon_cen = (
+        harp_data["LON_MIN"].to_numpy(dtype=float) + harp_data["LON_MAX"].to_numpy(dtype=float)
+    ) / 2
+    lat_cen = (
+        harp_data["LAT_MIN"].to_numpy(dtype=float) + harp_data["LAT_MAX"].to_numpy(dtype=float)
+    ) / 2
+
+    magnitudes = [flare["magnitude"] for flare in flares]
+
+    return {
+        "HARPNUM": [harpnum] * len(flares),
+        "FLARE_ID": [flare["id"] for flare in flares],
+        "FLARE_DATE": harp_data["Timestamp"].to_numpy()[flare_harps_rows].tolist(),
+        "FLARE_LON": lon_cen[flare_harps_rows].tolist(),
+        "FLARE_LAT": lat_cen[flare_harps_rows].tolist(),
+        "FLARE_CLASS_SCORE": get_flare_class_scores(magnitudes).tolist(),
+        "FLARE_CLASS": magnitudes,
+        "FLARE_AR": [flare["NOAA_AR"] for flare in flares],
+        "FLARE_AR_SOURCE": [flare["narn_source"] for flare in flares],
+        "FLARE_VERIFICATION": [flare["verification"] for flare in flares],
     }
-    letter = fclass[0]
-
-    points = class_letters[letter]
-
-    points += float(fclass[1:])
-
-    return points
-
 
-SWAN = filepaths_updated_swan_data()
 
-# SWAN = {
-#    "test": pd.read_csv("/home/julio/cmesrc/data/interim/SWAN/345.csv", sep="\t")
-# }
+def extract_flares(swan_files: dict, n_workers: int = N_WORKERS) -> pd.DataFrame:
+    """
+    Extracts the flares of all the SWAN files ({harpnum: filepath}), streaming
+    the files through a pool of n_workers processes. The results are merged in
+    the order of swan_files as they arrive and deduplicated on FLARE_ID,
+    keeping the first one. Raises a ValueError if the copies of a flare ID
+    disagree on its HARPNUM or FLARE_DATE.
+    """
+    harps_files = list(swan_files.items())
+    file_sizes = [os.path.getsize(filepath) for _, filepath in harps_files]
 
-flares_rows = []
+    scheduler = CostAwareScheduler(n_workers=n_workers)
 
-print("== EXTRACTING FLARES FROM SWAN-SF ==")
+    flares_columns = {column: [] for column in FLARE_COLUMNS}
 
-for harpnum, harp_filepath in tqdm(SWAN.items()):
-    harp_data = read_SWAN_filepath(harp_filepath)
-    flare_mask = harp_data[["BFLARE", "CFLARE", "MFLARE", "XFLARE"]].any(axis=1)
+    for harps_flares in tqdm(
+        scheduler.map(extract_harps_flares, harps_files, file_sizes), total=len(harps_files)
+    ):
+        for column in FLARE_COLUMNS:
+            flares_columns[column].extend(harps_flares[column])
 
-    for idx, row in harp_data[flare_mask].iterrows():
-        harp_data = row[
-            ["Timestamp", "LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"]
-        ].to_list()
+    scheduler.print_stats()
 
-        harps = Harps(*harp_data)
+    flares_data = pd.DataFrame(flares_columns)
 
-        for fclass in ["B", "C", "M", "X"]:
-            if row[f"{fclass}FLARE"]:
-                all_flares_data = row[f"{fclass}FLARE_LABEL"].split(";")
+    # The copies of a flare must be the same flare, only exact copies are
+    # dropped. The dates are still the timestamp strings here
+    flare_copies = flares_data.groupby("FLARE_ID")[["HARPNUM", "FLARE_DATE"]].nunique()
+    inconsistent_ids = flare_copies.index[(flare_copies > 1).any(axis=1)]
 
-                for flare_data in all_flares_data:
-                    flare_data = json.loads(flare_data)
+    if len(inconsistent_ids) > 0:
+        inconsistent_flares = flares_data[flares_data["FLARE_ID"].isin(inconsistent_ids)]
+        print(inconsistent_flares.sort_values("FLARE_ID"))
+        raise ValueError("Duplicate flare IDs with different HARPNUM or FLARE_DATE found")
 
-                    new_flare = {
-                        "HARPNUM": harpnum,
-                        "FLARE_ID": flare_data["id"],
-                        "FLARE_DATE": row["Timestamp"],
-                        "FLARE_LON": harps.get_centre_point().LON,
-                        "FLARE_LAT": harps.get_centre_point().LAT,
-                        "FLARE_CLASS_SCORE": flare_class_to_number(
-                            flare_data["magnitude"]
-                        ),
-                        "FLARE_CLASS": flare_data["magnitude"],
-                        "FLARE_AR": flare_data["NOAA_AR"],
-                        "FLARE_AR_SOURCE": flare_data["narn_source"],
-                        "FLARE_VERIFICATION": flare_data["verification"],
-                    }
+    flares_data = flares_data.drop_duplicates(subset=["FLARE_ID"], keep="first")
 
-                    flares_rows.append(new_flare)
+    # A Time object per flare, like the timestamps of read_SWAN_filepath
+    if len(flares_data) > 0:
+        flares_data["FLARE_DATE"] = list(
+            np.asarray(Time(list(flares_data["FLARE_DATE"]), format="iso"), dtype=object)
+        )
 
-flares_data = pd.DataFrame(flares_rows)
-flares_data = flares_data.drop_duplicates(subset=["FLARE_ID"], keep="first")
+    return flares_data
 
-# Test for duplicates before saving
 
-duplicate_matches = flares_data.duplicated(subset=["FLARE_ID"], keep=False)
+if __name__ == "__main__":
+    SWAN = filepaths_updated_swan_data()
 
-if np.any(duplicate_matches):
-    print(flares_data[duplicate_matches].sort_values("FLARE_ID"))
-    raise ValueError("Duplicate matches found")
+    print("== EXTRACTING FLARES FROM SWAN-SF ==")
 
-flares_data.to_csv(FLARES_MATCHED_TO_HARPS, index=False)
-flares_data.to_pickle(FLARES_MATCHED_TO_HARPS_PICKLE)
+    flares_data = extract_flares(SWAN)
 
+    flares_data.to_csv(FLARES_MATCHED_TO_HARPS, index=False)
+    flares_data.to_pickle(FLARES_MATCHED_TO_HARPS_PICKLE)
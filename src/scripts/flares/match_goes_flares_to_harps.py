@@ -0,0 +1,305 @@
+import pandas as pd
+from astropy.time import Time
+from src.flares.flares import get_flare_class_scores
+from src.cmesrc.classes import BoundingBoxArray
+from src.cmesrc.utils import (
+    clear_screen,
+    get_closest_record_indices,
+    read_sql_processed_bbox_bulk,
+    to_epoch,
+)
+from src.cmesrc.interval_index import IntervalIndex
+import numpy as np
+from src.cmesrc.config import (
+    RAW_FLARE_CATALOGUE,
+    GOES_FLARES_MATCHED_TO_HARPS,
+    GOES_FLARES_MATCHED_TO_HARPS_PICKLE,
+    CMESRC_BBOXES,
+)
+
+import sqlite3
+
+# Columns of the GOES SXR flare catalogue. The position (Stonyhurst longitude
+# and latitude in degrees) and the NOAA active region may be missing
+ID_COLUMN = "flare_id"
+PEAK_TIME_COLUMN = "peak_time"
+CLASS_COLUMN = "goes_class"
+NOAA_AR_COLUMN = "noaa_ar"
+LON_COLUMN = "hgs_lon"
+LAT_COLUMN = "hgs_lat"
+
+DEG_TO_RAD = np.pi / 180
+
+# Flares with a position only match HARPS within this (spherical) distance,
+# the same limit as the dimmings
+MAX_FLARE_DISTANCE = 10 * DEG_TO_RAD
+
+FLARE_AR_SOURCE = "GOES"
+
+
+def get_rotated_bboxes(harps_records, closest_records, flare_dates, flare_epochs):
+    """
+    Bounding boxes of the closest HARPS record of each pair, rotated to the
+    flare peak time when they are more than an hour apart. All the rotations
+    are done in one batch.
+    """
+    LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX = (
+        harps_records[["LONDTMIN", "LATDTMIN", "LONDTMAX", "LATDTMAX"]]
+        .to_numpy(dtype=float)[closest_records]
+        .T.copy()
+    )
+
+    needs_rotation = np.flatnonzero(
+        np.abs(flare_epochs - harps_records["epoch"].to_numpy()[closest_records]) > 3600
+    )
+
+    if len(needs_rotation) > 0:
+        rotated_records = closest_records[needs_rotation]
+
+        rotated_bboxes = BoundingBoxArray(
+            list(harps_records["timestamp"].to_numpy()[rotated_records]),
+            LONDTMIN[needs_rotation],
+            LATDTMIN[needs_rotation],
+            LONDTMAX[needs_rotation],
+            LATDTMAX[needs_rotation],
+        ).rotate_bbox(flare_dates[needs_rotation])
+
+        # Rotations giving an invalid bounding box keep the original one
+        rotated = rotated_bboxes.is_valid()
+        rotated_bboxes = rotated_bboxes[rotated]
+        rotated_indices = needs_rotation[rotated]
+
+        LONDTMIN[rotated_indices] = rotated_bboxes.LON_MIN
+        LATDTMIN[rotated_indices] = rotated_bboxes.LAT_MIN
+        LONDTMAX[rotated_indices] = rotated_bboxes.LON_MAX
+        LATDTMAX[rotated_indices] = rotated_bboxes.LAT_MAX
+
+    return BoundingBoxArray(None, LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX)
+
+
+def match_goes_flares(conn, raw_flare_catalogue) -> pd.DataFrame:
+    """
+    Matches the flares of the GOES flare catalogue to the HARPS of conn.
+    Returns the matched flares, with the columns of FLARES_MATCHED_TO_HARPS
+    plus HARPS_FLARE_DISTANCE.
+    """
+    clear_screen()
+
+    print("===GOES FLARES===")
+    print("==Reading GOES flare catalogue==")
+
+    ###################################
+    # Read in the GOES flare catalogue
+    ###################################
+
+    raw_flare_catalogue = raw_flare_catalogue.copy()
+
+    missing_columns = {ID_COLUMN, PEAK_TIME_COLUMN, CLASS_COLUMN}.difference(
+        raw_flare_catalogue.columns
+    )
+
+    if missing_columns:
+        raise ValueError(f"The GOES flare catalogue has no {sorted(missing_columns)} columns")
+
+    for column in [NOAA_AR_COLUMN, LON_COLUMN, LAT_COLUMN]:
+        if column not in raw_flare_catalogue.columns:
+            raw_flare_catalogue[column] = np.nan
+
+    if np.any(raw_flare_catalogue.duplicated(subset=[ID_COLUMN])):
+        raise ValueError("Duplicate flare ids in the GOES flare catalogue")
+
+    raw_flare_catalogue["FLARE_CLASS_SCORE"] = get_flare_class_scores(
+        raw_flare_catalogue[CLASS_COLUMN].to_numpy()
+    )
+
+    # ALERT: Dropping flares without a valid GOES class, they can't be scored
+    flare_catalogue = raw_flare_catalogue.dropna(
+        subset=[PEAK_TIME_COLUMN, "FLARE_CLASS_SCORE"]
+    ).reset_index(drop=True)
+
+    peak_times = pd.to_datetime(flare_catalogue[PEAK_TIME_COLUMN], format="ISO8601")
+    flare_epochs = peak_times.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    flare_dates = peak_times.dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+
+    flare_lons = flare_catalogue[LON_COLUMN].to_numpy(dtype=float)
+    flare_lats = flare_catalogue[LAT_COLUMN].to_numpy(dtype=float)
+    flare_noaas = flare_catalogue[NOAA_AR_COLUMN].to_numpy(dtype=float)
+
+    has_position = ~np.isnan(flare_lons) & ~np.isnan(flare_lats)
+
+    ###################################
+
+    ##################################
+    # Read in HARPs lifetime catalogue
+    ##################################
+
+    harps_lifetime_database = pd.read_sql(
+        """
+                                        SELECT * FROM HARPS
+                                        WHERE harpnum IN (SELECT DISTINCT harpnum FROM PROCESSED_HARPS_BBOX)
+                                        """,
+        conn,
+    )
+
+    harps_lifetime_index = IntervalIndex(
+        to_epoch(harps_lifetime_database["start"].to_numpy()),
+        to_epoch(harps_lifetime_database["end"].to_numpy()),
+    )
+    harpsnums = harps_lifetime_database["harpnum"].to_numpy()
+
+    noaa_harpnum_mapping = pd.read_sql("SELECT harpnum, noaa FROM NOAA_HARPNUM_MAPPING", conn)
+
+    ##################################
+
+    #####################################################
+    # Find HARPs present at the peak time of every flare
+    #####################################################
+
+    clear_screen()
+
+    print("===GOES FLARES===")
+    print("==Finding HARPs present at flare peak time==")
+
+    flare_indices, harps_indices = harps_lifetime_index.query_points(flare_epochs)
+    pair_harpnums = harpsnums[harps_indices]
+
+    #####################################################
+
+    ######################################################################
+    # Distances to the rotated HARPS boxes, for the flares with a position
+    ######################################################################
+
+    clear_screen()
+
+    print("===GOES FLARES===")
+    print("==Rotating HARPs to flare peak time and calculating distances==")
+
+    distances = np.full(len(flare_indices), np.inf)
+
+    positioned_pairs = np.flatnonzero(has_position[flare_indices])
+
+    if len(positioned_pairs) > 0:
+        positioned_flares = flare_indices[positioned_pairs]
+
+        harps_records = read_sql_processed_bbox_bulk(
+            conn, np.unique(pair_harpnums[positioned_pairs])
+        )
+
+        closest_records = get_closest_record_indices(
+            harps_records["harpnum"].to_numpy(),
+            harps_records["epoch"].to_numpy(),
+            pair_harpnums[positioned_pairs],
+            flare_epochs[positioned_flares],
+        )
+
+        if np.any(closest_records < 0):
+            raise ValueError("Some HARPS have no bounding boxes")
+
+        bboxes = get_rotated_bboxes(
+            harps_records,
+            closest_records,
+            flare_dates[positioned_flares],
+            flare_epochs[positioned_flares],
+        )
+
+        distances[positioned_pairs] = bboxes.get_spherical_point_distance(
+            flare_lons[positioned_flares], flare_lats[positioned_flares]
+        )
+
+    ######################################################################
+
+    ###########################################
+    # Match each flare to a single HARP
+    ###########################################
+
+    clear_screen()
+
+    print("===GOES FLARES===")
+    print("==Matching flares to HARPs==")
+
+    # Flares without a position can only match the HARPS of their NOAA active
+    # region
+    noaa_pairs = pd.MultiIndex.from_arrays(
+        [pair_harpnums, flare_noaas[flare_indices]]
+    ).isin(
+        pd.MultiIndex.from_arrays(
+            [
+                noaa_harpnum_mapping["harpnum"].to_numpy(),
+                noaa_harpnum_mapping["noaa"].to_numpy(dtype=float),
+            ]
+        )
+    )
+
+    pair_has_position = has_position[flare_indices]
+
+    candidates = np.flatnonzero(
+        np.where(pair_has_position, distances <= MAX_FLARE_DISTANCE, noaa_pairs)
+    )
+
+    # A flare with a position matches the HARPS containing it or, if none
+    # does, the closest one. The first one in row order wins on ties
+    candidates = candidates[
+        np.lexsort((distances[candidates], flare_indices[candidates]))
+    ]
+    _, first_candidates = np.unique(flare_indices[candidates], return_index=True)
+
+    matches = candidates[first_candidates]
+    matched_flares = flare_indices[matches]
+
+    matched_catalogue = flare_catalogue.iloc[matched_flares]
+
+    matched_distances = distances[matches]
+    matched_noaas = flare_noaas[matched_flares]
+
+    # Same columns as FLARES_MATCHED_TO_HARPS, so that both are loaded into
+    # the FLARES table in the same way
+    flares_data = pd.DataFrame(
+        {
+            "HARPNUM": pair_harpnums[matches],
+            "FLARE_ID": matched_catalogue[ID_COLUMN].to_numpy(),
+            "FLARE_DATE": np.asarray(
+                Time(list(flare_dates[matched_flares]), format="iso"), dtype=object
+            )
+            if len(matches) > 0
+            else [],
+            "FLARE_LON": flare_lons[matched_flares],
+            "FLARE_LAT": flare_lats[matched_flares],
+            "FLARE_CLASS_SCORE": matched_catalogue["FLARE_CLASS_SCORE"].to_numpy(),
+            "FLARE_CLASS": matched_catalogue[CLASS_COLUMN].astype(str).str.strip().to_numpy(),
+            "FLARE_AR": pd.array(matched_noaas, dtype="Int64"),
+            "FLARE_AR_SOURCE": FLARE_AR_SOURCE,
+            "FLARE_VERIFICATION": np.where(
+                pair_has_position[matches], "Position", "NOAA AR"
+            ),
+            "HARPS_FLARE_DISTANCE": np.where(
+                pair_has_position[matches], matched_distances, np.nan
+            ),
+        }
+    )
+
+    clear_screen()
+
+    print(f"MATCHED GOES FLARES: {len(flares_data)}")
+    print(f"UNMATCHED GOES FLARES: {len(flare_catalogue) - len(flares_data)}")
+    print(f"DROPPED GOES FLARES (NO CLASS): {len(raw_flare_catalogue) - len(flare_catalogue)}")
+
+    duplicate_matches = flares_data.duplicated(subset=["FLARE_ID"], keep=False)
+
+    if np.any(duplicate_matches):
+        print(flares_data[duplicate_matches].sort_values("FLARE_ID"))
+        raise ValueError("Duplicate matches found")
+
+    return flares_data
+
+
+if __name__ == "__main__":
+    clear_screen()
+
+    flares_data = match_goes_flares(
+        sqlite3.connect(CMESRC_BBOXES), pd.read_csv(RAW_FLARE_CATALOGUE)
+    )
+
+    flares_data.to_csv(GOES_FLARES_MATCHED_TO_HARPS, index=False)
+    flares_data.to_pickle(GOES_FLARES_MATCHED_TO_HARPS_PICKLE)
+
+    clear_screen()
@@ -0,0 +1,151 @@
+import json
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from src.harps.harps import Harps
+from src.cmesrc.utils import read_SWAN_filepath
+import pytest
+from src.flares.flares import get_flare_class_scores
+from src.scripts.flares.match_flares_to_harps import (
+    FLARE_COLUMNS,
+    extract_flares,
+    extract_harps_flares,
+)
+
+def flare_label(flare_id, magnitude, noaa_ar=11158):
+    return json.dumps(
+        {
+            "id": flare_id,
+            "magnitude": magnitude,
+            "NOAA_AR": noaa_ar,
+            "narn_source": "SWPC",
+            "verification": "verified",
+        }
+    )
+
+# Rows of a SWAN file: timestamp, bounding box and, for each flare class, the
+# ";" separated labels of its flares (empty if there are none)
+ROWS = [
+    ("2012-01-01 00:00:00", (10, -20, 20, -10), {}),
+    ("2012-01-01 00:12:00", (11, -20, 21, -10), {"C": [(1, "C2.1")]}),
+    ("2012-01-01 00:24:00", (12, -21, 22, -9), {"B": [(2, "B5.0"), (3, "B1.2")], "M": [(4, "M1.5")]}),
+    ("2012-01-01 00:36:00", (13, -20, 23, -10), {}),
+    ("2012-01-01 00:48:00", (14, -20, 24, -10), {"C": [(5, "C1.0"), (6, "C3.3"), (7, "C9.9")], "X": [(8, "X10.2")]}),
+    ("2012-01-01 01:00:00", (15, -20, 25, -10), {"M": [(9, "M2.0"), (10, "M3.0")]}),
+]
+
+def write_swan_file(path, rows):
+    columns = {
+        "Timestamp": [],
+        "USFLUX": [],
+        "LON_MIN": [],
+        "LAT_MIN": [],
+        "LON_MAX": [],
+        "LAT_MAX": [],
+    }
+
+    for fclass in ["B", "C", "M", "X"]:
+        columns[f"{fclass}FLARE"] = []
+        columns[f"{fclass}FLARE_LABEL"] = []
+
+    for timestamp, (lon_min, lat_min, lon_max, lat_max), flares in rows:
+        columns["Timestamp"].append(timestamp)
+        columns["USFLUX"].append(1e21)
+        columns["LON_MIN"].append(lon_min)
+        columns["LAT_MIN"].append(lat_min)
+        columns["LON_MAX"].append(lon_max)
+        columns["LAT_MAX"].append(lat_max)
+
+        for fclass in ["B", "C", "M", "X"]:
+            labels = [flare_label(*flare) for flare in flares.get(fclass, [])]
+            columns[f"{fclass}FLARE"].append(int(len(labels) > 0))
+            columns[f"{fclass}FLARE_LABEL"].append(";".join(labels))
+
+    pd.DataFrame(columns).to_csv(path, sep="\t", index=False)
+
+def extract_harps_flares_per_row(harpnum, filepath):
+    """
+    The per row loop extract_harps_flares replaced.
+    """
+    harp_data = read_SWAN_filepath(filepath)
+    flare_mask = harp_data[["BFLARE", "CFLARE", "MFLARE", "XFLARE"]].any(axis=1)
+
+    flares_rows = []
+
+    for idx, row in harp_data[flare_mask].iterrows():
+        harps = Harps(*row[["Timestamp", "LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"]].to_list())
+
+        for fclass in ["B", "C", "M", "X"]:
+            if row[f"{fclass}FLARE"]:
+                for flare_data in row[f"{fclass}FLARE_LABEL"].split(";"):
+                    flare_data = json.loads(flare_data)
+
+                    flares_rows.append(
+                        {
+                            "HARPNUM": harpnum,
+                            "FLARE_ID": flare_data["id"],
+                            "FLARE_DATE": row["Timestamp"].iso,
+                            "FLARE_LON": harps.get_centre_point().LON,
+                            "FLARE_LAT": harps.get_centre_point().LAT,
+                            "FLARE_CLASS_SCORE": get_flare_class_scores([flare_data["magnitude"]])[0],
+                            "FLARE_CLASS": flare_data["magnitude"],
+                            "FLARE_AR": flare_data["NOAA_AR"],
+                            "FLARE_AR_SOURCE": flare_data["narn_source"],
+                            "FLARE_VERIFICATION": flare_data["verification"],
+                        }
+                    )
+
+    return pd.DataFrame(flares_rows, columns=FLARE_COLUMNS)
+
+def test_extract_harps_flares_matches_per_row(tmp_path):
+    filepath = str(tmp_path / "345.csv")
+    write_swan_file(filepath, ROWS)
+
+    flares = pd.DataFrame(extract_harps_flares((345, filepath)))
+    flares["FLARE_DATE"] = Time(list(flares["FLARE_DATE"]), format="iso").iso
+
+    expected_flares = extract_harps_flares_per_row(345, filepath)
+
+    pd.testing.assert_frame_equal(flares, expected_flares, check_dtype=False)
+
+    assert np.all([
+        list(flares["FLARE_ID"]) == list(range(1, 11)),
+        list(flares["FLARE_CLASS"][1:4]) == ["B5.0", "B1.2", "M1.5"],
+        np.allclose(flares["FLARE_LON"][1:4], 17),
+        ])
+
+def test_extract_harps_flares_without_flares(tmp_path):
+    filepath = str(tmp_path / "345.csv")
+    write_swan_file(filepath, [row for row in ROWS if len(row[2]) == 0])
+
+    flares = extract_harps_flares((345, filepath))
+
+    assert np.all([
+        list(flares.keys()) == FLARE_COLUMNS,
+        np.all([len(column) == 0 for column in flares.values()]),
+        ])
+
+def test_extract_flares_keeps_first_duplicate(tmp_path):
+    swan_files = {345: str(tmp_path / "345.csv"), 346: str(tmp_path / "346.csv")}
+
+    write_swan_file(swan_files[345], ROWS)
+    # Flare 11 is labelled twice in the same record of the second HARPS
+    write_swan_file(swan_files[346], [("2012-01-01 00:48:00", (30, 0, 40, 10), {"M": [(11, "M1.1")], "X": [(11, "M1.1"), (12, "X1.0")]})])
+
+    flares = extract_flares(swan_files, n_workers=2)
+
+    assert np.all([
+        list(flares["FLARE_ID"]) == list(range(1, 13)),
+        list(flares["HARPNUM"]) == [345] * 10 + [346] * 2,
+        flares["FLARE_DATE"].iloc[-1].iso == "2012-01-01 00:48:00.000",
+        ])
+
+def test_extract_flares_raises_on_inconsistent_duplicates(tmp_path):
+    swan_files = {345: str(tmp_path / "345.csv"), 346: str(tmp_path / "346.csv")}
+
+    write_swan_file(swan_files[345], ROWS)
+    # Flare 8 is also labelled in the second HARPS
+    write_swan_file(swan_files[346], [("2012-01-01 00:48:00", (30, 0, 40, 10), {"X": [(8, "X10.2")], "C": [(11, "C1.1")]})])
+
+    with pytest.raises(ValueError):
+        extract_flares(swan_files, n_workers=2)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+import pytest
+import src.scripts.flares.match_goes_flares_to_harps as match_goes_flares_to_harps
+from src.scripts.flares.match_goes_flares_to_harps import DEG_TO_RAD, match_goes_flares
+from src.cmesrc.utils import create_processed_harps_ephemeris
+
+START = "2012-01-01 00:00:00"
+END = "2012-01-01 06:00:00"
+
+# HARPNUM: (LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX)
+HARPS_BBOXES = {
+    1: (0, 0, 10, 10),
+    2: (14, 0, 24, 10),
+    3: (-60, -20, -50, -10),
+}
+
+NOAA_HARPNUM_MAPPING = [(3, 11111)]
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(match_goes_flares_to_harps, "clear_screen", lambda: None)
+
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE HARPS (harpnum INTEGER PRIMARY KEY, start TEXT, end TEXT);
+        CREATE TABLE PROCESSED_HARPS_BBOX (harpnum INTEGER, timestamp TEXT, LONDTMIN REAL, LONDTMAX REAL, LATDTMIN REAL, LATDTMAX REAL);
+        CREATE TABLE PROCESSED_HARPS_EPHEMERIS (harpnum INTEGER, epoch INTEGER, timestamp TEXT, LON_CEN REAL, LAT_CEN REAL, X_CEN REAL, Y_CEN REAL, PA REAL, DIST_SUN_CENTRE REAL);
+        CREATE TABLE NOAA_HARPNUM_MAPPING (noaa INTEGER, harpnum INTEGER);
+        """
+    )
+
+    for harpnum, (lon_min, lat_min, lon_max, lat_max) in HARPS_BBOXES.items():
+        conn.execute("INSERT INTO HARPS VALUES (?, ?, ?)", (harpnum, START, END))
+
+        for timestamp in [START, "2012-01-01 00:12:00"]:
+            conn.execute(
+                "INSERT INTO PROCESSED_HARPS_BBOX VALUES (?, ?, ?, ?, ?, ?)",
+                (harpnum, timestamp, lon_min, lon_max, lat_min, lat_max),
+            )
+
+    conn.executemany(
+        "INSERT INTO NOAA_HARPNUM_MAPPING (harpnum, noaa) VALUES (?, ?)", NOAA_HARPNUM_MAPPING
+    )
+
+    create_processed_harps_ephemeris(conn)
+
+    return conn
+
+def test_goes_flares_matching(conn):
+    flare_catalogue = pd.DataFrame(
+        {
+            "flare_id": [1, 2, 3, 4, 5, 6, 7],
+            "peak_time": ["2012-01-01T00:05:00"] * 6 + ["2012-01-02T00:05:00"],
+            "goes_class": ["M1.5", "C2.0", "X1.0", "B3.1", "C1.1", "", "M1.0"],
+            "noaa_ar": [np.nan, np.nan, np.nan, 11111, 99999, 11111, np.nan],
+            "hgs_lon": [5, 13, 40, np.nan, np.nan, np.nan, 5],
+            "hgs_lat": [5, 5, 5, np.nan, np.nan, np.nan, 5],
+        }
+    )
+
+    flares = match_goes_flares(conn, flare_catalogue)
+
+    # 1: Inside HARPS 1, and 9 deg from HARPS 2
+    # 2: 3 deg from HARPS 1 and 1 deg from HARPS 2, matches the closest one
+    # 3: 16 deg from HARPS 2, more than MAX_FLARE_DISTANCE
+    # 4: No position, matches the HARPS of its NOAA active region
+    # 5: No position and a NOAA active region without HARPS
+    # 6: No GOES class, dropped
+    # 7: No HARPS at its peak time
+    assert np.all([
+        list(zip(flares["FLARE_ID"], flares["HARPNUM"])) == [(1, 1), (2, 2), (4, 3)],
+        list(flares["FLARE_VERIFICATION"]) == ["Position", "Position", "NOAA AR"],
+        np.isclose(flares["HARPS_FLARE_DISTANCE"].iloc[0], 0),
+        np.isclose(flares["HARPS_FLARE_DISTANCE"].iloc[1], 1 * DEG_TO_RAD, rtol=0.01),
+        np.isnan(flares["HARPS_FLARE_DISTANCE"].iloc[2]),
+        np.allclose(flares["FLARE_CLASS_SCORE"], [31.5, 22.0, 13.1]),
+        flares["FLARE_DATE"].iloc[0].iso == "2012-01-01 00:05:00.000",
+        ])
+
+def test_no_matched_goes_flares(conn):
+    flare_catalogue = pd.DataFrame(
+        {
+            "flare_id": [1],
+            "peak_time": ["2012-01-02T00:05:00"],
+            "goes_class": ["M1.0"],
+        }
+    )
+
+    flares = match_goes_flares(conn, flare_catalogue)
+
+    assert len(flares) == 0 and "HARPS_FLARE_DISTANCE" in flares.columns
@@ -0,0 +1,157 @@
+"""
+Benchmarks parse_lasco_cme_catalogue on a synthetic catalogue with the same
+fixed-width layout as univ_all.txt (halo CMEs, missing values, non reliable
+measurements and comment flags included), against the line by line parser.
+"""
+
+from src.cmes.lasco_catalogue import (
+    lasco_lines_to_csv,
+    parse_lasco_lines_per_line,
+    read_catalogue_lines,
+    OUTPUT_COLUMNS,
+)
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+COMMENTS = np.array(
+    [
+        "",
+        "Only C2",
+        "Only C3",
+        "Poor Event",
+        "Very Poor Event",
+        "Only C2 Poor Event; Only 3 points",
+        "Only 2 points",
+        "Very Poor Event; Only C3; Only 4 points",
+    ]
+)
+
+
+def format_column(values, width: int, missing, unreliable=None) -> pd.Series:
+    """
+    Right aligned column of a synthetic catalogue, with "----" for the missing
+    values and a trailing "*" for the non reliable ones.
+    """
+    column = pd.Series(values).astype(str)
+    column = column.where(~missing, "----")
+
+    if unreliable is not None:
+        column = column.where(~unreliable, column + "*")
+
+    return column.str.rjust(width)
+
+
+def generate_synthetic_catalogue(path: str, n_lines: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+
+    epochs = np.sort(rng.integers(820454400, 1704067200, n_lines))
+    dates = pd.to_datetime(epochs, unit="s")
+
+    halo = rng.uniform(size=n_lines) < 0.05
+
+    def missing(fraction):
+        return rng.uniform(size=n_lines) < fraction
+
+    def unreliable(fraction):
+        return rng.uniform(size=n_lines) < fraction
+
+    pa = format_column(rng.integers(0, 360, n_lines), 5, np.zeros(n_lines, dtype=bool))
+    pa = pa.where(~halo, "Halo".rjust(5))
+    width = format_column(rng.integers(5, 360, n_lines), 5, np.zeros(n_lines, dtype=bool))
+    width = width.where(~halo, "360".rjust(5))
+
+    columns = [
+        pd.Series(dates.strftime("%Y/%m/%d")),
+        pd.Series(dates.strftime("%H:%M:%S")).str.rjust(9),
+        pa,
+        width,
+        format_column(rng.integers(50, 2500, n_lines), 7, missing(0.02)),
+        format_column(rng.integers(50, 2500, n_lines), 7, missing(0.1)),
+        format_column(rng.integers(50, 2500, n_lines), 7, missing(0.1)),
+        format_column(rng.integers(50, 2500, n_lines), 7, missing(0.1)),
+        format_column(np.round(rng.normal(0, 20, n_lines), 1), 8, missing(0.1), unreliable(0.3)),
+        format_column(
+            pd.Series(10 ** rng.uniform(13, 16, n_lines)).map("{:.1e}".format),
+            9,
+            missing(0.3),
+            unreliable(0.1),
+        ),
+        format_column(
+            pd.Series(10 ** rng.uniform(27, 32, n_lines)).map("{:.1e}".format),
+            9,
+            missing(0.3),
+            unreliable(0.1),
+        ),
+        format_column(rng.integers(0, 360, n_lines), 6, missing(0.01)),
+    ]
+
+    data = columns[0].str.cat(columns[1:], sep=" ").str.ljust(101)
+    lines = data + "  " + pd.Series(COMMENTS[rng.integers(0, len(COMMENTS), n_lines)])
+
+    header = ["SYNTHETIC LASCO CME CATALOGUE", "", "Date Time PA Width ...", ""]
+
+    with open(path, "w") as file:
+        file.write("\n".join(header + lines.str.rstrip().to_list()) + "\n")
+
+
+def benchmark(n_lines: int, seed: int = 0) -> dict:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        catalogue_path = os.path.join(temp_dir, "univ_all.txt")
+        output_path = os.path.join(temp_dir, "lasco_cme_database.csv")
+
+        generate_synthetic_catalogue(catalogue_path, n_lines, seed)
+
+        start = time.perf_counter()
+        lines = read_catalogue_lines(catalogue_path)
+        read_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        csv_contents = lasco_lines_to_csv(lines)
+        parse_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(output_path, "wb") as file:
+            file.write(csv_contents)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        per_line_contents = (
+            ",".join(OUTPUT_COLUMNS) + "\n"
+            + parse_lasco_lines_per_line(lines).to_csv(index=False, header=False)
+        ).encode("utf-8")
+        per_line_time = time.perf_counter() - start
+
+    if csv_contents != per_line_contents:
+        raise ValueError("The parsed catalogue differs from the line by line parser")
+
+    return {
+        "n_lines": n_lines,
+        "read_time": read_time,
+        "parse_time": parse_time,
+        "write_time": write_time,
+        "per_line_time": per_line_time,
+        "lines_per_second": n_lines / (read_time + parse_time),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--lines", type=int, default=2_000_000, help="Number of CMEs in the synthetic catalogue"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(args.lines, args.seed)
+
+    print(f"LINES: {results['n_lines']}")
+    print(f"READ: {results['read_time']:.2f} s")
+    print(f"PARSE: {results['parse_time']:.2f} s")
+    print(f"WRITE CSV: {results['write_time']:.2f} s")
+    print(f"PARSE LINE BY LINE: {results['per_line_time']:.2f} s (SAME OUTPUT)")
+    print(f"SPEEDUP: {results['per_line_time'] / results['parse_time']:.1f}x")
+    print(f"THROUGHPUT (READ + PARSE): {results['lines_per_second']:,.0f} LINES/S")
@@ -1,7 +1,7 @@
 """
 This script fills missing positions in SWAN data by interpolating bounding boxes
 for intervals where data is missing. It processes each SWAN item in parallel using
-a ProcessPoolExecutor.
+the CostAwareScheduler.
 """
 
 from src.cmesrc.utils import filepaths_dt_swan_data, clear_screen, read_SWAN_filepath
@@ -11,9 +11,9 @@ from src.harps.harps import Harps
 import pandas as pd
 import numexpr as ne
 import numpy as np
-from os.path import join, exists
+from os.path import join, exists, getsize
 from os import mkdir
-import concurrent.futures
+from src.cmesrc.scheduler import CostAwareScheduler
 
 # Ensure the directory for updated SWAN data exists
 if not exists(UPDATED_SWAN):
@@ -142,11 +142,16 @@ def process_swan_item(swan_item):
 
 num_threads = 4
 
-with concurrent.futures.ProcessPoolExecutor(max_workers=num_threads) as executor:
-    futures = [
-        executor.submit(process_swan_item, swan_item) for swan_item in SWAN.items()
-    ]
+# Files with more rows (larger files) take longer, dispatch them first
+swan_items = list(SWAN.items())
+swan_costs = [getsize(swan_filepath) for harpnum, swan_filepath in swan_items]
 
-    for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-        pass
+scheduler = CostAwareScheduler(n_workers=num_threads)
 
+for _ in tqdm(
+    scheduler.map(process_swan_item, swan_items, swan_costs, ordered=False),
+    total=len(swan_items),
+):
+    pass
+
+scheduler.print_stats()
@@ -1,172 +1,331 @@
 """
 Match temporally co-occurent HARPS regions to CMEs
+
+Two modes:
+    full: every temporally matched pair is checked (default)
+    index: CMEs whose HARPS all have a record at the cadence nearest to the CME
+    take their spatially consistent HARPS straight from a position angle index,
+    only the other CMEs go through all their pairs
+
+With --new-cmes-only, only the CMEs added by the last ingest of the LASCO
+catalogue are matched.
 """
 from src.cmesrc.config import (
-    TEMPORAL_MATCHING_HARPS_DATABASE_PICKLE,
+    TEMPORAL_MATCHING_HARPS_PAIRS,
     SPATIOTEMPORAL_MATCHING_HARPS_DATABASE,
-    SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_PICKLE,
+    SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS,
     MAIN_DATABASE,
-    MAIN_DATABASE_PICKLE,
+    MAIN_DATABASE_CHUNKS,
     CMESRC_BBOXES,
+    NEW_LASCO_CME_IDS,
 )
 from src.cmesrc.utils import (
-    get_closest_harps_timestamp,
+    get_closest_record_indices,
     clear_screen,
-    read_sql_processed_bbox,
+    read_sql_processed_bbox_bulk,
+    to_epoch,
 )
-from src.cmes.cmes import CME
-from src.harps.harps import Harps
+from src.cmesrc.pairs import CandidatePairs
+from src.cmesrc.chunked import ChunkWriter, CHUNK_SIZE
+from src.cmesrc.scheduler import CostAwareScheduler, split_by_cost
+from src.cmesrc.checkpoints import CheckpointStore, get_input_hash, map_with_checkpoints
+from src.cmesrc.classes import BoundingBoxArray
+from src.cmesrc.pa_index import CircularPAIndex
+from src.cmes.cmes import CMEBatch
+from src.cmes.lasco_catalogue import read_cme_ids
 import numpy as np
 from tqdm import tqdm
 import pandas as pd
-import multiprocessing as mp
-import astropy.units as u
+from astropy.time import Time
+import argparse
 import sqlite3
-from src.cmesrc.exception_classes import InvalidBoundingBox
-
-conn = sqlite3.connect(CMESRC_BBOXES)
-cur = conn.cursor()
-
-# Let's create an index in case it doesn't exist to make things faster
-
-cur.execute(
-    "CREATE INDEX IF NOT EXISTS idx_processed_harps_bbox_harpnum ON PROCESSED_HARPS_BBOX (HARPNUM);"
-)
 
 EXTRA_CME_WIDTH = 10
 HALO_MAX_SUN_CENTRE_DIST = 1
 
+# Relative cost of a pair that needs rotating and of one that doesn't
+ROTATION_COST = 1
+LOOKUP_COST = 0.02
+TASKS_PER_WORKER = 16
+
 rows = []
 
 
-def setup():
-    temporal_matching_harps = pd.read_pickle(TEMPORAL_MATCHING_HARPS_DATABASE_PICKLE)
-    temporal_matching_harps.set_index("CME_HARPNUM_ID", inplace=True, drop=False)
-    temporal_matching_harps = temporal_matching_harps.sort_values(by="HARPNUM")
-    grouped_matching_harps = temporal_matching_harps.groupby("HARPNUM")
-    final_database = temporal_matching_harps.copy()
-    harps_indices = None
-    ALL_LONDTMIN = []
-    ALL_LATDTMIN = []
-    ALL_LONDTMAX = []
-    ALL_LATDTMAX = []
-    ALL_RAW_HARPS_TIMES = []
+def getIndexedPairs(candidate_pairs, harps_records):
+    """
+    Replaces the pairs of the CMEs that don't need any rotation by their
+    spatially consistent pairs, found in a CircularPAIndex over the HARPS
+    records. That is the CMEs less than 12 minutes away from the nearest
+    cadence with a record at that cadence for all their HARPS, so the closest
+    record of every HARPS is the one at the cadence. The other CMEs keep all
+    their pairs.
+
+    Returns the new pairs and a mask of the indexed CMEs. The non consistent
+    pairs of the indexed CMEs are not in the new pairs, so the output of index
+    mode is the output of full mode without them.
+    """
+    # Records without a finite position (e.g. from an invalid bounding box)
+    # are left out of the index, the CMEs of their HARPS keep all their pairs
+    finite_records = np.isfinite(harps_records["PA"].to_numpy(dtype=float)) & np.isfinite(
+        harps_records["DIST_SUN_CENTRE"].to_numpy(dtype=float)
+    )
+    index_records = np.flatnonzero(finite_records)
+
+    if len(candidate_pairs) == 0 or len(index_records) == 0:
+        return candidate_pairs, np.zeros(len(candidate_pairs.EVENTS), dtype=bool)
+
+    pa_index = CircularPAIndex(
+        harps_records["epoch"].to_numpy()[index_records],
+        harps_records["PA"].to_numpy(dtype=float)[index_records],
+        harps_records["DIST_SUN_CENTRE"].to_numpy(dtype=float)[index_records],
+    )
+
+    cmes = candidate_pairs.EVENTS
+    cme_epochs = to_epoch(cmes["CME_DATE"].to_numpy())
+
+    cadence_positions, cadence_gaps = pa_index.get_nearest_cadences(cme_epochs)
+    cadence_epochs = pa_index.CADENCES[cadence_positions]
+
+    # Pairs whose HARPS has a record at the nearest cadence of their CME
+    pair_records = get_closest_record_indices(
+        harps_records["harpnum"].to_numpy(),
+        harps_records["epoch"].to_numpy(),
+        candidate_pairs.get_pair_harpnums(),
+        cadence_epochs[candidate_pairs.EVENT_INDICES],
+    )
+    pair_at_cadence = (
+        (pair_records >= 0)
+        & (
+            harps_records["epoch"].to_numpy()[pair_records]
+            == cadence_epochs[candidate_pairs.EVENT_INDICES]
+        )
+        & finite_records[pair_records]
+    )
+
+    n_missing = np.bincount(
+        candidate_pairs.EVENT_INDICES[~pair_at_cadence], minlength=len(cmes)
+    )
+    indexed = (cadence_gaps < 12 * 60) & (n_missing == 0)
+
+    halo = cmes["CME_HALO"].to_numpy() == 1
+    non_halo = cmes["CME_HALO"].to_numpy() == 0
+
+    non_halo_cmes = np.flatnonzero(indexed & non_halo)
+    halo_cmes = np.flatnonzero(indexed & halo)
+
+    non_halo_queries, non_halo_records = pa_index.query_pa_windows(
+        cadence_positions[non_halo_cmes],
+        cmes["CME_PA"].to_numpy(dtype=float)[non_halo_cmes],
+        cmes["CME_WIDTH"].to_numpy(dtype=float)[non_halo_cmes] / 2 + EXTRA_CME_WIDTH,
+    )
+    halo_queries, halo_records = pa_index.query_distances(
+        cadence_positions[halo_cmes],
+        np.full(len(halo_cmes), HALO_MAX_SUN_CENTRE_DIST),
+    )
+
+    index_events = np.concatenate(
+        [non_halo_cmes[non_halo_queries], halo_cmes[halo_queries]]
+    )
+    index_harpnums = harps_records["harpnum"].to_numpy()[
+        index_records[np.concatenate([non_halo_records, halo_records])]
+    ]
+
+    # Only the HARPS that were temporally matched to the CME
+    harps_order = np.argsort(candidate_pairs.HARPNUMS)
+    index_harps = harps_order[
+        np.searchsorted(candidate_pairs.HARPNUMS, index_harpnums, sorter=harps_order)
+        % len(harps_order)
+    ]
+
+    pair_keys = (candidate_pairs.EVENT_INDICES.astype(np.int64) << 32) + candidate_pairs.HARP_INDICES
+    index_keys = (index_events.astype(np.int64) << 32) + index_harps
+    key_positions = np.minimum(np.searchsorted(pair_keys, index_keys), len(pair_keys) - 1)
+    temporally_matched = (pair_keys[key_positions] == index_keys) & (
+        candidate_pairs.HARPNUMS[index_harps] == index_harpnums
+    )
+
+    kept_pairs = ~indexed[candidate_pairs.EVENT_INDICES]
+
+    print(
+        f"INDEXED CMES: {np.sum(indexed)} OF {len(cmes)}, "
+        f"PAIRS: {len(candidate_pairs)} -> {np.sum(kept_pairs) + np.sum(temporally_matched)}"
+    )
+
+    indexed_pairs = CandidatePairs(
+        cmes,
+        candidate_pairs.HARPNUMS,
+        np.concatenate(
+            [candidate_pairs.EVENT_INDICES[kept_pairs], index_events[temporally_matched]]
+        ),
+        np.concatenate(
+            [candidate_pairs.HARP_INDICES[kept_pairs], index_harps[temporally_matched]]
+        ),
+    )
+
+    return indexed_pairs, indexed
+
+
+def setup(conn, mode="full", cme_ids=None):
+    """
+    Loads the temporally matched pairs and finds the closest HARPS record of
+    every pair. Returns the pairs, the closest records and a mask of the CMEs
+    whose pairs were reduced by getIndexedPairs (none in full mode).
+    """
+    candidate_pairs = CandidatePairs.load(TEMPORAL_MATCHING_HARPS_PAIRS)
+
+    if cme_ids is not None:
+        candidate_pairs = candidate_pairs.select_events(
+            candidate_pairs.EVENTS["CME_ID"].isin(cme_ids).to_numpy()
+        )
 
     print("\n===Finding Spatially Matching Harps.===\n")
     print("\n=Finding Closest Harps Positions=\n")
-    for harpnum, group in tqdm(grouped_matching_harps):
-        harps_data = read_sql_processed_bbox(harpnum, conn)
-        cme_times = group["CME_DATE"].to_numpy()
-        harps_timestamps = harps_data["Timestamp"].to_numpy()
-        if harps_indices is None:
-            harps_indices = group.index
-        else:
-            harps_indices = harps_indices.append(group.index)
-
-        cme_closest_harps_time_indices = []
-        for cme_time in cme_times:
-            closest_timestamps = get_closest_harps_timestamp(harps_timestamps, cme_time)
-            cme_closest_harps_time_indices.append(closest_timestamps)
-
-        LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX = (
-            harps_data.loc[
-                cme_closest_harps_time_indices,
-                ["LONDTMIN", "LATDTMIN", "LONDTMAX", "LATDTMAX"],
-            ]
-            .to_numpy()
-            .T
-        )
 
-        ALL_LONDTMIN.extend(list(LONDTMIN))
-        ALL_LATDTMIN.extend(list(LATDTMIN))
-        ALL_LONDTMAX.extend(list(LONDTMAX))
-        ALL_LATDTMAX.extend(list(LATDTMAX))
-        ALL_RAW_HARPS_TIMES.extend(list(cme_closest_harps_time_indices))
-
-    final_database.loc[harps_indices, "HARPS_RAW_LONDTMIN"] = ALL_LONDTMIN
-    final_database.loc[harps_indices, "HARPS_RAW_LATDTMIN"] = ALL_LATDTMIN
-    final_database.loc[harps_indices, "HARPS_RAW_LONDTMAX"] = ALL_LONDTMAX
-    final_database.loc[harps_indices, "HARPS_RAW_LATDTMAX"] = ALL_LATDTMAX
-    final_database.loc[harps_indices, "HARPS_RAW_DATE"] = ALL_RAW_HARPS_TIMES
-
-    final_database["HARPS_DATE"] = None
-    final_database["HARPS_MIDPOINT"] = None
-    final_database["HARPS_DISTANCE_TO_SUN_CENTRE"] = None
-    final_database["HARPS_PA"] = None
-    final_database["CME_HARPS_PA_DIFF"] = None
-    final_database["HARPS_RAW_BBOX"] = None
-    final_database["HARPS_LONDTMIN"] = None
-    final_database["HARPS_LATDTMIN"] = None
-    final_database["HARPS_LONDTMAX"] = None
-    final_database["HARPS_LATDTMAX"] = None
+    # All the HARPS records in one query, sorted by harpnum and time
+    harps_records = read_sql_processed_bbox_bulk(conn, candidate_pairs.HARPNUMS)
 
-    return final_database
+    if mode == "index":
+        candidate_pairs, indexed_cmes = getIndexedPairs(candidate_pairs, harps_records)
+    elif mode == "full":
+        indexed_cmes = np.zeros(len(candidate_pairs.EVENTS), dtype=bool)
+    else:
+        raise ValueError(f"Unknown spatial matching mode {mode}")
 
+    cme_epochs = to_epoch(candidate_pairs.EVENTS["CME_DATE"].to_numpy())
+
+    # As-of join, closest HARPS record to the CME time for every pair
+    closest_records = get_closest_record_indices(
+        harps_records["harpnum"].to_numpy(),
+        harps_records["epoch"].to_numpy(),
+        candidate_pairs.get_pair_harpnums(),
+        cme_epochs[candidate_pairs.EVENT_INDICES],
+    )
+
+    if np.any(closest_records < 0):
+        raise ValueError("Some candidate HARPS have no processed bounding boxes")
+
+    def get_closest(column):
+        return harps_records[column].to_numpy()[closest_records]
+
+    # Only the HARPS columns are kept for every pair, the CME columns are
+    # joined chunk by chunk in findSpatialCoOcurrentHarps
+    harps_raw_database = pd.DataFrame(
+        {
+            "HARPS_RAW_LONDTMIN": get_closest("LONDTMIN"),
+            "HARPS_RAW_LATDTMIN": get_closest("LATDTMIN"),
+            "HARPS_RAW_LONDTMAX": get_closest("LONDTMAX"),
+            "HARPS_RAW_LATDTMAX": get_closest("LATDTMAX"),
+            "HARPS_RAW_DATE": get_closest("timestamp"),
+            # Precomputed in PROCESSED_HARPS_EPHEMERIS, used when no rotation is needed
+            "HARPS_RAW_LON_CEN": get_closest("LON_CEN"),
+            "HARPS_RAW_LAT_CEN": get_closest("LAT_CEN"),
+            "HARPS_RAW_PA": get_closest("PA"),
+            "HARPS_RAW_DIST_SUN_CENTRE": get_closest("DIST_SUN_CENTRE"),
+        }
+    )
+
+    return candidate_pairs, harps_raw_database, indexed_cmes
 
-def findSpatialCoOcurrentHarps(cme_ids):
-    return_database = final_database[[ID in cme_ids for ID in final_database["CME_ID"]]]
-    cme_grouped_matching_harps = return_database.groupby("CME_ID")
 
-    for cme_id, group in tqdm(cme_grouped_matching_harps):
-        CME_DETECTION_DATE = group.iloc[0]["CME_DATE"]
-        CME_PA = group.iloc[0]["CME_PA"]
-        CME_WIDTH = group.iloc[0]["CME_WIDTH"]
-        CME_IS_HALO = bool(group.iloc[0]["CME_HALO"])
-        CME_SEEN_ONLY_IN = int(group.iloc[0]["CME_SEEN_IN"])
+def findSpatialCoOcurrentHarps(pair_range):
+    """
+    Works on a contiguous range of pairs [pair_start, pair_end) holding all the
+    pairs of some CMEs (pairs are sorted by CME). Returns only the computed
+    columns, indexed by pair position.
 
-        cme = CME(
-            CME_DETECTION_DATE,
-            CME_PA,
-            CME_WIDTH,
-            halo=CME_IS_HALO,
-            seen_only_in=CME_SEEN_ONLY_IN,
+    The CMEs of the pairs are held in a CMEBatch, which rotates all the boxes
+    that need it in one batch, the rest use the precomputed ephemeris values.
+    """
+    pair_start, pair_end = pair_range
+
+    harps_raw = harps_raw_database.iloc[pair_start:pair_end]
+    cmes = candidate_pairs.EVENTS.iloc[
+        candidate_pairs.EVENT_INDICES[pair_start:pair_end]
+    ]
+
+    harps_dates = Time(harps_raw["HARPS_RAW_DATE"].to_list(), format="iso")
+
+    cme_batch = CMEBatch.from_catalogue(cmes)
+    pair_cmes = np.arange(len(cmes))
+
+    raw_bboxes = BoundingBoxArray(
+        harps_dates,
+        harps_raw["HARPS_RAW_LONDTMIN"].to_numpy(),
+        harps_raw["HARPS_RAW_LATDTMIN"].to_numpy(),
+        harps_raw["HARPS_RAW_LONDTMAX"].to_numpy(),
+        harps_raw["HARPS_RAW_LATDTMAX"].to_numpy(),
+    )
+
+    # Rotate if no timestamp within 12 minutes. Rotations giving an invalid
+    # bounding box keep the original one
+    rotated, _, final_bboxes = cme_batch.rotate_bboxes(pair_cmes, raw_bboxes)
+    rotated_indices = np.flatnonzero(rotated)
+
+    # The boxes that weren't rotated use the precomputed ephemeris values
+    LON_CEN = harps_raw["HARPS_RAW_LON_CEN"].to_numpy(dtype=float).copy()
+    LAT_CEN = harps_raw["HARPS_RAW_LAT_CEN"].to_numpy(dtype=float).copy()
+    PA = harps_raw["HARPS_RAW_PA"].to_numpy(dtype=float).copy()
+    DIST_SUN_CENTRE = harps_raw["HARPS_RAW_DIST_SUN_CENTRE"].to_numpy(dtype=float).copy()
+
+    if len(rotated_indices) > 0:
+        rotated_bboxes = final_bboxes[rotated_indices]
+
+        LON_CEN[rotated_indices], LAT_CEN[rotated_indices] = (
+            rotated_bboxes.get_centre_point()
         )
+        PA[rotated_indices] = rotated_bboxes.get_position_angle()
+        DIST_SUN_CENTRE[rotated_indices] = rotated_bboxes.get_distance_to_sun_centre()
+
+    CME_HARPS_PA_DIFF = cme_batch.get_pa_diff(PA, pair_cmes)
+
+    LONDTMIN = final_bboxes.LON_MIN
+    LATDTMIN = final_bboxes.LAT_MIN
+    LONDTMAX = final_bboxes.LON_MAX
+    LATDTMAX = final_bboxes.LAT_MAX
+    HARPS_DATE = final_bboxes.DATE.iso
+
+    return pd.DataFrame(
+        {
+            "HARPS_DATE": HARPS_DATE,
+            "HARPS_LON_CEN": LON_CEN,
+            "HARPS_LAT_CEN": LAT_CEN,
+            "HARPS_DISTANCE_TO_SUN_CENTRE": DIST_SUN_CENTRE,
+            "HARPS_PA": PA,
+            "CME_HARPS_PA_DIFF": CME_HARPS_PA_DIFF,
+            "HARPS_LONDTMIN": LONDTMIN,
+            "HARPS_LATDTMIN": LATDTMIN,
+            "HARPS_LONDTMAX": LONDTMAX,
+            "HARPS_LATDTMAX": LATDTMAX,
+        },
+        index=np.arange(pair_start, pair_end),
+    )
+
+
+def assemble_chunk(pair_range, computed_columns):
+    """
+    Builds the output rows of a range of pairs: CME columns, closest HARPS
+    record and the columns computed by findSpatialCoOcurrentHarps.
+    """
+    pair_positions = np.arange(*pair_range)
+
+    chunk = candidate_pairs.to_frame(pair_positions)
+    chunk.index = pair_positions
+    chunk = chunk.join(harps_raw_database.iloc[pair_range[0] : pair_range[1]])
+    chunk["HARPS_RAW_DATE"] = list(Time(chunk["HARPS_RAW_DATE"].to_list()))
+    chunk = chunk.join(computed_columns)
+    chunk = find_matches(chunk)
+
+    # Only the spatially consistent pairs of the indexed CMEs were kept, the
+    # full check must agree with the index on all of them
+    indexed_rows = indexed_cmes[candidate_pairs.EVENT_INDICES[chunk.index]]
 
-        for idx, harps_data in group.iterrows():
-            HARPS_DATE = harps_data["HARPS_RAW_DATE"]
-            LONDTMIN = harps_data["HARPS_RAW_LONDTMIN"]
-            LATDTMIN = harps_data["HARPS_RAW_LATDTMIN"]
-            LONDTMAX = harps_data["HARPS_RAW_LONDTMAX"]
-            LATDTMAX = harps_data["HARPS_RAW_LATDTMAX"]
-            HARPNUM = harps_data["HARPNUM"]
-
-            harps = Harps(
-                date=HARPS_DATE,
-                lon_min=LONDTMIN,
-                lat_min=LATDTMIN,
-                lon_max=LONDTMAX,
-                lat_max=LATDTMAX,
-                HARPNUM=HARPNUM,
-            )
-            if np.abs(HARPS_DATE - CME_DETECTION_DATE) > 12 * u.min:
-                try:
-                    harps = harps.rotate_bbox(
-                        CME_DETECTION_DATE
-                    )  # Rotate if no timestamp within 12 minutes
-                except TypeError:
-                    harps = harps
-                except InvalidBoundingBox:
-                    harps = harps
-
-            #            return_database.at[harps_data.index, "HARPS_SPAT_CONSIST"] = is_harps_within_boundary
-            return_database.at[idx, "HARPS_DATE"] = harps.DATE.to_string()
-            return_database.at[
-                idx, "HARPS_MIDPOINT"
-            ] = harps.get_centre_point().get_raw_coords()
-            return_database.at[
-                idx, "HARPS_DISTANCE_TO_SUN_CENTRE"
-            ] = harps.get_distance_to_sun_centre()
-            return_database.at[idx, "HARPS_PA"] = harps.get_position_angle()
-            return_database.at[idx, "CME_HARPS_PA_DIFF"] = cme.get_bbox_pa_diff(harps)
-            return_database.at[idx, "HARPS_RAW_BBOX"] = harps.get_raw_bbox()
-            return_database.at[idx, "HARPS_LONDTMIN"] = harps.get_raw_bbox()[0][0]
-            return_database.at[idx, "HARPS_LATDTMIN"] = harps.get_raw_bbox()[0][1]
-            return_database.at[idx, "HARPS_LONDTMAX"] = harps.get_raw_bbox()[1][0]
-            return_database.at[idx, "HARPS_LATDTMAX"] = harps.get_raw_bbox()[1][1]
-    return return_database
-
-
-def find_matches_and_save(final_database):
+    if not np.all(chunk["HARPS_SPAT_CONSIST"].to_numpy(dtype=bool)[indexed_rows]):
+        raise ValueError("Non consistent pairs found for CMEs matched with the index")
+
+    return chunk
+
+
+def find_matches(final_database):
     non_halo = final_database[final_database["CME_HALO"] == 0]
     halo = final_database[final_database["CME_HALO"] == 1]
 
@@ -183,37 +342,111 @@ def find_matches_and_save(final_database):
 
     final_database.sort_values(by=["CME_DATE", "HARPNUM"], inplace=True)
 
-    #    final_database.to_csv(ALL_MATCHING_HARPS_DATABASE, index=False)
-    #    final_database.to_pickle(ALL_MATCHING_HARPS_DATABASE_PICKLE)
+    return final_database
+
 
-    final_database.to_csv(SPATIOTEMPORAL_MATCHING_HARPS_DATABASE, index=False)
-    final_database.to_pickle(SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_PICKLE)
+def estimate_pair_costs(candidate_pairs, harps_raw_database):
+    """
+    Relative cost of each pair. Pairs whose closest HARPS record is more than
+    12 minutes away from the CME need a rotation, which dominates the cost, the
+    rest only use precomputed values.
+    """
+    cme_epochs = to_epoch(candidate_pairs.EVENTS["CME_DATE"].to_numpy())
+    harps_epochs = to_epoch(harps_raw_database["HARPS_RAW_DATE"].to_numpy())
 
-    final_database.to_csv(MAIN_DATABASE, index=False)
-    final_database.to_pickle(MAIN_DATABASE_PICKLE)
+    time_gaps = np.abs(harps_epochs - cme_epochs[candidate_pairs.EVENT_INDICES])
+
+    return np.where(time_gaps > 12 * 60, ROTATION_COST, LOOKUP_COST)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--mode",
+        choices=["full", "index"],
+        default="full",
+        help="Check every pair or use the position angle index for the CMEs that allow it",
+    )
+    parser.add_argument(
+        "--new-cmes-only",
+        action="store_true",
+        help="Only match the CMEs added by the last ingest of the LASCO catalogue",
+    )
+    args = parser.parse_args()
+
     clear_screen()
     N = 4
 
-    final_database = setup()
+    conn = sqlite3.connect(CMESRC_BBOXES)
 
-    clear_screen()
+    # Let's create an index in case it doesn't exist to make things faster
 
-    final_database_copy = final_database.copy()
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_harps_bbox_harpnum ON PROCESSED_HARPS_BBOX (HARPNUM);"
+    )
 
-    cme_ids_all = np.array(list(set(final_database["CME_ID"])))
+    candidate_pairs, harps_raw_database, indexed_cmes = setup(
+        conn,
+        mode=args.mode,
+        cme_ids=read_cme_ids(NEW_LASCO_CME_IDS) if args.new_cmes_only else None,
+    )
 
-    cme_ids_list = np.array_split(cme_ids_all, N)
+    clear_screen()
+
+    # Small tasks of similar cost, never splitting a CME (pairs are sorted by CME)
+    pair_costs = estimate_pair_costs(candidate_pairs, harps_raw_database)
+    pair_ranges = split_by_cost(
+        pair_costs,
+        TASKS_PER_WORKER * N,
+        boundaries=candidate_pairs.EVENT_OFFSETS,
+        max_size=CHUNK_SIZE,
+    )
+    task_costs = [pair_costs[start:end].sum() for start, end in pair_ranges]
+
+    scheduler = CostAwareScheduler(n_workers=N)
+
+    # Finished ranges are checkpointed, keyed by the inputs and the parameters
+    # of the split, so an interrupted run restarts where it stopped
+    checkpoint_store = CheckpointStore(
+        "spatial_matching",
+        get_input_hash(
+            candidate_pairs.EVENTS,
+            candidate_pairs.EVENT_INDICES,
+            candidate_pairs.HARPNUMS[candidate_pairs.HARP_INDICES],
+            harps_raw_database,
+            pair_ranges,
+        ),
+    )
 
     print("\n===Finding Spatially Matching Harps.===\n")
     print("\n=Rotating Harps Positions=\n")
-    with mp.Pool(processes=N) as pool:
-        final_database_copy = pd.concat(
-            list(tqdm(pool.imap(findSpatialCoOcurrentHarps, cme_ids_list)))
-        )
 
-    find_matches_and_save(final_database_copy)
-
-    clear_screen()
+    # Chunks are written as they are finished, in CME order
+    with ChunkWriter(
+        SPATIOTEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS,
+        SPATIOTEMPORAL_MATCHING_HARPS_DATABASE,
+    ) as spatiotemporal_writer, ChunkWriter(
+        MAIN_DATABASE_CHUNKS, MAIN_DATABASE
+    ) as main_writer:
+        for pair_range, computed_columns in zip(
+            pair_ranges,
+            tqdm(
+                map_with_checkpoints(
+                    scheduler,
+                    checkpoint_store,
+                    findSpatialCoOcurrentHarps,
+                    pair_ranges,
+                    pair_ranges,
+                    task_costs,
+                ),
+                total=len(pair_ranges),
+            ),
+        ):
+            chunk = assemble_chunk(pair_range, computed_columns)
+            spatiotemporal_writer.write(chunk)
+            main_writer.write(chunk)
+
+    scheduler.print_stats()
+
+    # All the outputs are written, the checkpoints are not needed anymore
+    checkpoint_store.clear()
@@ -1,22 +1,43 @@
 """
 Will match CMEs with HARPS regions that were present on-disk at the time of the CME.
 HERE THE LASCO CME DATABASE IS MASKED TO ONLY CMES WITHOUT POOR OR VERY POOR DESCRIPTIONS AND NO N POINTS WARNINGS
+
+Two modes:
+    detection: HARPS present at the CME detection time (default)
+    onset: HARPS present at any time within [onset - margin, detection], where
+    the onset is the linear back-projection of the CME to the Sun centre
+
+With --prefilter, pairs that can't be spatially consistent under any rotation
+of the HARPS (checked against its daily envelopes) are dropped before the pairs
+are stored.
+
+With --new-cmes-only, only the CMEs added by the last ingest of the LASCO
+catalogue are matched.
 """
 
 from src.cmesrc.config import (
     LASCO_CME_DATABASE,
+    NEW_LASCO_CME_IDS,
     TEMPORAL_MATCHING_HARPS_DATABASE,
-    TEMPORAL_MATCHING_HARPS_DATABASE_PICKLE,
+    TEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS,
+    TEMPORAL_MATCHING_HARPS_PAIRS,
     CMESRC_BBOXES,
 )
-from src.cmesrc.utils import clear_screen
+from src.cmesrc.utils import clear_screen, to_epoch
+from src.cmesrc.interval_index import IntervalIndex
+from src.cmesrc.pairs import CandidatePairs
+from src.cmesrc.chunked import ChunkWriter, CHUNK_SIZE
+from src.cmes.lasco_catalogue import read_cme_ids
+from src.cmes.cmes import calculate_approximate_linear_times_at_sun_centre
+from src.harps.envelopes import HarpsDailyEnvelopes
+import argparse
 import numpy as np
-from tqdm import tqdm
-from astropy.time import Time
-from bisect import bisect_right
 import pandas as pd
 import sqlite3
 
+ONSET_WINDOW_MARGIN = 60  # Minutes before the onset time
+EXTRA_CME_WIDTH = 10  # Same as in spatial_matching.py
+
 conn = sqlite3.connect(CMESRC_BBOXES)
 cur = conn.cursor()
 
@@ -37,86 +58,149 @@ harps_lifetime_database = pd.read_sql(
     conn,
 )
 
-harps_lifetime_start_times = np.array(
-    [Time(harps_time) for harps_time in harps_lifetime_database["start"]]
-)
-harps_lifetime_end_times = np.array(
-    [Time(harps_time) for harps_time in harps_lifetime_database["end"]]
-)
-lasco_cme_database["CME_DATE"] = np.array(
-    [Time(cme_time) for cme_time in lasco_cme_database["CME_DATE"]]
-)  # Parse dates
-cme_detection_times = lasco_cme_database["CME_DATE"].to_numpy()
+harps_lifetime_start_epochs = to_epoch(harps_lifetime_database["start"].to_numpy())
+harps_lifetime_end_epochs = to_epoch(harps_lifetime_database["end"].to_numpy())
+cme_detection_epochs = to_epoch(lasco_cme_database["CME_DATE"].to_numpy())
 
 harpsnums = harps_lifetime_database["harpnum"].to_numpy()
 
-FIRST_AVAILABLE_HARPS = min(harps_lifetime_start_times)
-LAST_AVAILABLE_HARPS = max(harps_lifetime_end_times)
+FIRST_AVAILABLE_HARPS = min(harps_lifetime_start_epochs)
+LAST_AVAILABLE_HARPS = max(harps_lifetime_end_epochs)
 
-CME_TIME_MASK = np.array(cme_detection_times >= FIRST_AVAILABLE_HARPS) & np.array(
-    (cme_detection_times <= LAST_AVAILABLE_HARPS)
+CME_TIME_MASK = np.array(cme_detection_epochs >= FIRST_AVAILABLE_HARPS) & np.array(
+    (cme_detection_epochs <= LAST_AVAILABLE_HARPS)
 )
 CME_QUALITY_MASK = lasco_cme_database["CME_QUALITY"] == 0
 CME_FULL_MASK = CME_TIME_MASK & CME_QUALITY_MASK
 
 masked_lasco_cme_database = lasco_cme_database[CME_FULL_MASK]
-masked_cme_times = np.array(
-    [Time(cme_time) for cme_time in masked_lasco_cme_database["CME_DATE"]]
-)
+masked_cme_epochs = cme_detection_epochs[np.array(CME_FULL_MASK)]
 
 
-def findAllMatchingRegions():
-    print("== Finding HARPS that match CMEs temporally ==")
-
-    sorted_start_indices = np.argsort(harps_lifetime_start_times)
-    sorted_end_indices = np.argsort(harps_lifetime_end_times)
-
-    harps_lifetime_start_times_sorted = harps_lifetime_start_times[sorted_start_indices]
-    harps_lifetime_end_times_sorted = harps_lifetime_end_times[sorted_end_indices]
+def prefilterPairs(cme_indices, harps_indices):
+    """
+    Drops the pairs whose HARPS can't be within the CME PA criterion of
+    spatial matching under any rotation. Never drops a spatially consistent
+    pair.
+    """
+    harps_envelopes = HarpsDailyEnvelopes.from_sql(conn)
+
+    keep = harps_envelopes.get_possible_pairs(
+        harpsnums[harps_indices],
+        masked_cme_epochs[cme_indices],
+        masked_lasco_cme_database["CME_PA"].to_numpy(dtype=float)[cme_indices],
+        masked_lasco_cme_database["CME_WIDTH"].to_numpy(dtype=float)[cme_indices],
+        masked_lasco_cme_database["CME_HALO"].to_numpy(dtype=bool)[cme_indices],
+        EXTRA_CME_WIDTH,
+    )
 
-    full_list_of_matches = []
-    new_data_rows = []
+    n_pruned = len(keep) - np.sum(keep)
 
-    n = len(harpsnums)
+    print(
+        f"PREFILTER: PRUNED {n_pruned} OF {len(keep)} PAIRS ({100 * n_pruned / max(len(keep), 1):.1f}%)"
+    )
 
-    for cme_time in tqdm(masked_cme_times):
-        start_index = bisect_right(harps_lifetime_start_times_sorted, cme_time)
-        end_index = bisect_right(harps_lifetime_end_times_sorted, cme_time)
+    return cme_indices[keep], harps_indices[keep]
 
-        start_indices = sorted_start_indices[:start_index]
-        end_indices = sorted_end_indices[end_index:]
 
-        harps = harpsnums[np.intersect1d(start_indices, end_indices)]
+def findAllMatchingRegions(
+    mode="detection", onset_margin=ONSET_WINDOW_MARGIN, prefilter=False
+):
+    print("== Finding HARPS that match CMEs temporally ==")
 
-        full_list_of_matches.append(list(harps))
+    harps_lifetime_index = IntervalIndex(
+        harps_lifetime_start_epochs, harps_lifetime_end_epochs
+    )
 
-    for i, harpnum_list in enumerate(full_list_of_matches):
-        for harpnum in harpnum_list:
-            new_row = masked_lasco_cme_database.iloc[i].to_dict()
-            new_row["HARPNUM"] = harpnum
-            new_row["CME_HARPNUM_ID"] = f"{new_row['CME_ID']}{harpnum}"
-            new_data_rows.append(new_row)
+    if mode == "detection":
+        # Pairs of (CME index, HARPS index) for every HARPS present at the CME time
+        cme_indices, harps_indices = harps_lifetime_index.query_points(
+            masked_cme_epochs
+        )
+    elif mode == "onset":
+        cme_onset_epochs = calculate_approximate_linear_times_at_sun_centre(
+            masked_cme_epochs,
+            masked_lasco_cme_database["CME_LINEAR_SPEED"].to_numpy(),
+            masked_lasco_cme_database["CME_SEEN_IN"].to_numpy(),
+        )
+
+        window_starts = np.floor(cme_onset_epochs - onset_margin * 60).astype(np.int64)
+
+        # Pairs of (CME index, HARPS index) for every HARPS present at any
+        # time within [onset - margin, detection]
+        cme_indices, harps_indices = harps_lifetime_index.query_overlaps(
+            window_starts, masked_cme_epochs
+        )
+    else:
+        raise ValueError(f"Unknown temporal matching mode {mode}")
+
+    if prefilter:
+        cme_indices, harps_indices = prefilterPairs(cme_indices, harps_indices)
+
+    # Only the pair indices are stored, the CME columns stay in the CME table
+    # and are joined when needed
+    temporal_matching_harps_pairs = CandidatePairs(
+        masked_lasco_cme_database, harpsnums, cme_indices, harps_indices
+    )
 
-    temporal_matching_harps_database = pd.DataFrame.from_records(new_data_rows)
-    columns = temporal_matching_harps_database.columns
-    first_cols = ["CME_ID", "CME_HARPNUM_ID", "CME_DATE", "HARPNUM"]
-    temporal_matching_harps_database = temporal_matching_harps_database[
-        first_cols + [col for col in columns if col not in first_cols]
-    ]
+    temporal_matching_harps_pairs.save(TEMPORAL_MATCHING_HARPS_PAIRS)
 
     # NOT ANYMORE, SOLVED
     # Some CMEs have the exact same time but are supposedly different ones, this makes life hard because if they share a HARPS region then I will get duplicated IDs. I'll just remove duplicated.
 
     # temporal_matching_harps_database.drop_duplicates(subset=["CME_HARPNUM_ID"], inplace=True)
-    temporal_matching_harps_database.to_csv(
-        TEMPORAL_MATCHING_HARPS_DATABASE, index=False
-    )
-    temporal_matching_harps_database.to_pickle(TEMPORAL_MATCHING_HARPS_DATABASE_PICKLE)
+
+    # The wide table (one row per pair) is written in chunks so it's never
+    # fully in memory
+    with ChunkWriter(
+        TEMPORAL_MATCHING_HARPS_DATABASE_CHUNKS, TEMPORAL_MATCHING_HARPS_DATABASE
+    ) as writer:
+        for chunk_start in range(0, len(temporal_matching_harps_pairs), CHUNK_SIZE):
+            chunk_positions = np.arange(
+                chunk_start,
+                min(chunk_start + CHUNK_SIZE, len(temporal_matching_harps_pairs)),
+            )
+            writer.write(temporal_matching_harps_pairs.to_frame(chunk_positions))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--mode",
+        choices=["detection", "onset"],
+        default="detection",
+        help="Match HARPS at the detection time or within the onset time window",
+    )
+    parser.add_argument(
+        "--onset-margin",
+        type=float,
+        default=ONSET_WINDOW_MARGIN,
+        help="Minutes before the onset time included in the onset time window",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Drop pairs that can't be spatially consistent before storing them",
+    )
+    parser.add_argument(
+        "--new-cmes-only",
+        action="store_true",
+        help="Only match the CMEs added by the last ingest of the LASCO catalogue",
+    )
+    args = parser.parse_args()
+
+    if args.new_cmes_only:
+        new_cmes = masked_lasco_cme_database["CME_ID"].isin(
+            read_cme_ids(NEW_LASCO_CME_IDS)
+        ).to_numpy()
+
+        masked_lasco_cme_database = masked_lasco_cme_database[new_cmes]
+        masked_cme_epochs = masked_cme_epochs[new_cmes]
+
     clear_screen()
 
-    findAllMatchingRegions()
+    findAllMatchingRegions(
+        mode=args.mode, onset_margin=args.onset_margin, prefilter=args.prefilter
+    )
 
     clear_screen()
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+import pytest
+import src.scripts.spatiotemporal_matching.spatial_matching as spatial_matching
+from src.cmesrc.pairs import CandidatePairs
+from src.cmesrc.utils import create_processed_harps_ephemeris
+
+START = pd.Timestamp("2012-01-01 00:00:00")
+
+# HARPNUM: (LONDTMIN, LATDTMIN, LONDTMAX, LATDTMAX)
+HARPS_BBOXES = {
+    1: (0, 10, 10, 20),
+    2: (-40, -20, -30, -10),
+    3: (50, 0, 60, 10),
+    4: (-5, -5, 5, 5),
+}
+
+# HARPS 3 has no records around 04:36, so the CMEs at that time can't use the
+# index and their HARPS 3 box is rotated
+MISSING_RECORDS = {3: ["2012-01-01 04:24:00", "2012-01-01 04:36:00", "2012-01-01 04:48:00"]}
+
+CMES = pd.DataFrame(
+    {
+        "CME_ID": [1, 2, 3, 4, 5, 6],
+        "CME_DATE": [
+            "2012-01-01 01:00:00",
+            "2012-01-01 02:03:00",
+            "2012-01-01 03:24:00",
+            "2012-01-01 04:36:00",
+            "2012-01-01 04:40:00",
+            "2012-01-01 05:10:00",
+        ],
+        "CME_PA": [0, 90, np.nan, 250, 270, 300],
+        "CME_WIDTH": [40, 60, 360, 100, 40, 60],
+        "CME_HALO": [0, 0, 1, 0, 0, 0],
+        "CME_LINEAR_SPEED": [500, 800, 1200, np.nan, 300, 400],
+        "CME_SEEN_IN": [0, 0, 0, 1, 0, 2],
+    }
+)
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE PROCESSED_HARPS_BBOX (harpnum INTEGER, timestamp TEXT, LONDTMIN REAL, LONDTMAX REAL, LATDTMIN REAL, LATDTMAX REAL);
+        CREATE TABLE PROCESSED_HARPS_EPHEMERIS (harpnum INTEGER, epoch INTEGER, timestamp TEXT, LON_CEN REAL, LAT_CEN REAL, X_CEN REAL, Y_CEN REAL, PA REAL, DIST_SUN_CENTRE REAL);
+        """
+    )
+
+    timestamps = pd.date_range(START, periods=31, freq="12min").strftime("%Y-%m-%d %H:%M:%S")
+
+    for harpnum, (lon_min, lat_min, lon_max, lat_max) in HARPS_BBOXES.items():
+        for timestamp in timestamps:
+            if timestamp not in MISSING_RECORDS.get(harpnum, []):
+                conn.execute(
+                    "INSERT INTO PROCESSED_HARPS_BBOX VALUES (?, ?, ?, ?, ?, ?)",
+                    (harpnum, timestamp, lon_min, lon_max, lat_min, lat_max),
+                )
+
+    create_processed_harps_ephemeris(conn)
+
+    # Every CME is temporally matched to every HARPS
+    harpnums = np.array(list(HARPS_BBOXES.keys()))
+    cme_indices, harp_indices = np.meshgrid(np.arange(len(CMES)), np.arange(len(harpnums)))
+
+    pairs_path = str(tmp_path / "temporal_matching_harps_pairs.pkl")
+    CandidatePairs(CMES, harpnums, cme_indices.ravel(), harp_indices.ravel()).save(pairs_path)
+
+    monkeypatch.setattr(spatial_matching, "TEMPORAL_MATCHING_HARPS_PAIRS", pairs_path)
+
+    return conn
+
+def match(conn, monkeypatch, mode):
+    candidate_pairs, harps_raw_database, indexed_cmes = spatial_matching.setup(conn, mode=mode)
+
+    monkeypatch.setattr(spatial_matching, "candidate_pairs", candidate_pairs, raising=False)
+    monkeypatch.setattr(spatial_matching, "harps_raw_database", harps_raw_database, raising=False)
+    monkeypatch.setattr(spatial_matching, "indexed_cmes", indexed_cmes, raising=False)
+
+    pair_range = (0, len(candidate_pairs))
+
+    matches = spatial_matching.assemble_chunk(
+        pair_range, spatial_matching.findSpatialCoOcurrentHarps(pair_range)
+    )
+
+    return matches, indexed_cmes
+
+def test_index_mode_drops_only_non_consistent_pairs_of_indexed_cmes(conn, monkeypatch):
+    full_matches, _ = match(conn, monkeypatch, "full")
+    index_matches, indexed_cmes = match(conn, monkeypatch, "index")
+
+    indexed_ids = CMES["CME_ID"][indexed_cmes]
+
+    expected_matches = full_matches[
+        ~full_matches["CME_ID"].isin(indexed_ids) | full_matches["HARPS_SPAT_CONSIST"].astype(bool)
+    ]
+
+    columns = ["CME_ID", "HARPNUM", "HARPS_DATE", "HARPS_PA", "CME_HARPS_PA_DIFF", "HARPS_SPAT_CONSIST"]
+
+    pd.testing.assert_frame_equal(
+        index_matches[columns].reset_index(drop=True),
+        expected_matches[columns].reset_index(drop=True),
+        check_dtype=False,
+    )
+
+    assert np.all([
+        list(indexed_cmes) == [True, True, True, False, False, True],
+        len(full_matches) == len(CMES) * len(HARPS_BBOXES),
+        len(index_matches) < len(full_matches),
+        np.any(index_matches["HARPS_SPAT_CONSIST"].astype(bool)),
+        np.any(~index_matches["HARPS_SPAT_CONSIST"].astype(bool)),
+        ])